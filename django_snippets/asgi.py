@@ -0,0 +1,18 @@
+"""
+ASGI config for django_snippets project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Set SNIPPETS_ASYNC_VIEWS = True in the settings to route the snippet
+detail, download and raw views and the feeds to their async variants.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_snippets.settings")
+
+application = get_asgi_application()
@@ -9,5 +9,6 @@ urlpatterns = [
     path('languages/', include('snippets.urls.languages',
                                namespace='languages')),
     path('popular/', include('snippets.urls.popular', namespace='popular')),
+    path('tags/', include('snippets.urls.tags', namespace='tags')),
     path('', include('snippets.urls.snippets', namespace='snippets')),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from snippets.models import Language, Snippet, SnippetFlag
+from snippets import search
+from snippets.models import Language, Snippet, SnippetFlag, Tag
 
 
 @admin.register(Language)
@@ -12,16 +13,35 @@ class SnippetAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'pub_date']
     list_filter = ['language', 'pub_date']
     date_hierarchy = 'pub_date'
-    search_fields = ['author__username', 'title', 'description', 'code']
+    # The code is stored compressed, so LIKE can't search it; the
+    # full-text index covers it where there is one
+    search_fields = ['author__username', 'title', 'description']
     raw_id_fields = ['author']
 
+    def get_search_results(self, request, queryset, search_term):
+        # Add the full-text matches, which cover the code, to the
+        # search_fields ones
+        results, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term)
+        if search_term and search.is_available():
+            ids = search.search_ids(search_term, limit=None)
+            results |= queryset.filter(pk__in=ids)
+        return results, may_have_duplicates
+
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name', 'snippet_count']
+    search_fields = ['name']
+    readonly_fields = ['snippet_count']
+
 
 @admin.register(SnippetFlag)
 class SnippetFlagAdmin(admin.ModelAdmin):
-    list_display = ['snippet', 'flag']
+    list_display = ['snippet', 'flag', 'duplicate_of']
     list_filter = ['flag']
     actions = ['remove_and_ban']
-    raw_id_fields = ['snippet', 'user']
+    raw_id_fields = ['snippet', 'user', 'duplicate_of']
 
     def remove_and_ban(self, request, queryset):
         for obj in queryset:
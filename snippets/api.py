@@ -0,0 +1,180 @@
+"""
+Serialization for the read-only JSON API.
+
+Rows are read with ``.values()`` limited to the columns the requested
+fields need, so ``?fields=id,title`` never loads ``code`` or
+``highlighted_code``, and no model instances are built. Responses are
+written out row by row through a StreamingHttpResponse.
+"""
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from .models import SnippetTag
+
+MAX_BULK_IDS = getattr(settings, 'SNIPPETS_API_MAX_BULK_IDS', 500)
+STREAM_CHUNK_SIZE = 200
+
+
+class FieldError(ValueError):
+    pass
+
+
+# columns: what .values() reads for the field. get: builds the value from
+# those columns, in order; without it the one column is the value. Tags
+# take an extra query per chunk of rows instead.
+Field = namedtuple('Field', ['columns', 'get'], defaults=[None])
+
+
+def _url(name):
+    return Field(['id'], lambda pk: reverse(name, args=[pk]))
+
+
+SNIPPET_FIELDS = {
+    'id': Field(['id']),
+    'url': _url('snippets:detail'),
+    'title': Field(['title']),
+    'language': Field(['language__slug']),
+    'author': Field(['author__username']),
+    'description': Field(['description']),
+    'description_html': Field(['description_html']),
+    'code': Field(['code']),
+    'highlighted_code': Field(['highlighted_code']),
+    'tags': Field(['id']),
+    'pub_date': Field(['pub_date']),
+    'updated_date': Field(['updated_date']),
+    'score': Field(['score']),
+    'rating_count': Field(['rating_count']),
+    'bookmark_count': Field(['bookmark_count']),
+    'wilson_score': Field(['wilson_score']),
+    'hot_score': Field(['hot_score']),
+}
+SNIPPET_LIST_FIELDS = ['id', 'url', 'title', 'language', 'author', 'pub_date',
+                       'score', 'bookmark_count']
+
+LANGUAGE_FIELDS = {
+    'id': Field(['id']),
+    'url': Field(['slug'], lambda slug: reverse('languages:detail',
+                                                args=[slug])),
+    'name': Field(['name']),
+    'slug': Field(['slug']),
+    'language_code': Field(['language_code']),
+    'file_extension': Field(['file_extension']),
+    'mime_type': Field(['mime_type']),
+}
+
+USER_FIELDS = {
+    'id': Field(['id']),
+    'username': Field(['username']),
+}
+
+TAG_FIELDS = {
+    'name': Field(['name']),
+    'url': Field(['name'], lambda name: reverse('tags:detail', args=[name])),
+    'snippet_count': Field(['snippet_count']),
+}
+
+
+def parse_fields(request, available, default=None):
+    """ The fields asked for with ``?fields=a,b``, or the defaults. """
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default or available)
+    names = list(dict.fromkeys(name for name in raw.split(',') if name))
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise FieldError(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def columns(fields, available, prefix='', extra=()):
+    """ The .values() columns needed for the fields, plus ``extra``. """
+    needed = dict.fromkeys(extra)
+    for name in fields:
+        needed.update(dict.fromkeys(
+            prefix + column for column in available[name].columns))
+    return list(needed)
+
+
+def serialize(row, fields, available, prefix='', tags=None):
+    data = {}
+    for name in fields:
+        if name == 'tags':
+            data[name] = tags.get(row[prefix + 'id'], [])
+            continue
+        field = available[name]
+        values = [row[prefix + column] for column in field.columns]
+        data[name] = field.get(*values) if field.get else values[0]
+    return data
+
+
+def _tags_of(snippet_ids):
+    tags = {}
+    for snippet_id, name in SnippetTag.objects.filter(
+            snippet__in=snippet_ids).order_by('tag__name').values_list(
+            'snippet', 'tag__name'):
+        tags.setdefault(snippet_id, []).append(name)
+    return tags
+
+
+def serialize_snippets(rows, fields, prefix='', chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Lazily serialize snippet rows, fetching the tags of each chunk of rows
+    in one query when they are asked for.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _serialize_chunk(chunk, fields, prefix)
+            chunk = []
+    yield from _serialize_chunk(chunk, fields, prefix)
+
+
+def _serialize_chunk(rows, fields, prefix):
+    tags = None
+    if 'tags' in fields:
+        tags = _tags_of([row[prefix + 'id'] for row in rows])
+    for row in rows:
+        yield serialize(row, fields, SNIPPET_FIELDS, prefix, tags)
+
+
+def stream(results, **extra):
+    """
+    Stream ``{"results": [...], **extra}`` as JSON, encoding one result at
+    a time.
+    """
+    def chunks():
+        yield '{"results": ['
+        for position, result in enumerate(results):
+            yield (',' if position else '') + json.dumps(
+                result, cls=DjangoJSONEncoder)
+        yield ']'
+        for key, value in extra.items():
+            yield f', {json.dumps(key)}: ' + json.dumps(
+                value, cls=DjangoJSONEncoder)
+        yield '}'
+    return StreamingHttpResponse(chunks(), content_type='application/json')
+
+
+def page_links(request, page):
+    """ The next and previous URLs of a KeysetPage, keeping the other query
+    parameters. """
+    links = {}
+    for name, cursor in (('next', page.next_cursor),
+                         ('previous', page.previous_cursor)):
+        if cursor is None:
+            links[name] = None
+            continue
+        query = request.GET.copy()
+        query['cursor'] = cursor
+        links[name] = f'{request.path}?{query.urlencode()}'
+    return links
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
@@ -0,0 +1,255 @@
+"""
+Micro-benchmarks for the models, managers, template tags and feeds, run
+against whatever the database holds (see ``manage.py seed_bench``) by
+``manage.py run_benchmarks``.
+
+Each benchmark is a function taking a Fixtures and returning the callable
+to time. Benchmarks that write run inside a transaction that is rolled
+back, so the data stays the same from one run to the next.
+"""
+import time
+from functools import cached_property
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count
+from django.template import Context, Template
+from django.test import RequestFactory
+
+from . import feeds, highlighting, queries, tokens
+from .models import Bookmark, Language, Rating, Snippet, Tag
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def rolled_back(func):
+    def run():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+    return run
+
+
+class Fixtures:
+    """ Typical rows to benchmark with: the busiest author, language and
+    tag, and a page of the latest snippets. """
+
+    @cached_property
+    def snippet(self):
+        return Snippet.objects.select_related('language').with_text(
+        ).order_by('-bookmark_count', 'pk').first()
+
+    @cached_property
+    def page(self):
+        return list(Snippet.objects.select_related('author')[:20])
+
+    @cached_property
+    def user(self):
+        return get_user_model().objects.annotate(
+            ratings=Count('rating')).order_by('-ratings', 'pk').first()
+
+    @cached_property
+    def author(self):
+        return Snippet.objects.top_authors()[0]
+
+    @cached_property
+    def language(self):
+        return Language.objects.top_languages()[0]
+
+    @cached_property
+    def tags(self):
+        return list(Tag.objects.top_tags()[:2])
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return request
+
+
+@benchmark('snippet.save')
+def snippet_save(fixtures):
+    snippet = fixtures.snippet
+    code = snippet.code
+
+    def save():
+        # Change the code every time, so the save re-renders and
+        # re-indexes it
+        snippet.code = code + '\n' if snippet.code == code else code
+        snippet.save()
+    return rolled_back(save)
+
+
+@benchmark('snippet.highlight')
+def snippet_highlight(fixtures):
+    return fixtures.snippet.highlight
+
+
+@benchmark('snippet.highlight_uncached')
+def snippet_highlight_uncached(fixtures):
+    snippet = fixtures.snippet
+    return lambda: highlighting.render(
+        snippet.code, snippet.language.language_code)
+
+
+@benchmark('tokens.render_ansi')
+def tokens_render_ansi(fixtures):
+    # Measured from the stored stream, which reading never writes
+    tokens.store(fixtures.snippet)
+    return lambda: tokens.render(tokens.tokens_of(fixtures.snippet), 'ansi')
+
+
+@benchmark('tokens.render_ansi_relexed')
+def tokens_render_ansi_relexed(fixtures):
+    snippet = fixtures.snippet
+    return lambda: tokens.render(
+        tokens.lex(snippet.code, snippet.language.language_code), 'ansi')
+
+
+@benchmark('snippet.get_score')
+def snippet_get_score(fixtures):
+    return lambda: [snippet.get_score() for snippet in fixtures.page]
+
+
+@benchmark('snippets.top_authors')
+def top_authors(fixtures):
+    return lambda: list(Snippet.objects.top_authors())
+
+
+@benchmark('snippets.most_bookmarked')
+def most_bookmarked(fixtures):
+    return lambda: list(Snippet.objects.most_bookmarked())
+
+
+@benchmark('snippets.top_rated')
+def top_rated(fixtures):
+    return lambda: list(Snippet.objects.top_rated()[:20])
+
+
+@benchmark('snippets.top_rated_hot')
+def top_rated_hot(fixtures):
+    return lambda: list(Snippet.objects.top_rated('hot')[:20])
+
+
+@benchmark('snippets.tagged')
+def tagged(fixtures):
+    return lambda: list(Snippet.objects.tagged(fixtures.tags)[:20])
+
+
+@benchmark('snippets.add_bookmarks')
+def add_bookmarks(fixtures):
+    return rolled_back(
+        lambda: Snippet.objects.add_bookmarks(fixtures.snippet.pk))
+
+
+@benchmark('ratings.rate')
+def rate(fixtures):
+    return rolled_back(lambda: Rating.objects.rate(
+        fixtures.snippet.pk, fixtures.user.pk, Rating.RATING_DOWN))
+
+
+@benchmark('bookmarks.add')
+def bookmark_add(fixtures):
+    return rolled_back(
+        lambda: Bookmark.objects.add(fixtures.snippet.pk, fixtures.user.pk))
+
+
+@benchmark('snippets.rerank')
+def rerank(fixtures):
+    return rolled_back(lambda: Snippet.objects.rerank(
+        [snippet.pk for snippet in fixtures.page]))
+
+
+@benchmark('languages.top_languages')
+def top_languages(fixtures):
+    return lambda: list(Language.objects.top_languages())
+
+
+def _template_tag(source, fixtures):
+    template = Template('{% load snippets %}{% load_viewer_state user page %}'
+                        '{% for snippet in page %}' + source + '{% endfor %}')
+
+    def render():
+        template.render(Context({'user': fixtures.user,
+                                 'page': fixtures.page}))
+    return render
+
+
+@benchmark('templatetags.if_bookmarked')
+def if_bookmarked(fixtures):
+    return _template_tag('{% if_bookmarked user snippet %}b'
+                         '{% endif_bookmarked %}', fixtures)
+
+
+@benchmark('templatetags.if_rated')
+def if_rated(fixtures):
+    return _template_tag('{% if_rated user snippet %}r{% endif_rated %}',
+                         fixtures)
+
+
+@benchmark('templatetags.get_rating')
+def get_rating(fixtures):
+    return _template_tag('{% get_rating user snippet as rating %}{{ rating }}',
+                         fixtures)
+
+
+def _feed(feed, fixtures, obj):
+    def build():
+        feed.get_feed(obj, fixtures.request()).writeString('utf-8')
+    return build
+
+
+@benchmark('feeds.latest')
+def latest_feed(fixtures):
+    return _feed(feeds.LatestSnippetsFeed(), fixtures, None)
+
+
+@benchmark('feeds.author')
+def author_feed(fixtures):
+    return _feed(feeds.SnippetsByAuthorFeed(), fixtures, fixtures.author)
+
+
+@benchmark('feeds.language')
+def language_feed(fixtures):
+    return _feed(feeds.SnippetsByLanguageFeed(), fixtures, fixtures.language)
+
+
+@benchmark('feeds.tag')
+def tag_feed(fixtures):
+    return _feed(feeds.SnippetsByTagFeed(), fixtures, fixtures.tags[0])
+
+
+def run(names=None, repeat=20):
+    """
+    Time the named benchmarks (all by default). Returns {name: {"min",
+    "median", "mean" (seconds), "queries"}}.
+    """
+    fixtures = Fixtures()
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        func = setup(fixtures)
+        # Warm up, loading the fixtures, before counting queries
+        func()
+        with queries.record_queries() as recorder:
+            func()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        results[name] = {
+            'min': timings[0],
+            'median': timings[len(timings) // 2],
+            'mean': sum(timings) / len(timings),
+            'queries': recorder.count,
+        }
+    return results
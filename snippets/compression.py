@@ -0,0 +1,54 @@
+"""
+Precompressed response bodies for large snippets.
+
+Bodies are compressed once per distinct code (keyed by Snippet.code_hash)
+and kept in the cache, so mirrors and editor plugins refetching a big
+snippet cost a cache read instead of a compression pass. Brotli is used
+when the optional ``brotli`` package is installed, gzip otherwise.
+"""
+import gzip
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PRECOMPRESS_MIN_SIZE = getattr(settings, 'SNIPPETS_PRECOMPRESS_MIN_SIZE', 4096)
+PRECOMPRESS_CACHE_TIMEOUT = getattr(
+    settings, 'SNIPPETS_PRECOMPRESS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Preferred first
+ENCODERS = [('gzip', lambda data: gzip.compress(data, compresslevel=9))]
+if brotli is not None:
+    ENCODERS.insert(0, ('br', lambda data: brotli.compress(data)))
+
+
+def accepted_encoding(request):
+    """ Return the best encoding the client accepts, or None. """
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')}
+    for encoding, _ in ENCODERS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def cache_key(code_hash, encoding):
+    return f'snippets:compressed:{encoding}:{code_hash}'
+
+
+def get_compressed(code_hash, encoding):
+    """ Return the cached compressed body, or None. """
+    return cache.get(cache_key(code_hash, encoding))
+
+
+def compress(code, code_hash, encoding):
+    """ Compress the code with ``encoding`` and cache the result. """
+    encoder = dict(ENCODERS)[encoding]
+    body = encoder(code.encode('utf-8'))
+    cache.set(cache_key(code_hash, encoding), body, PRECOMPRESS_CACHE_TIMEOUT)
+    return body
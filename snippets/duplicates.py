@@ -0,0 +1,199 @@
+"""
+Exact and near-duplicate detection for submitted code.
+
+Exact duplicates share a ``code_hash``. For near duplicates the lexed
+code is normalized (identifiers, strings and numbers each collapse to
+one placeholder, whitespace and comments go), runs of SHINGLE_SIZE tokens
+are hashed, and winnowing keeps the smallest hash of every WINDOW
+consecutive ones. The tokens are the ones the code was highlighted from,
+so the code is never lexed for this alone. Those fingerprints are stored
+in CodeFingerprint, so a submission is checked with indexed lookups: the
+snippet sharing the largest share of its fingerprints is its closest
+duplicate. Fingerprints most snippets share say nothing and are skipped.
+
+With ``SNIPPETS_NEAR_DUPLICATE_ACTION`` set to 'flag' (the default) near
+duplicates are saved and flagged for moderators; with 'reject' they are
+refused like exact ones.
+"""
+import hashlib
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from pygments.token import Comment, Name, Number, String, Text
+
+from . import tokens
+from .models import CodeFingerprint, Snippet, SnippetFlag
+
+NEAR_DUPLICATE_THRESHOLD = getattr(
+    settings, 'SNIPPETS_NEAR_DUPLICATE_THRESHOLD', 0.8)
+NEAR_DUPLICATE_ACTION = getattr(
+    settings, 'SNIPPETS_NEAR_DUPLICATE_ACTION', 'flag')
+SHINGLE_SIZE = 5
+WINDOW = 4
+# Shorter code is too generic to call a near duplicate of anything
+MIN_TOKENS = 20
+# Fingerprints looked up per check; the smallest hashes are a stable sample
+MAX_LOOKUP = 500
+# Fingerprints held by more snippets are boilerplate, left out of checks
+MAX_SHARED = getattr(settings, 'SNIPPETS_DUPLICATE_MAX_SHARED', 50)
+# Fingerprints per lookup query, within SQLite's parameter limit
+LOOKUP_CHUNK = 2000
+
+Duplicate = namedtuple('Duplicate', ['snippet_id', 'similarity', 'exact'])
+
+
+def normalized_tokens(stream):
+    """ The normalized tokens of lexed code, a list of (token type,
+    value) pairs. """
+    tokens = []
+    for ttype, value in stream:
+        if ttype in Comment or ttype in Text or not value.strip():
+            continue
+        if ttype in Name:
+            tokens.append('N')
+        elif ttype in String:
+            tokens.append('S')
+        elif ttype in Number:
+            tokens.append('0')
+        else:
+            tokens.append(value)
+    return tokens
+
+
+def _hash(shingle):
+    digest = hashlib.blake2b(
+        '\x1f'.join(shingle).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def fingerprints(stream):
+    """ The winnowed shingle hashes of lexed code, empty for short code.
+    """
+    tokens = normalized_tokens(stream)
+    if len(tokens) < MIN_TOKENS:
+        return set()
+    hashes = [_hash(tokens[i:i + SHINGLE_SIZE])
+              for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+    return {min(hashes[i:i + WINDOW])
+            for i in range(max(1, len(hashes) - WINDOW + 1))}
+
+
+def _holders(wanted, exclude):
+    """
+    Return ({fingerprint: [snippet pks]}, common fingerprints) for the
+    wanted fingerprints. Those held by more than MAX_SHARED snippets are
+    boilerplate; they are set apart rather than fetched, which keeps the
+    rows read bounded whatever the table holds.
+    """
+    holders, common = defaultdict(list), set()
+    wanted = sorted(wanted)
+    for start in range(0, len(wanted), LOOKUP_CHUNK):
+        chunk = wanted[start:start + LOOKUP_CHUNK]
+        matches = CodeFingerprint.objects.filter(fingerprint__in=chunk)
+        common.update(matches.values('fingerprint').annotate(
+            holders=Count('pk')).filter(
+            holders__gt=MAX_SHARED).values_list('fingerprint', flat=True))
+        rare = matches.exclude(snippet__in=exclude).exclude(
+            fingerprint__in=[fp for fp in chunk if fp in common])
+        for fingerprint, snippet_id in rare.values_list(
+                'fingerprint', 'snippet'):
+            holders[fingerprint].append(snippet_id)
+    return holders, common
+
+
+def find_duplicates(codes, exclude=()):
+    """
+    For each (code_hash, fingerprints) pair, return the Duplicate
+    closest to that code, or None: a snippet with the same code_hash
+    (unless it is None), or else the one sharing the largest share of
+    the fingerprints, if at NEAR_DUPLICATE_THRESHOLD or above. Snippets
+    in ``exclude`` never match. A whole batch is checked in one query
+    for exact duplicates and two per LOOKUP_CHUNK fingerprints for near
+    ones.
+    """
+    found = [None] * len(codes)
+    hashes = {code_hash for code_hash, _ in codes if code_hash is not None}
+    if hashes:
+        exact = dict(Snippet.objects.filter(code_hash__in=hashes).exclude(
+            pk__in=exclude).values_list('code_hash', 'pk'))
+        for i, (code_hash, _) in enumerate(codes):
+            if code_hash in exact:
+                found[i] = Duplicate(exact[code_hash], 1.0, True)
+
+    # The smallest hashes are a stable sample of each code's fingerprints
+    samples = {i: sorted(prints)[:MAX_LOOKUP]
+               for i, (_, prints) in enumerate(codes)
+               if found[i] is None and prints}
+    if not samples:
+        return found
+    holders, common = _holders(set().union(*samples.values()), exclude)
+    for i, sample in samples.items():
+        telling = len(sample) - sum(fp in common for fp in sample)
+        shared = Counter(snippet_id for fp in sample
+                         for snippet_id in holders.get(fp, ()))
+        if not telling or not shared:
+            continue
+        snippet_id, count = min(shared.items(),
+                                key=lambda item: (-item[1], item[0]))
+        if count / telling >= NEAR_DUPLICATE_THRESHOLD:
+            found[i] = Duplicate(snippet_id, count / telling, False)
+    return found
+
+
+def find_duplicate(code, language_code, exclude=None):
+    """
+    Return the Duplicate closest to the code, if an exact duplicate or a
+    near one at NEAR_DUPLICATE_THRESHOLD or above exists. ``exclude`` is
+    the primary key of the snippet being edited.
+    """
+    return find_duplicates(
+        [(Snippet.hash_code(code),
+          fingerprints(tokens.lex(code, language_code)))],
+        () if exclude is None else [exclude])[0]
+
+
+def flag(snippet_id, duplicate):
+    """ Flag a saved snippet as a near duplicate for moderators, once. """
+    return SnippetFlag.objects.get_or_create(
+        snippet_id=snippet_id, flag=SnippetFlag.FLAG_DUPLICATE, user=None,
+        defaults={'duplicate_of_id': duplicate.snippet_id})[0]
+
+
+def index_snippets(prints):
+    """ Store the fingerprints of snippets, given as {pk: fingerprints},
+    replacing any they had. """
+    with transaction.atomic():
+        CodeFingerprint.objects.filter(snippet__in=list(prints)).delete()
+        CodeFingerprint.objects.bulk_create(
+            [CodeFingerprint(snippet_id=pk, fingerprint=fingerprint)
+             for pk, found in prints.items() for fingerprint in found],
+            batch_size=1000)
+
+
+def check_snippets(prints):
+    """ Flag the snippets, given as {pk: fingerprints}, that are near
+    duplicates of others, for moderators. """
+    found = find_duplicates([(None, prints[pk]) for pk in prints],
+                            exclude=list(prints))
+    for pk, duplicate in zip(prints, found):
+        if duplicate:
+            flag(pk, duplicate)
+
+
+def rebuild(chunk_size=500):
+    """ Fingerprint every snippet, from its stored token stream when it
+    has a current one. Yields the number done after each chunk. """
+    snippets = Snippet.objects.select_related('language').only(
+        'code', 'code_hash', 'language',
+        'language__language_code').order_by('pk')
+    done, last = 0, 0
+    while True:
+        chunk = list(snippets.filter(pk__gt=last)[:chunk_size])
+        if not chunk:
+            break
+        index_snippets({pk: fingerprints(stream) for pk, stream in
+                        tokens.streams_of(chunk).items()})
+        last, done = chunk[-1].pk, done + len(chunk)
+        yield done
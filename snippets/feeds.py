@@ -1,21 +1,97 @@
+import hashlib
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Max
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, quote_etag
 from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date
 
-from .models import Language, Snippet
+from .models import Language, Snippet, Tag
 
 SITE_NAME = getattr(settings, 'SITE_NAME', None)
+FEED_CACHE_TIMEOUT = getattr(settings, 'SNIPPETS_FEED_CACHE_TIMEOUT', 60 * 60)
+FEED_SCHEMES = ('http', 'https')
+
+
+def feed_cache_key(name, pk, scheme):
+    return f'snippets:feed:{name}:{pk}:{scheme}'
+
 
+def invalidate_feeds(author_ids=(), language_ids=(), tag_ids=()):
+    """ Drop the cached feeds a saved or deleted snippet appears in. """
+    scopes = [('latest', None)]
+    scopes += [('author', pk) for pk in author_ids]
+    scopes += [('language', pk) for pk in language_ids]
+    scopes += [('tag', pk) for pk in tag_ids]
+    cache.delete_many([feed_cache_key(name, pk, scheme)
+                       for name, pk in scopes for scheme in FEED_SCHEMES])
 
-class LatestSnippetsFeed(Feed):
+
+class CachedFeed(Feed):
+    """
+    A Feed whose rendered XML is cached per feed object and served with
+    ETag and Last-Modified validators, so polling readers mostly get a 304
+    without the feed being rebuilt.
+
+    Subclasses set ``cache_name`` and implement ``scope(obj)``, the
+    queryset of snippets the feed covers.
+    """
+    cache_name = None
+
+    def scope(self, obj):
+        raise NotImplementedError
+
+    def items(self, obj=None):
+        # Entries show the description's HTML, never the code
+        return self.scope(obj).select_related('author').with_text().defer(
+            'code', 'highlighted_code')[:15]
+
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404("Feed object does not exist.")
+        key = feed_cache_key(
+            self.cache_name, getattr(obj, 'pk', None), request.scheme)
+        cached = cache.get(key)
+        if cached is None:
+            feedgen = self.get_feed(obj, request)
+            content = feedgen.writeString('utf-8').encode('utf-8')
+            latest = self.scope(obj).aggregate(
+                latest=Max('updated_date'))['latest']
+            cached = {
+                'content': content,
+                'content_type': feedgen.content_type,
+                'etag': quote_etag(hashlib.md5(content).hexdigest()),
+                'last_modified': latest.timestamp() if latest else None,
+            }
+            cache.set(key, cached, FEED_CACHE_TIMEOUT)
+
+        response = HttpResponse(
+            cached['content'], content_type=cached['content_type'])
+        response.headers['ETag'] = cached['etag']
+        if cached['last_modified'] is not None:
+            response.headers['Last-Modified'] = http_date(
+                cached['last_modified'])
+        return get_conditional_response(
+            request, etag=cached['etag'],
+            last_modified=cached['last_modified'], response=response)
+
+
+class LatestSnippetsFeed(CachedFeed):
     """
     Feed of the most recently published Snippets.
     """
+    cache_name = 'latest'
     feed_type = Atom1Feed
-    title_template = 'snippets/feeds/title.html'
-    description_template = 'snippets/feeds/description.html'
+    title_template = 'feeds/title.html'
+    description_template = 'feeds/description.html'
     item_copyright = 'Freely redistributable'
     link = "/snippets/"
     description = "Latest snippets"
@@ -30,8 +106,8 @@ class LatestSnippetsFeed(Feed):
     def item_author_name(self, item):
         return item.author.username
 
-    def items(self):
-        return Snippet.objects.all()[:15]
+    def scope(self, obj):
+        return Snippet.objects.all()
 
     def item_link(self, item):
         return item.get_absolute_url()
@@ -40,13 +116,14 @@ class LatestSnippetsFeed(Feed):
         return item.pub_date
 
 
-class SnippetsByAuthorFeed(Feed):
+class SnippetsByAuthorFeed(CachedFeed):
     """
     Feed of the most recent Snippets by a given author.
     """
+    cache_name = 'author'
     feed_type = Atom1Feed
-    title_template = 'snippets/feeds/title.html'
-    description_template = 'snippets/feeds/description.html'
+    title_template = 'feeds/title.html'
+    description_template = 'feeds/description.html'
     item_copyright = 'Freely redistributable'
 
     def author_name(self, obj):
@@ -55,8 +132,8 @@ class SnippetsByAuthorFeed(Feed):
     def get_object(self, request, username=None):
         return get_object_or_404(User, username__exact=username)
 
-    def items(self, obj):
-        return Snippet.objects.filter(author=obj)[:15]
+    def scope(self, obj):
+        return Snippet.objects.filter(author=obj)
 
     def link(self, obj):
         return f"/users/{obj.username}/"
@@ -77,20 +154,21 @@ class SnippetsByAuthorFeed(Feed):
         return item.pub_date
 
 
-class SnippetsByLanguageFeed(Feed):
+class SnippetsByLanguageFeed(CachedFeed):
     """
     Feed of the most recent Snippets in a given language.
     """
+    cache_name = 'language'
     feed_type = Atom1Feed
-    title_template = 'snippets/feeds/title.html'
-    description_template = 'snippets/feeds/description.html'
+    title_template = 'feeds/title.html'
+    description_template = 'feeds/description.html'
     item_copyright = 'Freely redistributable'
 
     def get_object(self, request, slug=None):
         return get_object_or_404(Language, slug__exact=slug)
 
-    def items(self, obj):
-        return Snippet.objects.filter(language=obj)[:15]
+    def scope(self, obj):
+        return Snippet.objects.filter(language=obj)
 
     def link(self, obj):
         return obj.get_absolute_url()
@@ -109,3 +187,38 @@ class SnippetsByLanguageFeed(Feed):
 
     def item_pubdate(self, item):
         return item.pub_date
+
+
+class SnippetsByTagFeed(CachedFeed):
+    """
+    Feed of the most recent Snippets carrying a given tag.
+    """
+    cache_name = 'tag'
+    feed_type = Atom1Feed
+    title_template = 'feeds/title.html'
+    description_template = 'feeds/description.html'
+    item_copyright = 'Freely redistributable'
+
+    def get_object(self, request, name=None):
+        return get_object_or_404(Tag, name__exact=name)
+
+    def scope(self, obj):
+        return Snippet.objects.filter(tags=obj)
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def title(self, obj):
+        if SITE_NAME:
+            return f"{SITE_NAME}: Latest snippets tagged {obj.name}"
+        else:
+            return f"Latest snippets tagged {obj.name}"
+
+    def item_author_name(self, item):
+        return item.author.username
+
+    def item_link(self, item):
+        return item.get_absolute_url()
+
+    def item_pubdate(self, item):
+        return item.pub_date
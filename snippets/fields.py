@@ -0,0 +1,56 @@
+"""
+Model fields.
+
+``CompressedTextField`` holds text in a binary column, zlib-compressed
+once its UTF-8 encoding reaches ``SNIPPETS_COMPRESS_MIN_LENGTH`` bytes and
+the compressed form is actually smaller. Shorter values are stored as
+plain UTF-8. A compressed value starts with a 0xFF byte, which never
+occurs in UTF-8, so the two can't be confused. Text values written before
+the column was converted are returned as they are.
+
+Only exact lookups work on these fields: the database sees bytes, so
+``icontains`` and friends don't match compressed values.
+"""
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+COMPRESS_MIN_LENGTH = getattr(settings, 'SNIPPETS_COMPRESS_MIN_LENGTH', 512)
+COMPRESS_LEVEL = 6
+
+_COMPRESSED = b'\xff'
+
+
+def compress(text, min_length=None):
+    data = text.encode('utf-8')
+    if len(data) < (COMPRESS_MIN_LENGTH if min_length is None
+                    else min_length):
+        return data
+    compressed = _COMPRESSED + zlib.compress(data, COMPRESS_LEVEL)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress(data):
+    data = bytes(data)
+    if data[:1] == _COMPRESSED:
+        data = zlib.decompress(data[1:])
+    return data.decode('utf-8')
+
+
+class CompressedTextField(models.TextField):
+    """ A TextField stored compressed in a binary column. """
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            value = connection.Database.Binary(compress(value))
+        return value
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress(value)
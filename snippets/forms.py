@@ -1,16 +1,80 @@
 from django import forms
 from django.contrib.auth import get_user_model
+from django.utils.html import format_html
+from django.utils.text import slugify
 
-from .models import Snippet, SnippetFlag
+from . import duplicates, tokens
+from .models import Snippet, SnippetFlag, Tag
 
 User = get_user_model()
 
 
 class SnippetForm(forms.ModelForm):
+    tags = forms.CharField(
+        max_length=255, required=False,
+        help_text="Separate tags with spaces.")
+
     class Meta:
         model = Snippet
         fields = ['title', 'description', 'code', 'language']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial.setdefault('tags', ' '.join(
+                tag.name for tag in self.instance.tags.all()))
+
+    def clean_tags(self):
+        names = []
+        for word in self.cleaned_data['tags'].split():
+            name = slugify(word)[:50]
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    def clean(self):
+        cleaned_data = super().clean()
+        code, language = cleaned_data.get('code'), cleaned_data.get('language')
+        if code and language:
+            # Near duplicates are only looked for here when they are
+            # rejected; otherwise they are flagged once the snippet is
+            # saved, from the tokens it is highlighted from
+            prints = set()
+            if duplicates.NEAR_DUPLICATE_ACTION == 'reject':
+                stream = tokens.lex(code, language.language_code)
+                prints = duplicates.fingerprints(stream)
+                # Handed to save(), which would lex the code again
+                self.instance._lexed = (code, language.language_code, stream)
+            duplicate = duplicates.find_duplicates(
+                [(Snippet.hash_code(code), prints)],
+                exclude=[self.instance.pk] if self.instance.pk else [])[0]
+            if duplicate:
+                original = Snippet.objects.get(pk=duplicate.snippet_id)
+                raise forms.ValidationError(format_html(
+                    'This code has already been posted as '
+                    '<a href="{}">{}</a>.',
+                    original.get_absolute_url(), original.title))
+        return cleaned_data
+
+    def save(self, commit=True):
+        """ Save the snippet, then its tags; with commit=False, those are
+        saved by save_m2m(). """
+        snippet = super().save(commit)
+        if commit:
+            self.save_tags()
+        else:
+            save_m2m = self.save_m2m
+
+            def save_all_m2m():
+                save_m2m()
+                self.save_tags()
+            self.save_m2m = save_all_m2m
+        return snippet
+
+    def save_tags(self):
+        self.instance.tags.set(Tag.objects.for_names(
+            self.cleaned_data['tags']))
+
 
 class SnippetFlagForm(forms.ModelForm):
     class Meta:
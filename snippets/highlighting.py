@@ -0,0 +1,165 @@
+"""
+Syntax highlighting with a content-addressed cache.
+
+Highlighted HTML is keyed by a hash of the code, the Pygments lexer name,
+the formatter options and the Pygments version, so identical code (forks,
+reposts, saves that only touch the title) is lexed once. Lookups go through
+an in-process LRU first and the ``HighlightCache`` table second.
+
+Renderings of code that was since edited, or made under an older Pygments
+or other formatter options, are never read again; ``prune()`` deletes
+them, along with any not read for a while.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+import pygments
+from django.conf import settings
+from django.utils import timezone
+from pygments import format as pygments_format
+from pygments import highlight as pygments_highlight
+from pygments import lexers
+from pygments.formatters import HtmlFormatter
+
+FORMATTER_OPTIONS = {'linenos': True}
+CACHE_SIZE = getattr(settings, 'SNIPPETS_HIGHLIGHT_CACHE_SIZE', 256)
+# A table row's last_used is refreshed at most this often, so reads
+# rarely write
+TOUCH_INTERVAL = timedelta(days=1)
+PRUNE_CHUNK = 500
+
+CacheInfo = namedtuple(
+    'CacheInfo', ['hits', 'db_hits', 'misses', 'currsize', 'maxsize'])
+
+_formatter = HtmlFormatter(**FORMATTER_OPTIONS)
+_lock = threading.Lock()
+_lru = OrderedDict()
+_stats = {'hits': 0, 'db_hits': 0, 'misses': 0}
+
+
+@lru_cache(maxsize=None)
+def get_lexer(language_code):
+    """ Return a (shared) Pygments lexer for a language code. """
+    return lexers.get_lexer_by_name(language_code)
+
+
+def cache_key(code, language_code):
+    material = json.dumps(
+        [code, language_code, FORMATTER_OPTIONS, pygments.__version__],
+        sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def render(code, language_code, tokens=None):
+    """ Highlight code without consulting any cache, formatting the given
+    tokens of it if it has been lexed already. """
+    if tokens is not None:
+        return pygments_format(tokens, _formatter)
+    return pygments_highlight(code, get_lexer(language_code), _formatter)
+
+
+def highlight(code, language_code, tokens=None):
+    """ Return highlighted HTML for the code, from cache when possible. """
+    from .models import HighlightCache
+
+    key = cache_key(code, language_code)
+    with _lock:
+        html = _lru.get(key)
+        if html is not None:
+            _lru.move_to_end(key)
+            _stats['hits'] += 1
+            return html
+
+    row = HighlightCache.objects.filter(key=key).values_list(
+        'html', 'last_used').first()
+    if row is not None:
+        html, last_used = row
+        now = timezone.now()
+        if last_used < now - TOUCH_INTERVAL:
+            HighlightCache.objects.filter(key=key).update(last_used=now)
+        _remember(key, html, 'db_hits')
+    else:
+        html = render(code, language_code, tokens)
+        HighlightCache.objects.bulk_create(
+            [HighlightCache(key=key, html=html)], ignore_conflicts=True)
+        _remember(key, html, 'misses')
+    return html
+
+
+def store(code, language_code, html):
+    """ Record HTML rendered elsewhere, e.g. by a render worker. """
+    store_many([(code, language_code, html)])
+
+
+def store_many(renderings):
+    """ Record many (code, language_code, html) renderings at once. """
+    from .models import HighlightCache
+
+    HighlightCache.objects.bulk_create(
+        [HighlightCache(key=cache_key(code, language_code), html=html)
+         for code, language_code, html in renderings],
+        ignore_conflicts=True)
+
+
+def prune(days):
+    """
+    Delete the cached renderings not read in ``days`` days, and those
+    whose key is no snippet's current one: renderings of edited code or
+    of an older Pygments or formatter setup. Renderings made while this
+    runs are kept. Returns the number deleted.
+    """
+    from .models import HighlightCache, Snippet
+
+    started = timezone.now()
+    deleted, _ = HighlightCache.objects.filter(
+        last_used__lt=started - timedelta(days=days)).delete()
+
+    current, last = set(), 0
+    snippets = Snippet.objects.select_related('language').only(
+        'code', 'language', 'language__language_code').order_by('pk')
+    while True:
+        chunk = list(snippets.filter(pk__gt=last)[:PRUNE_CHUNK])
+        if not chunk:
+            break
+        current.update(cache_key(snippet.code, snippet.language.language_code)
+                       for snippet in chunk)
+        last = chunk[-1].pk
+    stale = [key for key in HighlightCache.objects.filter(
+        created__lt=started).values_list('key', flat=True).iterator()
+        if key not in current]
+    for start in range(0, len(stale), PRUNE_CHUNK):
+        count, _ = HighlightCache.objects.filter(
+            key__in=stale[start:start + PRUNE_CHUNK]).delete()
+        deleted += count
+    return deleted
+
+
+def _remember(key, html, outcome):
+    with _lock:
+        _stats[outcome] += 1
+        _lru[key] = html
+        _lru.move_to_end(key)
+        while len(_lru) > CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def cache_info():
+    """
+    Report in-process cache statistics: LRU hits, hits served from the
+    HighlightCache table, misses that had to be lexed, and the LRU size.
+    """
+    with _lock:
+        return CacheInfo(_stats['hits'], _stats['db_hits'], _stats['misses'],
+                         len(_lru), CACHE_SIZE)
+
+
+def cache_clear():
+    """ Empty the in-process LRU and reset its statistics. """
+    with _lock:
+        _lru.clear()
+        for name in _stats:
+            _stats[name] = 0
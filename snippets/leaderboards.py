@@ -0,0 +1,189 @@
+"""
+Incrementally maintained leaderboards for the popular views.
+
+Every snippet or bookmark created or deleted adjusts two things, one
+statement each:
+
+* a per-day LeaderboardBucket count for the object it ranks, and
+* the object's LeaderboardEntry score on each window (all time, 30 days,
+  7 days) the event's day falls in.
+
+The all-time most bookmarked board is the exception: it is read straight
+from Snippet.bookmark_count, the one all-time bookmark counter.
+
+Reading a board is then an ordered index scan over LeaderboardEntry. Events
+never leave a window by themselves, so ``compact()`` (run periodically via
+``manage.py compact_leaderboards``) recomputes the windowed scores from the
+buckets and drops the buckets no window needs any more.
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import pagecache
+from .models import (Bookmark, Language, LeaderboardBucket, LeaderboardEntry,
+                     Snippet)
+
+LEADERBOARD_SIZE = getattr(settings, 'SNIPPETS_LEADERBOARD_SIZE', 20)
+
+WINDOWS = [window for window, _ in LeaderboardEntry.WINDOW_CHOICES]
+LONGEST_WINDOW = max(WINDOWS)
+
+
+def day_of(when):
+    """ The (local) day a snippet or bookmark was created on. """
+    return timezone.localdate(when)
+
+
+def _windows(board, day):
+    """ The windows of a board an event on ``day`` counts towards. """
+    age = (timezone.localdate() - day).days
+    windows = [window for window in WINDOWS
+               if window != LeaderboardEntry.WINDOW_ALL and age < window]
+    if board != LeaderboardEntry.BOARD_BOOKMARKED:
+        windows.append(LeaderboardEntry.WINDOW_ALL)
+    return windows
+
+
+def record(board, object_id, day, delta=1):
+    """ Count ``delta`` events created on ``day`` towards object_id. """
+    with transaction.atomic():
+        LeaderboardBucket.objects.upsert(
+            ['board', 'object_id', 'day'], increment=['count'],
+            board=board, object_id=object_id, day=day, count=delta)
+        LeaderboardEntry.objects.upsert_many(
+            ['board', 'window', 'object_id'],
+            [{'board': board, 'window': window, 'object_id': object_id,
+              'score': delta} for window in _windows(board, day)],
+            increment=['score'])
+
+
+def record_snippets(snippets, delta=1):
+    """ Count newly created (or, with delta=-1, deleted) snippets. """
+    events = Counter()
+    for snippet in snippets:
+        day = day_of(snippet.pub_date)
+        events[LeaderboardEntry.BOARD_AUTHORS, snippet.author_id, day] += 1
+        events[LeaderboardEntry.BOARD_LANGUAGES, snippet.language_id, day] += 1
+    for (board, object_id, day), count in events.items():
+        record(board, object_id, day, count * delta)
+
+
+def forget(board, object_id):
+    """ Remove an object that no longer exists from a board. """
+    LeaderboardEntry.objects.filter(board=board, object_id=object_id).delete()
+    LeaderboardBucket.objects.filter(board=board, object_id=object_id).delete()
+
+
+BOARD_QUERYSETS = {
+    LeaderboardEntry.BOARD_AUTHORS: lambda: get_user_model().objects.all(),
+    LeaderboardEntry.BOARD_LANGUAGES: lambda: Language.objects.all(),
+    LeaderboardEntry.BOARD_BOOKMARKED:
+        lambda: Snippet.objects.listing(),
+}
+
+
+def ranked_ids(board, window=LeaderboardEntry.WINDOW_ALL,
+               limit=LEADERBOARD_SIZE):
+    """ Return the (object_id, score) pairs at the top of a board. """
+    if board == LeaderboardEntry.BOARD_BOOKMARKED and \
+            window == LeaderboardEntry.WINDOW_ALL:
+        return list(
+            Snippet.objects.filter(bookmark_count__gt=0)
+            .order_by('-bookmark_count', 'pk')
+            .values_list('pk', 'bookmark_count')[:limit])
+    return list(
+        LeaderboardEntry.objects.filter(
+            board=board, window=window, score__gt=0)
+        .order_by('-score', 'object_id')
+        .values_list('object_id', 'score')[:limit])
+
+
+def top(board, window=LeaderboardEntry.WINDOW_ALL, limit=LEADERBOARD_SIZE):
+    """
+    Return the top objects of a board, best first, each annotated with its
+    ``leaderboard_score``.
+    """
+    entries = ranked_ids(board, window, limit)
+    objects = BOARD_QUERYSETS[board]().in_bulk(
+        [object_id for object_id, _ in entries])
+    ranked = []
+    for object_id, score in entries:
+        if object_id in objects:
+            obj = objects[object_id]
+            obj.leaderboard_score = score
+            ranked.append(obj)
+    return ranked
+
+
+def _source_counts():
+    """
+    Yield (board, object_id, day, count) for every day an object gained
+    snippets or bookmarks, straight from the source tables.
+    """
+    sources = [
+        (LeaderboardEntry.BOARD_AUTHORS, Snippet.objects, 'author_id',
+         'pub_date'),
+        (LeaderboardEntry.BOARD_LANGUAGES, Snippet.objects, 'language_id',
+         'pub_date'),
+        (LeaderboardEntry.BOARD_BOOKMARKED, Bookmark.objects, 'snippet_id',
+         'date'),
+    ]
+    for board, manager, key, date_field in sources:
+        rows = manager.order_by().annotate(day=TruncDate(date_field)).values(
+            key, 'day').annotate(count=Count('pk'))
+        for row in rows.iterator():
+            yield board, row[key], row['day'], row['count']
+
+
+@transaction.atomic
+def rebuild():
+    """ Recompute every board and bucket from the snippet and bookmark
+    tables. """
+    today = timezone.localdate()
+    totals, buckets = Counter(), []
+    for board, object_id, day, count in _source_counts():
+        if board != LeaderboardEntry.BOARD_BOOKMARKED:
+            totals[board, object_id] += count
+        if (today - day).days < LONGEST_WINDOW:
+            buckets.append(LeaderboardBucket(
+                board=board, object_id=object_id, day=day, count=count))
+    LeaderboardBucket.objects.all().delete()
+    LeaderboardBucket.objects.bulk_create(buckets, batch_size=1000)
+    LeaderboardEntry.objects.filter(
+        window=LeaderboardEntry.WINDOW_ALL).delete()
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(board=board, window=LeaderboardEntry.WINDOW_ALL,
+                          object_id=object_id, score=score)
+         for (board, object_id), score in totals.items()],
+        batch_size=1000)
+    compact(today)
+
+
+@transaction.atomic
+def compact(today=None):
+    """
+    Recompute the windowed scores from the daily buckets and drop buckets
+    older than the longest window.
+    """
+    today = today or timezone.localdate()
+    LeaderboardBucket.objects.filter(
+        day__lte=today - datetime.timedelta(days=LONGEST_WINDOW)).delete()
+    for window in WINDOWS:
+        if window == LeaderboardEntry.WINDOW_ALL:
+            continue
+        scores = LeaderboardBucket.objects.filter(
+            day__gt=today - datetime.timedelta(days=window)).values(
+            'board', 'object_id').annotate(score=Sum('count'))
+        LeaderboardEntry.objects.filter(window=window).delete()
+        LeaderboardEntry.objects.bulk_create(
+            [LeaderboardEntry(window=window, **row) for row in scores
+             if row['score']],
+            batch_size=1000)
+    pagecache.invalidate(popular=True)
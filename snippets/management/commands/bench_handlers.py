@@ -0,0 +1,128 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from snippets.models import Snippet
+from snippets.views import asynchronous
+
+
+class Command(BaseCommand):
+    help = ("Measure throughput of a read endpoint through the WSGI or the "
+            "ASGI handler, in process, with slow clients: every response "
+            "chunk takes --client-delay ms to send.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('handler', choices=['wsgi', 'asgi'])
+        parser.add_argument(
+            '--path', help="Path to request; defaults to the raw code of "
+                           "the newest snippet.")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument(
+            '--concurrency', type=int, default=200,
+            help="Clients connected at once.")
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="WSGI worker threads, as in a threaded WSGI server.")
+        parser.add_argument('--client-delay', type=float, default=50)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path is None:
+            snippet = Snippet.objects.only('pk').order_by('-pk').first()
+            if snippet is None:
+                raise CommandError("No snippets; pass --path.")
+            path = reverse('snippets:raw', args=[snippet.pk])
+        if options['handler'] == 'asgi' and not asynchronous.ASYNC_VIEWS:
+            self.stderr.write(self.style.WARNING(
+                "SNIPPETS_ASYNC_VIEWS is off: the ASGI handler will run the "
+                "sync views in a thread."))
+
+        run = self.wsgi if options['handler'] == 'wsgi' else self.asgi
+        delay = options['client_delay'] / 1000
+        started = time.perf_counter()
+        latencies, statuses = run(path, delay, options)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        self.stdout.write(
+            f"{options['handler']}: {len(latencies)} requests to {path} in "
+            f"{elapsed:.2f}s, {len(latencies) / elapsed:.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:.0f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f}ms, "
+            f"statuses {sorted(set(statuses))}")
+
+    def wsgi(self, path, delay, options):
+        handler = WSGIHandler()
+
+        def request():
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                'SCRIPT_NAME': '', 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+            }
+            body = handler(environ, lambda s, headers: status.append(s))
+            for chunk in body:
+                # The worker thread is held while the client reads
+                time.sleep(delay)
+            body.close()
+            return int(status[0][:3])
+
+        # Connected clients wait for a free worker, as in a threaded server
+        with ThreadPoolExecutor(options['workers']) as workers, \
+                ThreadPoolExecutor(options['concurrency']) as clients:
+            def client(_):
+                started = time.perf_counter()
+                status = workers.submit(request).result()
+                return time.perf_counter() - started, status
+
+            results = list(clients.map(client, range(options['requests'])))
+        return [r[0] for r in results], [r[1] for r in results]
+
+    def asgi(self, path, delay, options):
+        handler = ASGIHandler()
+
+        async def request():
+            started = time.perf_counter()
+            status = []
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'headers': [(b'host', b'localhost')],
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            }
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'',
+                        'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                else:
+                    await asyncio.sleep(delay)
+
+            await handler(scope, receive, send)
+            return time.perf_counter() - started, status[0]
+
+        async def clients():
+            slots = asyncio.Semaphore(options['concurrency'])
+
+            async def client():
+                async with slots:
+                    return await request()
+            return await asyncio.gather(
+                *(client() for _ in range(options['requests'])))
+
+        results = asyncio.run(clients())
+        return [r[0] for r in results], [r[1] for r in results]
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from snippets import duplicates
+
+
+class Command(BaseCommand):
+    help = ("Build the near-duplicate fingerprint index over every "
+            "snippet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of snippets fingerprinted per batch.")
+
+    def handle(self, *args, **options):
+        done = 0
+        for done in duplicates.rebuild(options['chunk_size']):
+            self.stdout.write(f"{done} snippets fingerprinted")
+        self.stdout.write(self.style.SUCCESS(
+            f"Fingerprinted {done} snippet{'s' if done != 1 else ''}"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from snippets import leaderboards
+
+
+class Command(BaseCommand):
+    help = ("Recompute the 30 and 7 day leaderboards from their daily "
+            "buckets and drop buckets no window needs any more. Run daily.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Recompute every board from the snippet and bookmark "
+                 "tables instead.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            leaderboards.rebuild()
+            self.stdout.write(self.style.SUCCESS("Rebuilt leaderboards"))
+        else:
+            leaderboards.compact()
+            self.stdout.write(self.style.SUCCESS("Compacted leaderboards"))
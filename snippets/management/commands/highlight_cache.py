@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+
+from snippets import highlighting
+from snippets.models import HighlightCache
+
+
+class Command(BaseCommand):
+    help = ("Report the size of the persistent highlight cache, "
+            "optionally pruning or emptying it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help="Delete every cached rendering.")
+        parser.add_argument(
+            '--prune', action='store_true',
+            help="Delete renderings not used in --days days, and those "
+                 "of code no snippet currently has.")
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help="Age in days after which --prune deletes unused "
+                 "renderings (default 30).")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = HighlightCache.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} cached renderings")
+            return
+        if options['prune']:
+            deleted = highlighting.prune(options['days'])
+            self.stdout.write(f"Pruned {deleted} cached renderings")
+        stats = HighlightCache.objects.aggregate(
+            entries=Count('pk'), size=Sum(Length('html')))
+        self.stdout.write(
+            f"{stats['entries']} cached renderings, "
+            f"{stats['size'] or 0} bytes stored")
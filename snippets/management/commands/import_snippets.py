@@ -0,0 +1,174 @@
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from snippets import (duplicates, highlighting, leaderboards, ranking,
+                      rendering, search)
+from snippets.models import Checkpoint, Language, Snippet, SnippetTag, Tag
+
+
+class Command(BaseCommand):
+    help = ("Bulk import snippets from a JSON Lines file, one object per "
+            "line with title, description, code, language (a slug), "
+            "author (a username) and optionally tags (a list of names).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="File to import, or - to read standard input.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Snippets rendered and inserted per transaction.")
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help="Number of render processes.")
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore any saved progress and import from the start.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        if path == '-':
+            stream, checkpoint = sys.stdin.buffer, None
+        else:
+            try:
+                stream = open(path, 'rb')
+            except OSError as e:
+                raise CommandError(e)
+            # Progress is saved as a byte offset, committed together with
+            # each batch, so a crashed import resumes exactly where the last
+            # committed batch ended.
+            checkpoint, _ = Checkpoint.objects.get_or_create(
+                name=f'import:{os.path.abspath(path)}')
+            if options['restart']:
+                checkpoint.position = 0
+            stream.seek(checkpoint.position)
+            if checkpoint.position:
+                self.stdout.write(f"Resuming at byte {checkpoint.position}")
+
+        self.languages = {
+            language.slug: language for language in Language.objects.all()}
+        self.users = dict(
+            get_user_model().objects.values_list('username', 'pk'))
+        self.imported = self.skipped = 0
+        self.workers = options['workers']
+        started = time.monotonic()
+        with stream, ProcessPoolExecutor(self.workers) as executor:
+            position = checkpoint.position if checkpoint else 0
+            batch = []
+            for line in stream:
+                snippet = self.build_snippet(line, position)
+                position += len(line)
+                if snippet is not None:
+                    batch.append(snippet)
+                if len(batch) >= batch_size:
+                    self.save_batch(batch, executor, checkpoint, position)
+                    batch = []
+                    self.report(started)
+            self.save_batch(batch, executor, checkpoint, position)
+        self.report(started)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} snippets, skipped {self.skipped}"))
+
+    def build_snippet(self, line, offset):
+        if not line.strip():
+            return None
+        try:
+            record = json.loads(line)
+            language = self.languages[record['language']]
+            author_id = self.users[record['author']]
+            snippet = Snippet(
+                title=record['title'], description=record['description'],
+                code=record['code'], language=language, author_id=author_id)
+            tags = record.get('tags', [])
+            if isinstance(tags, str):
+                tags = tags.split()
+            snippet.tag_names = {slugify(name)[:50] for name in tags} - {''}
+            return snippet
+        except (ValueError, KeyError, TypeError) as e:
+            self.stderr.write(f"Record at byte {offset} skipped: {e!r}")
+            self.skipped += 1
+            return None
+
+    def drop_duplicates(self, batch):
+        """ Skip exact duplicates (and near ones, if those are rejected),
+        checking the whole batch at once; return the snippets to import
+        and the near duplicates to flag. """
+        found = duplicates.find_duplicates(
+            [(snippet.code_hash, snippet.analysis.fingerprints)
+             for snippet in batch])
+        kept, near, hashes = [], [], set()
+        for snippet, duplicate in zip(batch, found):
+            if snippet.code_hash in hashes or duplicate and (
+                    duplicate.exact or
+                    duplicates.NEAR_DUPLICATE_ACTION == 'reject'):
+                self.stderr.write(f"Duplicate {snippet.title!r} skipped")
+                self.skipped += 1
+                continue
+            hashes.add(snippet.code_hash)
+            kept.append(snippet)
+            if duplicate:
+                near.append((snippet, duplicate))
+        return kept, near
+
+    def save_batch(self, batch, executor, checkpoint, position):
+        # Rendered and analysed from one lexing, in the worker processes
+        rendered = executor.map(
+            rendering.index_job,
+            [snippet.description for snippet in batch],
+            [snippet.code for snippet in batch],
+            [snippet.language.language_code for snippet in batch],
+            chunksize=max(1, len(batch) // (self.workers * 4)))
+        for snippet, (description_html, highlighted_code, analysis) in zip(
+                batch, rendered):
+            snippet.description_html = description_html
+            snippet.highlighted_code = highlighted_code
+            snippet.analysis = analysis
+            snippet.code_hash = Snippet.hash_code(snippet.code)
+            snippet.render_version = rendering.RENDERER_VERSION
+            snippet.hot_score = ranking.hot_score(0, timezone.now())
+        batch, near = self.drop_duplicates(batch)
+        with transaction.atomic():
+            Snippet.objects.bulk_create(batch)
+            search.index_snippets(batch)
+            leaderboards.record_snippets(batch)
+            self.save_tags(batch)
+            rendering.index([(snippet, snippet.analysis)
+                             for snippet in batch], check=False)
+            for snippet, duplicate in near:
+                duplicates.flag(snippet.pk, duplicate)
+            if checkpoint is not None:
+                checkpoint.position = position
+                checkpoint.save(update_fields=['position', 'updated'])
+        rendering.invalidate(
+            batch, language_ids={snippet.language_id for snippet in batch},
+            listings=True, popular=True)
+        highlighting.store_many(
+            (snippet.code, snippet.language.language_code,
+             snippet.highlighted_code) for snippet in batch)
+        self.imported += len(batch)
+
+    def save_tags(self, batch):
+        names = set().union(*(snippet.tag_names for snippet in batch))
+        if not names:
+            return
+        tags = {tag.name: tag.pk for tag in Tag.objects.for_names(names)}
+        taggings = [SnippetTag(snippet_id=snippet.pk, tag_id=tags[name])
+                    for snippet in batch for name in snippet.tag_names]
+        SnippetTag.objects.bulk_create(taggings)
+        Tag.objects.adjust(Counter(tagging.tag_id for tagging in taggings))
+
+    def report(self, started):
+        elapsed = time.monotonic() - started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{self.imported} imported in {elapsed:.1f}s ({rate:.0f} rows/s)")
@@ -0,0 +1,372 @@
+import http.client
+import io
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import NoReverseMatch, reverse
+
+from snippets.models import Language, Snippet, Tag
+
+# (URL name, weight, kind of arguments). Detail and raw reads take 70% of
+# the traffic, lists and feeds 15%, the popular pages 10% and writes 5%.
+MIX = [
+    ('snippets:detail', 40, 'snippet'),
+    ('snippets:raw', 20, 'snippet'),
+    ('snippets:download', 10, 'snippet'),
+    ('snippets:list', 5, None),
+    ('languages:detail', 3, 'language'),
+    ('tags:detail', 2, 'tag'),
+    ('feeds:latest', 3, None),
+    ('feeds:author', 1, 'author'),
+    ('feeds:language', 1, 'language'),
+    ('popular:authors', 2, None),
+    ('popular:languages', 2, None),
+    ('popular:bookmarked', 2, None),
+    ('popular:top_rated', 2, None),
+    ('popular:tags', 2, None),
+    ('snippets:rate', 2, 'snippet'),
+    ('bookmarks:add', 2, 'snippet'),
+    ('snippets:add', 1, None),
+]
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(timings, pct):
+    """ Nearest-rank percentile of sorted timings. """
+    return timings[max(0, -(-len(timings) * pct // 100) - 1)]
+
+
+class InProcessTransport:
+    """ Calls the WSGI application directly. """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, method, path, query='', body=b'', headers=None):
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '',
+            'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(), 'CONTENT_LENGTH': str(len(body)),
+            'HTTP_HOST': 'localhost',
+        }
+        for name, value in (headers or {}).items():
+            key = name.upper().replace('-', '_')
+            if key != 'CONTENT_TYPE':
+                key = 'HTTP_' + key
+            environ[key] = value
+        started = []
+        response = self.application(
+            environ, lambda status, headers: started.append((status, headers)))
+        try:
+            content = b''.join(response)
+        finally:
+            response.close()
+        status, response_headers = started[0]
+        return int(status[:3]), response_headers, content
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """ Sends requests to a running server over one keep-alive connection
+    per client. """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = None
+
+    def __call__(self, method, path, query='', body=b'', headers=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=60)
+        try:
+            self.connection.request(
+                method, path + ('?' + query if query else ''), body=body,
+                headers=headers or {})
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        return response.status, response.getheaders(), content
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class VirtualUser:
+    """ One logged-in client: its cookies and its transport. """
+
+    def __init__(self, transport, session_key):
+        self.transport = transport
+        self.cookies = {settings.SESSION_COOKIE_NAME: session_key}
+
+    def request(self, method, path, query='', data=None):
+        headers = {'Cookie': '; '.join(
+            f'{name}={value}' for name, value in self.cookies.items())}
+        body = b''
+        if data is not None:
+            body = urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.cookies.get(
+                settings.CSRF_COOKIE_NAME, '')
+        status, response_headers, content = self.transport(
+            method, path, query, body, headers)
+        for name, value in response_headers:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    self.cookies[morsel.key] = morsel.value
+        return status
+
+
+class Command(BaseCommand):
+    help = ("Replay a weighted mix of page views and writes against the "
+            "WSGI application, in process or through a running server, and "
+            "report throughput and p50/p95/p99 latency per URL name. Fails "
+            "when latency or errors pass the given thresholds or regress "
+            "from a baseline run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', help="Base URL of a running server, e.g. "
+                          "http://127.0.0.1:8000. By default the WSGI "
+                          "application is called in process.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=30,
+                            help="Seconds to run for.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--mix', action='append', default=[], metavar='NAME=WEIGHT',
+            help="Change the weight of a URL name; 0 leaves it out.")
+        parser.add_argument(
+            '--max-p95', type=float,
+            help="Fail if any URL name's p95 latency passes this many ms.")
+        parser.add_argument(
+            '--max-error-rate', type=float, default=0.01,
+            help="Fail if more than this share of requests errors, "
+                 "overall or for any one URL name.")
+        parser.add_argument('--output', help="Write the results here.")
+        parser.add_argument(
+            '--baseline', help="Results of an earlier run. Fail if any "
+                               "URL name's p95 is more than --tolerance "
+                               "slower.")
+        parser.add_argument('--tolerance', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        self.load_samples()
+        if options['url']:
+            transports = [HTTPTransport(options['url'])
+                          for _ in range(options['concurrency'])]
+        else:
+            from django_snippets.wsgi import application
+            transports = [InProcessTransport(application)
+                          for _ in range(options['concurrency'])]
+        clients = [VirtualUser(transport, self.session_key())
+                   for transport in transports]
+
+        results = defaultdict(list)
+        errors = defaultdict(int)
+        exceptions = {}
+        deadline = time.perf_counter() + options['duration']
+        names = [name for name, _, _ in mix]
+        weights = [weight for _, weight, _ in mix]
+        kinds = {name: kind for name, _, kind in mix}
+
+        def run(client, seed):
+            rng = random.Random(seed)
+            timings, failures = defaultdict(list), defaultdict(int)
+            raised = {}
+            try:
+                while time.perf_counter() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        ok = self.visit(client, name, kinds[name], rng)
+                    except Exception as e:
+                        # Connection and protocol errors, exceptions
+                        # raised in process: all count as failed requests
+                        raised.setdefault(name, e)
+                        ok = False
+                    timings[name].append(time.perf_counter() - started)
+                    if not ok:
+                        failures[name] += 1
+            finally:
+                client.transport.close()
+                with lock:
+                    for name, values in timings.items():
+                        results[name] += values
+                    for name, count in failures.items():
+                        errors[name] += count
+                    for name, e in raised.items():
+                        exceptions.setdefault(name, e)
+
+        lock = threading.Lock()
+        started = time.perf_counter()
+        threads = [threading.Thread(target=run, args=(client,
+                                                      options['seed'] + i))
+                   for i, client in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        for name, e in sorted(exceptions.items()):
+            self.stderr.write(f"{name} raised {e!r}")
+
+        report = self.report(results, errors, elapsed)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        self.enforce_thresholds(report, options)
+
+    def parse_mix(self, overrides):
+        weights = {name: weight for name, weight, _ in MIX}
+        for override in overrides:
+            name, _, weight = override.partition('=')
+            if name not in weights:
+                raise CommandError(
+                    f"{name} is not in the mix: {', '.join(weights)}")
+            try:
+                weights[name] = float(weight)
+            except ValueError:
+                raise CommandError(f"Bad weight in {override!r}")
+        mix = [(name, weights[name], kind) for name, _, kind in MIX
+               if weights[name] > 0]
+        for name, _, kind in mix:
+            try:
+                reverse(name, args=[1] if kind else [])
+            except NoReverseMatch:
+                raise CommandError(f"{name} is not a URL name")
+        return mix
+
+    def load_samples(self):
+        self.snippet_ids = list(Snippet.objects.values_list('pk', flat=True))
+        if not self.snippet_ids:
+            raise CommandError("No snippets to load test; run seed_bench.")
+        self.languages = list(Language.objects.values_list('slug', flat=True))
+        self.authors = list(get_user_model().objects.filter(
+            snippet__isnull=False).distinct().values_list(
+            'username', flat=True)[:1000])
+        self.tags = list(Tag.objects.filter(snippet_count__gt=0).values_list(
+            'name', flat=True)) or [None]
+        self.language_ids = list(Language.objects.values_list('pk', flat=True))
+        self.users = list(get_user_model().objects.values_list(
+            'pk', flat=True)[:1000])
+
+    def session_key(self):
+        """ Log a random user in, returning the session key. """
+        client = Client()
+        client.force_login(get_user_model().objects.get(
+            pk=random.choice(self.users)))
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def visit(self, client, name, kind, rng):
+        """ Make one request for the URL name; return whether it
+        succeeded. """
+        arg = {
+            'snippet': lambda: rng.choice(self.snippet_ids),
+            'language': lambda: rng.choice(self.languages),
+            'author': lambda: rng.choice(self.authors),
+            'tag': lambda: rng.choice(self.tags),
+            None: lambda: None,
+        }[kind]()
+        path = reverse(name, args=[] if arg is None else [arg])
+        if name == 'snippets:rate':
+            status = client.request('GET', path, urlencode(
+                {'rating': rng.choice(['1', '-1'])}))
+        elif name == 'snippets:add':
+            status = self.add_snippet(client, path, rng)
+        else:
+            status = client.request('GET', path)
+        return status < 400
+
+    def add_snippet(self, client, path, rng):
+        # The form page sets the CSRF cookie the POST needs
+        status = client.request('GET', path)
+        if status >= 400:
+            return status
+        return client.request('POST', path, data={
+            'title': 'Load test',
+            'description': 'Posted by manage.py load_test.',
+            'code': f'print({uuid.uuid4().hex!r})\n' * rng.randint(1, 20),
+            'language': rng.choice(self.language_ids),
+            'tags': 'loadtest',
+        })
+
+    def report(self, results, errors, elapsed):
+        report = {'duration': elapsed, 'urls': {}}
+        total = 0
+        for name, timings in sorted(results.items()):
+            timings.sort()
+            total += len(timings)
+            entry = {
+                'requests': len(timings),
+                'errors': errors[name],
+                'throughput': len(timings) / elapsed,
+                'mean': statistics.mean(timings) * 1000,
+            }
+            for pct in PERCENTILES:
+                entry[f'p{pct}'] = percentile(timings, pct) * 1000
+            report['urls'][name] = entry
+            self.stdout.write(
+                f"{name:20} {len(timings):6} req {entry['throughput']:8.1f}/s "
+                + ' '.join(f"p{pct} {entry[f'p{pct}']:7.1f}ms"
+                           for pct in PERCENTILES)
+                + (f"  {errors[name]} errors" if errors[name] else ''))
+        report['requests'] = total
+        report['errors'] = sum(errors.values())
+        report['throughput'] = total / elapsed
+        self.stdout.write(
+            f"{total} requests in {elapsed:.1f}s, "
+            f"{report['throughput']:.1f} req/s, {report['errors']} errors")
+        return report
+
+    def enforce_thresholds(self, report, options):
+        failures = []
+        if report['requests'] and report['errors'] / report['requests'] > \
+                options['max_error_rate']:
+            failures.append(f"{report['errors']} of {report['requests']} "
+                            f"requests failed")
+        for name, entry in report['urls'].items():
+            # Rare URL names, the writes among them, would hide in the total
+            if entry['errors'] / entry['requests'] > \
+                    options['max_error_rate']:
+                failures.append(f"{entry['errors']} of {entry['requests']} "
+                                f"{name} requests failed")
+            if options['max_p95'] and entry['p95'] > options['max_p95']:
+                failures.append(f"{name} p95 {entry['p95']:.1f}ms is over "
+                                f"{options['max_p95']:.1f}ms")
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['urls']
+            for name, entry in report['urls'].items():
+                if name not in baseline:
+                    continue
+                limit = baseline[name]['p95'] * (1 + options['tolerance'])
+                if entry['p95'] > limit:
+                    failures.append(
+                        f"{name} p95 regressed from "
+                        f"{baseline[name]['p95']:.1f}ms to "
+                        f"{entry['p95']:.1f}ms")
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS("Within thresholds"))
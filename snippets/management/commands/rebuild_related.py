@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from snippets import related
+
+
+class Command(BaseCommand):
+    help = ("Recompute the MinHash signature and related snippets of every "
+            "snippet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Snippets processed between progress reports.")
+
+    def handle(self, *args, **options):
+        done = 0
+        for stage, done in related.rebuild(options['chunk_size']):
+            self.stdout.write(f"{stage}: {done} snippets")
+        self.stdout.write(self.style.SUCCESS(
+            f"Related snippets rebuilt for {done} snippets"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index over every snippet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of snippets indexed per batch.")
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError(
+                "Full-text search needs the SQLite FTS5 extension.")
+        indexed = search.rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} snippet{'s' if indexed != 1 else ''}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from snippets.models import Snippet, Tag
+
+
+class Command(BaseCommand):
+    help = ("Recompute the denormalized score, rating_count and "
+            "bookmark_count columns of every snippet, the ranking "
+            "scores derived from them, and every tag's snippet_count.")
+
+    def handle(self, *args, **options):
+        updated = Snippet.objects.recount()
+        Snippet.objects.rerank()
+        Tag.objects.recount()
+        self.stdout.write(self.style.SUCCESS(
+            f"Recounted {updated} snippet{'s' if updated != 1 else ''}"))
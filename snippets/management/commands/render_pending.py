@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from snippets import rendering
+from snippets.models import Snippet
+
+
+class Command(BaseCommand):
+    help = ("Render snippets whose description and code are still waiting "
+            "on a render worker.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=rendering.RENDER_WORKERS,
+            help="Number of render processes.")
+        parser.add_argument(
+            '--timeout', type=float, default=rendering.RENDER_TIMEOUT,
+            help="Seconds a single snippet may take before it is failed.")
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Number of pending snippets picked up per pass.")
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help="Queue snippets that failed to render for another try.")
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep polling for pending snippets instead of exiting.")
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help="Seconds to sleep between polls when idle with --loop.")
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = Snippet.objects.filter(
+                render_status=Snippet.RENDER_FAILED).update(
+                render_status=Snippet.RENDER_PENDING)
+            self.stdout.write(f"Queued {retried} failed snippets again")
+        while True:
+            rendered, failed = rendering.render_pending(
+                limit=options['batch_size'], timeout=options['timeout'],
+                workers=options['workers'])
+            if rendered or failed:
+                self.stdout.write(f"Rendered {rendered}, failed {failed}")
+            if not options['loop']:
+                break
+            if not (rendered or failed):
+                time.sleep(options['interval'])
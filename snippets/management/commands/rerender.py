@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from snippets import highlighting, rendering
+from snippets.models import Checkpoint, Snippet
+
+
+class Command(BaseCommand):
+    help = ("Re-render the description and code of every snippet whose "
+            "stored HTML came from an older renderer.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help="Snippets rendered and written back per transaction.")
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help="Number of render processes.")
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore saved progress and walk the table from the start.")
+
+    def handle(self, *args, **options):
+        version = rendering.RENDERER_VERSION
+        batch_size, workers = options['batch_size'], options['workers']
+        # Progress is the last primary key written, kept per renderer
+        # version and committed with each batch.
+        checkpoint, _ = Checkpoint.objects.get_or_create(
+            name=f'rerender:{version}')
+        if options['restart']:
+            checkpoint.position = 0
+        if checkpoint.position:
+            self.stdout.write(f"Resuming after snippet {checkpoint.position}")
+
+        stale = Snippet.objects.exclude(render_version=version).select_related(
+            'language').only(
+            'description', 'code', 'author', 'language',
+            'language__language_code').order_by('pk')
+        rendered, started = 0, time.monotonic()
+        with ProcessPoolExecutor(workers) as executor:
+            while True:
+                # Seek past the last key instead of holding one cursor open
+                # over a table that is being written to.
+                batch = list(stale.filter(pk__gt=checkpoint.position)
+                             [:batch_size].iterator(chunk_size=batch_size))
+                if not batch:
+                    break
+                results = executor.map(
+                    rendering.render_job,
+                    [snippet.description for snippet in batch],
+                    [snippet.code for snippet in batch],
+                    [snippet.language.language_code for snippet in batch],
+                    chunksize=max(1, len(batch) // (workers * 4)))
+                for snippet, (description_html, highlighted_code) in zip(
+                        batch, results):
+                    snippet.description_html = description_html
+                    snippet.highlighted_code = highlighted_code
+                    snippet.render_status = Snippet.RENDER_READY
+                    snippet.render_version = version
+                with transaction.atomic():
+                    Snippet.objects.bulk_update(
+                        batch, ['description_html', 'highlighted_code',
+                                'render_status', 'render_version'])
+                    checkpoint.position = batch[-1].pk
+                    checkpoint.save(update_fields=['position', 'updated'])
+                highlighting.store_many(
+                    (snippet.code, snippet.language.language_code,
+                     snippet.highlighted_code) for snippet in batch)
+                # bulk_update() sends no post_save
+                rendering.invalidate(batch)
+                rendered += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{rendered} re-rendered in {elapsed:.1f}s "
+                    f"({rendered / elapsed:.0f} rows/s)")
+        # Done: a later run for this version starts over, picking up rows
+        # that went stale since, such as those skipped when resuming
+        checkpoint.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-rendered {rendered} snippets with {version}"))
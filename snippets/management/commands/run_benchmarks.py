@@ -0,0 +1,66 @@
+import datetime
+import json
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+from snippets import benchmarks
+from snippets.models import Bookmark, Rating, Snippet
+
+
+class Command(BaseCommand):
+    help = ("Time the model, manager, template tag and feed benchmarks "
+            "against the current database, and save the results as JSON "
+            "to compare runs across commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*', metavar='name',
+            help=f"Benchmarks to run: {', '.join(benchmarks.BENCHMARKS)}. "
+                 f"All by default.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--output', help="Write the results here, e.g. HEAD.bench.json.")
+        parser.add_argument(
+            '--compare', help="Results of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(benchmarks.BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(unknown)}")
+        if not Snippet.objects.exists():
+            raise CommandError("No snippets to benchmark; run seed_bench.")
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        results = benchmarks.run(options['names'], options['repeat'])
+        for name, result in results.items():
+            line = (f"{name:32} {result['median'] * 1000:9.3f}ms "
+                    f"{result['queries']:4} queries")
+            if name in baseline:
+                line += f"  {result['median'] / baseline[name]['median']:.2f}x"
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': self.commit(),
+                    'date': datetime.datetime.now().isoformat(),
+                    'rows': {
+                        'snippets': Snippet.objects.count(),
+                        'ratings': Rating.objects.count(),
+                        'bookmarks': Bookmark.objects.count(),
+                    },
+                    'repeat': options['repeat'],
+                    'results': results,
+                }, f, indent=2)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,191 @@
+import datetime
+import itertools
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from pygments.lexers import get_lexer_by_name
+
+from snippets import leaderboards, rendering, search
+from snippets.models import (Bookmark, Language, Rating, Snippet, SnippetTag,
+                             Tag)
+
+LANGUAGES = [
+    ('Python', 'python', 'py', 'text/x-python'),
+    ('JavaScript', 'javascript', 'js', 'application/javascript'),
+    ('Ruby', 'ruby', 'rb', 'text/x-ruby'),
+    ('Go', 'go', 'go', 'text/x-go'),
+    ('Rust', 'rust', 'rs', 'text/x-rust'),
+    ('C', 'c', 'c', 'text/x-csrc'),
+    ('Java', 'java', 'java', 'text/x-java'),
+    ('SQL', 'sql', 'sql', 'text/x-sql'),
+    ('Bash', 'bash', 'sh', 'text/x-sh'),
+    ('HTML', 'html', 'html', 'text/html'),
+    ('CSS', 'css', 'css', 'text/css'),
+    ('PHP', 'php', 'php', 'text/x-php'),
+]
+WORDS = ('cache queue parse render token stream buffer index query order '
+         'retry batch merge split filter sort widget model field view form '
+         'signal thread async lock file path date user price total').split()
+
+
+def zipf_weights(count, skew=1.1):
+    """ Cumulative weights making the first items far more likely. """
+    return list(itertools.accumulate(
+        1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = ("Generate users, languages, snippets, tags, ratings and "
+            "bookmarks for benchmarking, with a few authors, languages and "
+            "snippets drawing most of the activity, and recompute every "
+            "denormalized counter.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--languages', type=int, default=8,
+                            help=f"At most {len(LANGUAGES)}.")
+        parser.add_argument('--snippets', type=int, default=5000)
+        parser.add_argument('--ratings', type=int, default=20000)
+        parser.add_argument('--bookmarks', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread publication dates over this many "
+                                 "days.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+
+        users = self.seed_users(options['users'])
+        languages = self.seed_languages(options['languages'])
+        tags = self.seed_tags()
+        snippet_ids = self.seed_snippets(
+            options['snippets'], users, languages, tags)
+        self.seed_votes(Rating, options['ratings'], users, snippet_ids)
+        self.seed_votes(Bookmark, options['bookmarks'], users, snippet_ids)
+
+        self.stdout.write("Recounting")
+        Snippet.objects.recount()
+        Snippet.objects.rerank()
+        Tag.objects.recount()
+        leaderboards.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(languages)} languages, "
+            f"{len(snippet_ids)} snippets"))
+
+    def seed_users(self, count):
+        User = get_user_model()
+        start = User.objects.count()
+        User.objects.bulk_create(
+            [User(username=f'bench{start + i}', password='!')
+             for i in range(count)],
+            batch_size=self.batch_size, ignore_conflicts=True)
+        return list(User.objects.filter(
+            username__startswith='bench').values_list('pk', flat=True))
+
+    def seed_languages(self, count):
+        languages = []
+        for name, code, extension, mime_type in LANGUAGES[:count]:
+            get_lexer_by_name(code)
+            language, _ = Language.objects.get_or_create(
+                slug=code, defaults={
+                    'name': name, 'language_code': code,
+                    'file_extension': extension, 'mime_type': mime_type})
+            languages.append(language)
+        return languages
+
+    def seed_tags(self):
+        return list(Tag.objects.for_names(WORDS))
+
+    def pub_date(self):
+        # Most snippets are recent, a long tail is old
+        age = min(self.random.expovariate(4 / self.days), self.days)
+        return self.now - datetime.timedelta(days=age)
+
+    def code(self):
+        words = self.random.sample(WORDS, 4)
+        lines = [f'{words[0]}_{words[1]} = {self.random.randint(0, 999)}']
+        for _ in range(self.random.randint(3, 40)):
+            words = self.random.sample(WORDS, 3)
+            lines.append(f'{words[0]}({words[1]}, "{words[2]}", '
+                         f'{self.random.randint(0, 99)})')
+        return '\n'.join(lines)
+
+    def seed_snippets(self, count, users, languages, tags):
+        author_weights = zipf_weights(len(users))
+        language_weights = zipf_weights(len(languages))
+        tag_weights = zipf_weights(len(tags))
+        pks = []
+        for start in range(0, count, self.batch_size):
+            batch = []
+            for _ in range(min(self.batch_size, count - start)):
+                language = self.random.choices(
+                    languages, cum_weights=language_weights)[0]
+                title = ' '.join(self.random.sample(WORDS, 3))
+                snippet = Snippet(
+                    title=title.capitalize(),
+                    description=f"How to {title} with *{language.name}*.",
+                    code=self.code(), language=language,
+                    author_id=self.random.choices(
+                        users, cum_weights=author_weights)[0])
+                (snippet.description_html,
+                 snippet.highlighted_code) = rendering.render_job(
+                    snippet.description, snippet.code, language.language_code)
+                snippet.render_version = rendering.RENDERER_VERSION
+                snippet.code_hash = Snippet.hash_code(snippet.code)
+                batch.append(snippet)
+            with transaction.atomic():
+                Snippet.objects.bulk_create(batch)
+                # pub_date is auto_now_add, so it can only be backdated
+                # after the insert
+                for snippet in batch:
+                    snippet.pub_date = snippet.updated_date = self.pub_date()
+                Snippet.objects.bulk_update(
+                    batch, ['pub_date', 'updated_date'])
+                SnippetTag.objects.bulk_create(
+                    [SnippetTag(snippet_id=snippet.pk, tag_id=tag.pk)
+                     for snippet in batch
+                     for tag in set(self.random.choices(
+                         tags, cum_weights=tag_weights,
+                         k=self.random.randint(0, 3)))])
+                search.index_snippets(batch)
+            pks += [snippet.pk for snippet in batch]
+            self.stdout.write(f"{len(pks)} snippets")
+        return pks
+
+    def seed_votes(self, model, count, users, snippet_ids):
+        """ Create ratings or bookmarks, each user voting on a snippet at
+        most once, mostly on the most popular snippets. """
+        # Popularity is independent of age: shuffle before weighting
+        snippet_ids = self.random.sample(snippet_ids, len(snippet_ids))
+        snippet_weights = zipf_weights(len(snippet_ids), skew=0.9)
+        user_weights = zipf_weights(len(users), skew=0.7)
+        count = min(count, len(users) * len(snippet_ids))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.update(zip(
+                self.random.choices(snippet_ids, cum_weights=snippet_weights,
+                                    k=count - len(pairs)),
+                self.random.choices(users, cum_weights=user_weights,
+                                    k=count - len(pairs))))
+        pairs = sorted(pairs)
+        for start in range(0, len(pairs), self.batch_size):
+            objects = []
+            for snippet_id, user_id in pairs[start:start + self.batch_size]:
+                extra = {'rating': self.random.choices(
+                    [Rating.RATING_UP, Rating.RATING_DOWN], [4, 1])[0]} \
+                    if model is Rating else {}
+                objects.append(model(
+                    snippet_id=snippet_id, user_id=user_id, **extra))
+            with transaction.atomic():
+                model.objects.bulk_create(objects)
+                for obj in objects:
+                    obj.date = self.pub_date()
+                model.objects.bulk_update(objects, ['date'])
+        self.stdout.write(f"{len(pairs)} {model._meta.verbose_name_plural}")
@@ -1,25 +1,299 @@
-from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Count, Sum
+from collections import defaultdict
 
+from django.db import connections, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-class SnippetManager(models.Manager):
-    """ A manager for the snippet model. """
 
-    def top_authors(self):
-        """ Function that returns users with the most number of snippets. """
-        return User.objects.annotate(score=Count('snippet')).order_by('-score')
+# The large text columns, which listing pages never show
+LISTING_DEFERRED = ('description', 'description_html', 'code',
+                    'highlighted_code')
 
-    def most_bookmarked(self):
-        """ Function that returns the most bookmarked snippet by users. """
-        return self.annotate(score=Count('bookmark')).order_by('-score')
 
-    def top_rated(self):
-        """ Function for calculating the top-rated snippets """
-        return self.annotate(score=Sum('rating')).order_by('-score')
+class SnippetQuerySet(models.QuerySet):
+    def listing(self):
+        """ The snippets with their author and language, for listing
+        pages. """
+        return self.select_related('author', 'language')
+
+    def with_text(self):
+        """ The snippets with their large text columns, for the pages and
+        jobs that show or process one. """
+        return self.defer(None)
+
+    def only(self, *fields):
+        # Fields named here are loaded, even the ones deferred by default
+        return super(SnippetQuerySet, self.with_text()).only(*fields)
+
+
+class SnippetManager(models.Manager.from_queryset(SnippetQuerySet)):
+    """
+    A manager for the snippet model. Its querysets leave the ``deferred``
+    columns, by default the large text ones (LISTING_DEFERRED), out unless
+    asked for them, with ``with_text()`` or ``only()``, so lists never
+    load them by accident.
+    """
+
+    def __init__(self, deferred=LISTING_DEFERRED):
+        super().__init__()
+        self.deferred = deferred
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.deferred)
+
+    def top_authors(self, window=0):
+        """ Function that returns users with the most number of snippets,
+        over the last ``window`` days (0 for all time). """
+        from . import leaderboards
+
+        return leaderboards.top(leaderboards.LeaderboardEntry.BOARD_AUTHORS,
+                                window)
+
+    def most_bookmarked(self, window=0):
+        """ Function that returns the most bookmarked snippet by users,
+        counting bookmarks from the last ``window`` days (0 for all time). """
+        from . import leaderboards
+
+        return leaderboards.top(
+            leaderboards.LeaderboardEntry.BOARD_BOOKMARKED, window)
+
+    def top_rated(self, ranking='wilson'):
+        """ Function for listing the top-rated snippets, by Wilson score
+        or, with ranking='hot', by hot score. """
+        from .ranking import ORDERINGS
+
+        return self.order_by(*ORDERINGS[ranking])
+
+    def rerank(self, snippet_ids=None, batch_size=500):
+        """
+        Recompute the stored wilson_score and hot_score of the given
+        snippets (all of them by default) from their vote counters.
+        Returns the number of snippets updated.
+        """
+        from . import pagecache, ranking
+
+        snippets = self.only('score', 'rating_count', 'pub_date').order_by(
+            'pk')
+        if snippet_ids is not None:
+            snippets = snippets.filter(pk__in=snippet_ids)
+        updated, batch = 0, []
+        for snippet in snippets.iterator(chunk_size=batch_size):
+            snippet.wilson_score = ranking.wilson_score(
+                snippet.score, snippet.rating_count)
+            snippet.hot_score = ranking.hot_score(
+                snippet.score, snippet.pub_date)
+            batch.append(snippet)
+            if len(batch) == batch_size:
+                updated += self.bulk_update(
+                    batch, ['wilson_score', 'hot_score'])
+                batch = []
+        if batch:
+            updated += self.bulk_update(batch, ['wilson_score', 'hot_score'])
+        if snippet_ids is None:
+            pagecache.invalidate_all()
+        else:
+            pagecache.invalidate(popular=True)
+        return updated
+
+    def add_bookmarks(self, snippet_id, count=1):
+        """ Adjust a snippet's bookmark count; pass a negative count to
+        account for deleted bookmarks. """
+        from . import pagecache
+
+        updated = self.filter(pk=snippet_id).update(
+            bookmark_count=F('bookmark_count') + count)
+        pagecache.invalidate([snippet_id], popular=True)
+        return updated
+
+    def tagged(self, tags):
+        """
+        Return the snippets carrying every one of the given tags. The
+        matches come from one grouped scan of the (tag, snippet) index
+        rather than one join per tag.
+        """
+        from .models import SnippetTag
+
+        tag_ids = {tag.pk for tag in tags}
+        matching = SnippetTag.objects.filter(tag__in=tag_ids).values(
+            'snippet').annotate(matches=Count('tag')).filter(
+            matches=len(tag_ids)).values('snippet')
+        return self.filter(pk__in=matching)
+
+    def recount(self, snippet_ids=None):
+        """
+        Recompute the denormalized score, rating_count and bookmark_count
+        columns of the given snippets (all of them by default) from the
+        rating and bookmark tables. Returns the number of snippets updated.
+        """
+        from . import pagecache
+        from .models import Bookmark, Rating
+
+        snippets = self.all() if snippet_ids is None else self.filter(
+            pk__in=snippet_ids)
+        ratings = Rating.objects.filter(
+            snippet=OuterRef('pk')).order_by().values('snippet')
+        bookmarks = Bookmark.objects.filter(
+            snippet=OuterRef('pk')).order_by().values('snippet')
+        updated = snippets.update(
+            score=Coalesce(
+                Subquery(ratings.annotate(total=Sum('rating'))
+                         .values('total')),
+                Value(0)),
+            rating_count=Coalesce(
+                Subquery(ratings.annotate(total=Count('pk'))
+                         .values('total')),
+                Value(0)),
+            bookmark_count=Coalesce(
+                Subquery(bookmarks.annotate(total=Count('pk'))
+                         .values('total')),
+                Value(0)),
+        )
+        if snippet_ids is None:
+            pagecache.invalidate_all()
+        else:
+            pagecache.invalidate(snippet_ids, popular=True)
+        return updated
+
+
+class UpsertManager(models.Manager):
+    def upsert(self, conflict, update=(), increment=(), **values):
+        """
+        Insert a row with the given field values in one statement. If a row
+        with the same ``conflict`` fields exists, set its ``update`` fields
+        and add to its ``increment`` fields instead, or leave it alone when
+        there are none. Returns whether a row was inserted or changed.
+
+        Django 4.0's bulk_create() can ignore conflicts but not say whether
+        there was one, nor update on them, hence the SQL (INSERT ... ON
+        CONFLICT, understood by SQLite and PostgreSQL).
+        """
+        return self.upsert_many(conflict, [values], update, increment) > 0
+
+    def upsert_many(self, conflict, rows, update=(), increment=()):
+        """ upsert() several rows, given as dicts with the same keys, in
+        one statement. Returns the number of rows inserted or changed. """
+        if not rows:
+            return 0
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        names = list(rows[0])
+        fields = [opts.get_field(name) for name in names]
+        columns = [quote(field.column) for field in fields]
+        params = [field.get_db_prep_save(row[name], connection)
+                  for row in rows for name, field in zip(names, fields)]
+        placeholders = '(%s)' % ', '.join(['%s'] * len(columns))
+        target = ', '.join(quote(opts.get_field(name).column)
+                           for name in conflict)
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+               f"VALUES {', '.join([placeholders] * len(rows))} "
+               f"ON CONFLICT ({target}) ")
+        updated = [quote(opts.get_field(name).column) for name in update]
+        added = [quote(opts.get_field(name).column) for name in increment]
+        if updated or added:
+            sql += "DO UPDATE SET " + ', '.join(
+                [f'{column} = excluded.{column}' for column in updated]
+                + [f'{column} = {table}.{column} + excluded.{column}'
+                   for column in added])
+            if not added:
+                sql += " WHERE " + ' OR '.join(
+                    f'{table}.{column} <> excluded.{column}'
+                    for column in updated)
+        else:
+            sql += "DO NOTHING"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+
+class RatingManager(UpsertManager):
+    def rate(self, snippet_id, user_id, rating):
+        """
+        Record a user's rating of a snippet, replacing any earlier one, and
+        refresh the snippet's score, rating count and ranking scores if it
+        changed. Returns whether it changed.
+        """
+        from .models import Snippet
+
+        with transaction.atomic(using=self.db):
+            changed = self.upsert(
+                ['user', 'snippet'], update=['rating'], snippet_id=snippet_id,
+                user_id=user_id, rating=rating, date=timezone.now())
+            if changed:
+                # Recounted rather than adjusted, so concurrent votes can't
+                # leave the counters off
+                Snippet.objects.recount([snippet_id])
+                Snippet.objects.rerank([snippet_id])
+        return changed
+
+
+class BookmarkManager(UpsertManager):
+    def add(self, snippet_id, user_id):
+        """
+        Bookmark a snippet for a user unless it already is, counting the
+        new bookmark on the snippet and the leaderboard. Returns whether a
+        bookmark was added.
+        """
+        from . import leaderboards
+        from .models import LeaderboardEntry, Snippet
+
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            added = self.upsert(['user', 'snippet'], snippet_id=snippet_id,
+                                user_id=user_id, date=now)
+            if added:
+                Snippet.objects.add_bookmarks(snippet_id)
+                leaderboards.record(LeaderboardEntry.BOARD_BOOKMARKED,
+                                    snippet_id, leaderboards.day_of(now))
+        return added
 
 
 class LanguageManager(models.Manager):
-    def top_languages(self):
-        """ Function that returns the top languages by number of snippets. """
-        return self.annotate(score=Count('snippet')).order_by('-score')
+    def top_languages(self, window=0):
+        """ Function that returns the top languages by number of snippets,
+        over the last ``window`` days (0 for all time). """
+        from . import leaderboards
+
+        return leaderboards.top(
+            leaderboards.LeaderboardEntry.BOARD_LANGUAGES, window)
+
+
+class TagManager(models.Manager):
+    def top_tags(self):
+        """ Function that returns the tags used by the most snippets. """
+        return self.filter(snippet_count__gt=0).order_by(
+            '-snippet_count', 'name')
+
+    def for_names(self, names):
+        """ Return the tags with the given names, creating missing ones. """
+        names = set(names)
+        self.bulk_create([self.model(name=name) for name in names],
+                         ignore_conflicts=True)
+        return list(self.filter(name__in=names))
+
+    def adjust(self, deltas):
+        """ Add to the snippet_count of tags, given a {tag id: delta}
+        mapping, with one UPDATE per distinct delta. """
+        tag_ids = defaultdict(list)
+        for tag_id, delta in deltas.items():
+            if delta:
+                tag_ids[delta].append(tag_id)
+        for delta, ids in tag_ids.items():
+            self.filter(pk__in=ids).update(
+                snippet_count=F('snippet_count') + delta)
+
+    def recount(self, tag_ids=None):
+        """
+        Recompute the denormalized snippet_count of the given tags (all of
+        them by default), to repair it. Returns the number of tags updated.
+        """
+        from .models import SnippetTag
+
+        tags = self.all() if tag_ids is None else self.filter(pk__in=tag_ids)
+        taggings = SnippetTag.objects.filter(
+            tag=OuterRef('pk')).order_by().values('tag')
+        return tags.update(snippet_count=Coalesce(
+            Subquery(taggings.annotate(total=Count('pk')).values('total')),
+            Value(0)))
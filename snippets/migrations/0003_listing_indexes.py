@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0002_snippet_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', '-date', '-id'], name='bookmark_user_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['-pub_date', '-id'], name='snippet_pub_date_id_idx'),
+        ),
+    ]
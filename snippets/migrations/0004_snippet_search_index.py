@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS snippets_snippet_fts "
+        "USING fts5(title, description, code)")
+    schema_editor.execute(
+        "INSERT INTO snippets_snippet_fts (rowid, title, description, code) "
+        "SELECT id, title, description, code FROM snippets_snippet")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS snippets_snippet_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0003_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0005_highlight_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='render_status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Ready'), (1, 'Pending'), (2, 'Failed')], db_index=True, default=0, editable=False),
+        ),
+    ]
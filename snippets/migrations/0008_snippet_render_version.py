@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0007_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='render_version',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,32 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_code(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    batch = []
+    for snippet in Snippet.objects.only('code').iterator(chunk_size=500):
+        snippet.code_hash = hashlib.sha256(
+            snippet.code.encode('utf-8')).hexdigest()
+        batch.append(snippet)
+        if len(batch) == 500:
+            Snippet.objects.bulk_update(batch, ['code_hash'])
+            batch = []
+    Snippet.objects.bulk_update(batch, ['code_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0008_snippet_render_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='code_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(hash_code, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:53
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def fill_leaderboards(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    Bookmark = apps.get_model('snippets', 'Bookmark')
+    LeaderboardEntry = apps.get_model('snippets', 'LeaderboardEntry')
+    LeaderboardBucket = apps.get_model('snippets', 'LeaderboardBucket')
+    today = timezone.localdate()
+    sources = [('authors', Snippet, 'author_id', 'pub_date'),
+               ('languages', Snippet, 'language_id', 'pub_date'),
+               ('bookmarked', Bookmark, 'snippet_id', 'date')]
+    scores, buckets = Counter(), []
+    for board, model, key, date_field in sources:
+        rows = model.objects.order_by().annotate(
+            day=TruncDate(date_field)).values(key, 'day').annotate(
+            count=Count('pk'))
+        for row in rows.iterator():
+            age = (today - row['day']).days
+            scores[board, 0, row[key]] += row['count']
+            for window in (30, 7):
+                if age < window:
+                    scores[board, window, row[key]] += row['count']
+            if age < 30:
+                buckets.append(LeaderboardBucket(
+                    board=board, object_id=row[key], day=row['day'],
+                    count=row['count']))
+    LeaderboardBucket.objects.bulk_create(buckets, batch_size=1000)
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(board=board, window=window, object_id=object_id,
+                          score=score)
+         for (board, window, object_id), score in scores.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0009_snippet_code_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('authors', 'Top authors'), ('languages', 'Top languages'), ('bookmarked', 'Most bookmarked')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('authors', 'Top authors'), ('languages', 'Top languages'), ('bookmarked', 'Most bookmarked')], max_length=20)),
+                ('window', models.PositiveSmallIntegerField(choices=[(0, 'All time'), (30, 'Last 30 days'), (7, 'Last 7 days')])),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('score', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['board', 'window', '-score'], name='leaderboard_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('board', 'window', 'object_id'), name='leaderboard_entry_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardbucket',
+            index=models.Index(fields=['board', 'day'], name='leaderboard_bucket_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardbucket',
+            constraint=models.UniqueConstraint(fields=('board', 'object_id', 'day'), name='leaderboard_bucket_unique'),
+        ),
+        migrations.RunPython(fill_leaderboards, migrations.RunPython.noop),
+    ]
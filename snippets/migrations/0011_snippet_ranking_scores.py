@@ -0,0 +1,74 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:56
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The ranking formulas as of this migration, copied from snippets.ranking
+# so that later changes to it don't change what the migration does
+WILSON_Z = getattr(settings, 'SNIPPETS_WILSON_Z', 1.96)
+HOT_DECAY = getattr(settings, 'SNIPPETS_HOT_DECAY', 45000)
+HOT_EPOCH = 1134028003
+
+
+def wilson_score(score, rating_count):
+    up = (rating_count + score) // 2
+    if not rating_count:
+        return 0.0
+    z, share = WILSON_Z, up / rating_count
+    return ((share + z * z / (2 * rating_count)
+             - z * math.sqrt((share * (1 - share)
+                              + z * z / (4 * rating_count)) / rating_count))
+            / (1 + z * z / rating_count))
+
+
+def hot_score(score, pub_date):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    return round(
+        sign * order + (pub_date.timestamp() - HOT_EPOCH) / HOT_DECAY, 7)
+
+
+def rank_snippets(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    batch = []
+    snippets = Snippet.objects.only('score', 'rating_count', 'pub_date')
+    for snippet in snippets.iterator(chunk_size=500):
+        snippet.wilson_score = wilson_score(
+            snippet.score, snippet.rating_count)
+        snippet.hot_score = hot_score(snippet.score, snippet.pub_date)
+        batch.append(snippet)
+        if len(batch) == 500:
+            Snippet.objects.bulk_update(batch, ['wilson_score', 'hot_score'])
+            batch = []
+    Snippet.objects.bulk_update(batch, ['wilson_score', 'hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0010_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='hot_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='wilson_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(rank_snippets, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['-wilson_score', '-id'], name='snippet_wilson_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['-hot_score', '-id'], name='snippet_hot_id_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0011_snippet_ranking_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(unique=True)),
+                ('snippet_count', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-snippet_count', 'name'], name='tag_count_name_idx'),
+        ),
+        migrations.AddField(
+            model_name='snippettag',
+            name='snippet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snippets.snippet'),
+        ),
+        migrations.AddField(
+            model_name='snippettag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snippets.tag'),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='snippets', through='snippets.SnippetTag', to='snippets.tag'),
+        ),
+        migrations.AddConstraint(
+            model_name='snippettag',
+            constraint=models.UniqueConstraint(fields=('tag', 'snippet'), name='snippet_tag_unique'),
+        ),
+    ]
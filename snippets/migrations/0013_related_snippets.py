@@ -0,0 +1,51 @@
+# Generated by Django 4.0.6 on 2026-10-18 15:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0012_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetSignature',
+            fields=[
+                ('snippet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='snippets.snippet')),
+                ('signature', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SignatureBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snippets.snippet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RelatedSnippet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='snippets.snippet')),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='snippets.snippet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='signaturebucket',
+            index=models.Index(fields=['band', 'bucket'], name='signature_bucket_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatedsnippet',
+            index=models.Index(fields=['snippet', '-score'], name='related_snippet_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='relatedsnippet',
+            constraint=models.UniqueConstraint(fields=('snippet', 'related'), name='related_snippet_unique'),
+        ),
+    ]
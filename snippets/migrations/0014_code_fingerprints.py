@@ -0,0 +1,48 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('snippets', '0013_related_snippets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippetflag',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='snippets.snippet'),
+        ),
+        migrations.AlterField(
+            model_name='snippet',
+            name='code_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='snippetflag',
+            name='flag',
+            field=models.IntegerField(choices=[(1, 'Spam'), (2, 'Inappropriate'), (3, 'Duplicate')]),
+        ),
+        migrations.AlterField(
+            model_name='snippetflag',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='CodeFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.BigIntegerField()),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snippets.snippet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='codefingerprint',
+            index=models.Index(fields=['fingerprint', 'snippet'], name='code_fingerprint_idx'),
+        ),
+    ]
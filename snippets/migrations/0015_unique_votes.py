@@ -0,0 +1,121 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:18
+
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min
+from django.utils import timezone
+
+# The ranking formulas as of this migration, copied from snippets.ranking
+# so that later changes to it don't change what the migration does
+WILSON_Z = getattr(settings, 'SNIPPETS_WILSON_Z', 1.96)
+HOT_DECAY = getattr(settings, 'SNIPPETS_HOT_DECAY', 45000)
+HOT_EPOCH = 1134028003
+
+
+def wilson_score(score, rating_count):
+    up = (rating_count + score) // 2
+    if not rating_count:
+        return 0.0
+    z, share = WILSON_Z, up / rating_count
+    return ((share + z * z / (2 * rating_count)
+             - z * math.sqrt((share * (1 - share)
+                              + z * z / (4 * rating_count)) / rating_count))
+            / (1 + z * z / rating_count))
+
+
+def hot_score(score, pub_date):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    return round(
+        sign * order + (pub_date.timestamp() - HOT_EPOCH) / HOT_DECAY, 7)
+
+
+def _duplicates(model, keep):
+    """ The rows of model sharing a (user, snippet) pair, but for the one
+    ``keep`` (Min or Max of the id) picks. """
+    pairs = model.objects.order_by().values('user', 'snippet').annotate(
+        rows=Count('pk'), kept=keep('pk')).filter(rows__gt=1)
+    ids = []
+    for pair in pairs:
+        ids += model.objects.filter(
+            user=pair['user'], snippet=pair['snippet']).exclude(
+            pk=pair['kept']).values_list('pk', flat=True)
+    return model.objects.filter(pk__in=ids)
+
+
+def dedupe_votes(apps, schema_editor):
+    """
+    Keep each user's first bookmark and latest rating of a snippet, then
+    repair the counters, ranking scores and bookmark leaderboard the
+    duplicates inflated.
+    """
+    Snippet = apps.get_model('snippets', 'Snippet')
+    Bookmark = apps.get_model('snippets', 'Bookmark')
+    Rating = apps.get_model('snippets', 'Rating')
+    LeaderboardEntry = apps.get_model('snippets', 'LeaderboardEntry')
+    LeaderboardBucket = apps.get_model('snippets', 'LeaderboardBucket')
+
+    bookmarks = _duplicates(Bookmark, Min)
+    ratings = _duplicates(Rating, Max)
+    removed = Counter()
+    for snippet_id, date in bookmarks.values_list('snippet', 'date'):
+        removed[snippet_id, timezone.localdate(date)] += 1
+    touched = set(bookmarks.values_list('snippet', flat=True)) | set(
+        ratings.values_list('snippet', flat=True))
+    bookmarks.delete()
+    ratings.delete()
+
+    today = timezone.localdate()
+    for (snippet_id, day), count in removed.items():
+        LeaderboardBucket.objects.filter(
+            board='bookmarked', object_id=snippet_id, day=day).update(
+            count=F('count') - count)
+        windows = [window for window in (0, 30, 7)
+                   if window == 0 or (today - day).days < window]
+        LeaderboardEntry.objects.filter(
+            board='bookmarked', object_id=snippet_id,
+            window__in=windows).update(score=F('score') - count)
+
+    for snippet in Snippet.objects.filter(pk__in=touched).only(
+            'pub_date'):
+        votes = Rating.objects.filter(snippet=snippet.pk)
+        snippet.score = sum(votes.values_list('rating', flat=True))
+        snippet.rating_count = votes.count()
+        snippet.bookmark_count = Bookmark.objects.filter(
+            snippet=snippet.pk).count()
+        snippet.wilson_score = wilson_score(
+            snippet.score, snippet.rating_count)
+        snippet.hot_score = hot_score(snippet.score, snippet.pub_date)
+        snippet.save(update_fields=[
+            'score', 'rating_count', 'bookmark_count', 'wilson_score',
+            'hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0014_code_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_votes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='snippet_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['language', '-pub_date', '-id'], name='snippet_language_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookmark',
+            constraint=models.UniqueConstraint(fields=('user', 'snippet'), name='bookmark_user_snippet_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('user', 'snippet'), name='rating_user_snippet_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0015_unique_votes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('keyframe', models.BooleanField()),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='snippets.snippet')),
+            ],
+            options={
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='snippetrevision',
+            constraint=models.UniqueConstraint(fields=('snippet', 'number'), name='snippet_revision_unique'),
+        ),
+    ]
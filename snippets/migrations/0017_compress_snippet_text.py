@@ -0,0 +1,68 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:26
+
+from django.db import migrations
+import snippets.fields
+
+FIELDS = ['code', 'description_html', 'highlighted_code']
+BATCH_SIZE = 500
+
+
+def _rewrite(Snippet, write):
+    """ Pass every snippet's text fields to ``write``, in batches. """
+    snippets = Snippet.objects.only(*FIELDS).order_by('pk')
+    last = 0
+    while True:
+        batch = list(snippets.filter(pk__gt=last)[:BATCH_SIZE])
+        if not batch:
+            break
+        write(batch)
+        last = batch[-1].pk
+
+
+def compress_text(apps, schema_editor):
+    """ The columns were converted with their text as it was; save it
+    again, compressed. """
+    Snippet = apps.get_model('snippets', 'Snippet')
+    _rewrite(Snippet, lambda batch: Snippet.objects.bulk_update(batch, FIELDS))
+
+
+def decompress_text(apps, schema_editor):
+    """ Write the text back uncompressed, for the text columns. """
+    Snippet = apps.get_model('snippets', 'Snippet')
+    table = schema_editor.quote_name(Snippet._meta.db_table)
+    assignments = ', '.join(
+        f'{schema_editor.quote_name(field)} = %s' for field in FIELDS)
+
+    def write(batch):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET {assignments} WHERE id = %s',
+                [[getattr(snippet, field) for field in FIELDS] + [snippet.pk]
+                 for snippet in batch])
+    _rewrite(Snippet, write)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0016_snippet_revisions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='snippet',
+            name='code',
+            field=snippets.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='snippet',
+            name='description_html',
+            field=snippets.fields.CompressedTextField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='snippet',
+            name='highlighted_code',
+            field=snippets.fields.CompressedTextField(editable=False),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+    ]
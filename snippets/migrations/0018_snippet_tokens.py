@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0017_compress_snippet_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetTokens',
+            fields=[
+                ('snippet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tokens', serialize=False, to='snippets.snippet')),
+                ('code_hash', models.CharField(max_length=64)),
+                ('language_code', models.CharField(max_length=50)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+FTS_TABLE = 'snippets_snippet_fts'
+
+
+def _fts5(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def _recreate(apps, schema_editor, options):
+    if not _fts5(schema_editor):
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} "
+        f"USING fts5(title, description, code{options})")
+    # Read through the model, which decompresses the code
+    Snippet = apps.get_model('snippets', 'Snippet')
+    rows = Snippet.objects.order_by().values_list(
+        'pk', 'title', 'description', 'code')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, description, code) "
+            f"VALUES (%s, %s, %s, %s)", rows.iterator(chunk_size=500))
+
+
+def make_contentless(apps, schema_editor):
+    _recreate(apps, schema_editor, ", content=''")
+
+
+def keep_content(apps, schema_editor):
+    _recreate(apps, schema_editor, "")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0018_snippet_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_contentless, keep_content),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def drop_all_time_bookmark_entries(apps, schema_editor):
+    # The all-time most bookmarked board now reads Snippet.bookmark_count
+    LeaderboardEntry = apps.get_model('snippets', 'LeaderboardEntry')
+    LeaderboardEntry.objects.filter(board='bookmarked', window=0).delete()
+
+
+def restore_all_time_bookmark_entries(apps, schema_editor):
+    Snippet = apps.get_model('snippets', 'Snippet')
+    LeaderboardEntry = apps.get_model('snippets', 'LeaderboardEntry')
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(board='bookmarked', window=0, object_id=pk,
+                          score=count)
+         for pk, count in Snippet.objects.filter(
+             bookmark_count__gt=0).values_list('pk', 'bookmark_count')],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0019_contentless_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_all_time_bookmark_entries,
+                             restore_all_time_bookmark_entries),
+    ]
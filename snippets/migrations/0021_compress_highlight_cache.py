@@ -0,0 +1,24 @@
+from django.db import migrations
+import snippets.fields
+
+
+def empty_cache(apps, schema_editor):
+    # Cached renderings are rebuilt on demand; dropping them is cheaper
+    # than rewriting each one compressed
+    apps.get_model('snippets', 'HighlightCache').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0020_drop_all_time_bookmark_entries'),
+    ]
+
+    operations = [
+        migrations.RunPython(empty_cache, empty_cache),
+        migrations.AlterField(
+            model_name='highlightcache',
+            name='html',
+            field=snippets.fields.CompressedTextField(),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0021_compress_highlight_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='highlightcache',
+            name='last_used',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
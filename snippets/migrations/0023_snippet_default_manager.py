@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:14
+
+from django.db import migrations
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0022_highlight_cache_last_used'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='snippet',
+            options={'default_manager_name': 'objects_with_text', 'ordering': ['-pub_date']},
+        ),
+        migrations.AlterModelManagers(
+            name='snippet',
+            managers=[
+                ('objects_with_text', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
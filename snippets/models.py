@@ -1,13 +1,12 @@
+import hashlib
+
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
 
-from markdown import markdown
-# http://pygments.org/docs/lexers/
-from pygments import formatters, highlight, lexers
-
-from . import managers
+from . import highlighting, managers, ranking, rendering, tokens
+from .fields import CompressedTextField
 
 
 class Language(models.Model):
@@ -42,7 +41,7 @@ class Language(models.Model):
 
     def get_lexer(self):
         """ Return a lexer (rules) for a particular language. """
-        return lexers.get_lexer_by_name(self.language_code)
+        return highlighting.get_lexer(self.language_code)
 
 
 class Snippet(models.Model):
@@ -55,83 +54,281 @@ class Snippet(models.Model):
     description_html: Store an HTML version of the entered description
     code: The actual code entered by the author
     highlighted_code: A syntax-highlighted HTML version of the original code.
-    tags: A list of tags to categorize the snippet
+    tags: The tags categorizing the snippet, through SnippetTag
     pub_date: The date and time when the snippet was first posted
     updated_date: The date and time when the snippet was last updated.
+    score: Running sum of the ratings attached to the snippet
+    rating_count: Running number of ratings attached to the snippet
+    bookmark_count: Running number of bookmarks pointing at the snippet
+    render_status: Whether description_html and highlighted_code are
+                current, or still waiting on a render worker
+    render_version: The renderer (Markdown, Pygments and formatter options)
+                that produced description_html and highlighted_code
+    code_hash: sha256 of the code, used as its HTTP validator
+    wilson_score: Lower bound of the Wilson interval on the share of up
+                votes, the default top-rated ranking
+    hot_score: Votes on a log scale plus a term growing with pub_date, the
+                "hot" top-rated ranking (see snippets.ranking)
     """
+    RENDER_READY = 0
+    RENDER_PENDING = 1
+    RENDER_FAILED = 2
+    RENDER_STATUS_CHOICES = (
+        (RENDER_READY, 'Ready'),
+        (RENDER_PENDING, 'Pending'),
+        (RENDER_FAILED, 'Failed'),
+    )
+    # Updated only in place, by the vote managers, recount() and rerank();
+    # save() leaves them out so it can't undo a concurrent vote
+    COUNTER_FIELDS = ('score', 'rating_count', 'bookmark_count',
+                      'wilson_score', 'hot_score')
+
     title = models.CharField(max_length=255)
     language = models.ForeignKey(Language, on_delete=models.CASCADE)
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     description = models.TextField()
-    description_html = models.TextField(editable=False)
-    code = models.TextField()
-    highlighted_code = models.TextField(editable=False)
-    # TODO: Tag field
+    # The three large columns are stored compressed (see snippets.fields)
+    description_html = CompressedTextField(editable=False)
+    code = CompressedTextField()
+    highlighted_code = CompressedTextField(editable=False)
+    tags = models.ManyToManyField(
+        'Tag', through='SnippetTag', blank=True, related_name='snippets')
     pub_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True)
+    # Denormalized counters, kept in step by the rating and bookmark
+    # managers and signals and repaired by ``manage.py recount_snippets``.
+    # save() never writes them (see COUNTER_FIELDS).
+    score = models.IntegerField(default=0, db_index=True, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    bookmark_count = models.PositiveIntegerField(
+        default=0, db_index=True, editable=False)
+    render_status = models.PositiveSmallIntegerField(
+        choices=RENDER_STATUS_CHOICES, default=RENDER_READY, db_index=True,
+        editable=False)
+    render_version = models.CharField(
+        max_length=100, blank=True, editable=False)
+    code_hash = models.CharField(
+        max_length=64, blank=True, db_index=True, editable=False)
+    # Derived from score and rating_count by SnippetManager.rerank()
+    wilson_score = models.FloatField(default=0, editable=False)
+    hot_score = models.FloatField(default=0, editable=False)
 
     objects = managers.SnippetManager()
+    # Loads every column: the default manager, which the admin, dumpdata
+    # and serializers use and then read each row's text from
+    objects_with_text = managers.SnippetManager(deferred=())
 
     class Meta:
         # Logical ordering of the snippet by descending order
         ordering = ['-pub_date']
+        default_manager_name = 'objects_with_text'
+        indexes = [
+            # Seek index for keyset pagination of the listings
+            models.Index(fields=['-pub_date', '-id'],
+                         name='snippet_pub_date_id_idx'),
+            # The same for the per-author and per-language listings and
+            # feeds
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='snippet_author_pub_date_idx'),
+            models.Index(fields=['language', '-pub_date', '-id'],
+                         name='snippet_language_pub_date_idx'),
+            # Seek indexes for the top-rated listings
+            models.Index(fields=['-wilson_score', '-id'],
+                         name='snippet_wilson_id_idx'),
+            models.Index(fields=['-hot_score', '-id'],
+                         name='snippet_hot_id_idx'),
+        ]
 
     def __str__(self):
         """ String representation of a Snippet. """
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so save() can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
         """
-        Line 1 converts the plain-text description to HTML,
-        and store that in the description_html field.
-        Line 2 does the syntax highlighting, and store the resulting HTML
-        in the highlighted_code field.
+        Converts the plain-text description to HTML, and store that in the
+        description_html field. Does the syntax highlighting, and store the
+        resulting HTML in the highlighted_code field.
+        Either step is skipped when its input is unchanged since the snippet
+        was loaded. With SNIPPETS_ASYNC_RENDER on, both are left to a render
+        worker instead and the snippet is saved as pending.
         """
-        self.description_html = markdown(self.description)
-        self.highlighted_code = self.highlight()
+        loaded = getattr(self, '_loaded_values', {})
+        # Fields left unloaded can't have changed
+        unloaded = self.get_deferred_fields()
+        # HTML from an older renderer is redone in full
+        stale = 'render_version' not in unloaded and \
+            self.render_version != rendering.RENDERER_VERSION
+
+        def changed(name):
+            return name not in unloaded and \
+                getattr(self, name) != loaded.get(name)
+
+        def missing(name):
+            return name not in unloaded and not getattr(self, name)
+
+        description_changed = 'description' not in unloaded and (
+            stale or missing('description_html') or changed('description'))
+        code_changed = changed('language_id') or 'code' not in unloaded and (
+            stale or missing('highlighted_code') or changed('code'))
+        deferred = rendering.ASYNC_RENDER and (
+            description_changed or code_changed)
+        stream = None
+        if deferred:
+            if description_changed:
+                self.description_html = ''
+            if code_changed:
+                self.highlighted_code = ''
+            self.render_status = self.RENDER_PENDING
+        else:
+            if description_changed:
+                self.description_html = rendering.render_description(
+                    self.description)
+            if code_changed:
+                # Lexed once, for the HTML and, after the commit, the
+                # indexes (see snippets.signals)
+                language_code = self.language.language_code
+                lexed = self.__dict__.pop('_lexed', None)
+                if lexed is not None and lexed[:2] == (
+                        self.code, language_code):
+                    stream = lexed[2]
+                else:
+                    stream = tokens.lex(self.code, language_code)
+                self.highlighted_code = highlighting.highlight(
+                    self.code, self.language.language_code, stream)
+            self.render_status = self.RENDER_READY
+            self.render_version = rendering.RENDERER_VERSION
+        if 'code' not in unloaded:
+            self.code_hash = self.hash_code(self.code)
+        if self._state.adding:
+            self.hot_score = ranking.hot_score(
+                self.score, self.pub_date or timezone.now())
+        elif not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            unloaded = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in unloaded
+                and field.name not in self.COUNTER_FIELDS]
+        self._stream = stream
         super(Snippet, self).save(*args, **kwargs)
+        unloaded = self.get_deferred_fields()
+        loaded.update(
+            (name, getattr(self, name)) for name in (
+                'title', 'description', 'code', 'language_id', 'author_id')
+            if name not in unloaded)
+        self._loaded_values = loaded
+        if deferred:
+            transaction.on_commit(lambda: rendering.enqueue(self.pk))
+
+    @staticmethod
+    def hash_code(code):
+        return hashlib.sha256(code.encode('utf-8')).hexdigest()
 
     def get_absolute_url(self):
         return reverse('snippets:detail', args=[str(self.id)])
 
     def highlight(self):
         """
-        The highlight() function produce the highlighted output. Takes 3 args
-            code - The code to highlight
-            lexer - The lexer to use
-            formatter - The formatter to generate the output
-        linenos=True - Generates the output with line numbers
+        Produce the highlighted output of the code with line numbers,
+        through the content-addressed cache in snippets.highlighting.
         """
-        return highlight(
-            self.code, self.language.get_lexer(),
-            formatters.HtmlFormatter(linenos=True))
+        return highlighting.highlight(self.code, self.language.language_code)
 
     def get_score(self):
         """
-        Calculate a snippet's total score by summing all ratings attached to it
+        Return a snippet's total score, the sum of all ratings attached to it.
+        The value is read from the denormalized ``score`` column.
         """
-        return self.rating_set.aggregate(Sum('rating'))
+        return self.score
+
+
+class SnippetRevision(models.Model):
+    """ One version of a snippet's code, kept for its history.
+
+    snippet: The snippet the version belongs to
+    number: Position of the version in the snippet's history, from 1
+    keyframe: Whether data holds the whole code rather than a delta
+                against the previous version (see snippets.revisions)
+    data: The zlib-compressed code or delta
+    size: Length of the code in this version, in characters
+    created: When the version was saved
+    """
+    snippet = models.ForeignKey(
+        Snippet, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    keyframe = models.BooleanField()
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['snippet', 'number'],
+                                    name='snippet_revision_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.snippet_id} revision {self.number}"
+
+    def get_absolute_url(self):
+        return reverse('snippets:revision', args=[self.snippet_id,
+                                                  self.number])
+
+
+class SnippetTokens(models.Model):
+    """ The Pygments token stream of a snippet's code.
+
+    snippet: The snippet the code belongs to
+    code_hash: code_hash of the code the tokens were lexed from
+    language_code: The lexer the tokens came from
+    data: The encoded stream (see snippets.tokens)
+    """
+    snippet = models.OneToOneField(
+        Snippet, on_delete=models.CASCADE, primary_key=True,
+        related_name='tokens')
+    code_hash = models.CharField(max_length=64)
+    language_code = models.CharField(max_length=50)
+    data = models.BinaryField()
+
+    objects = managers.UpsertManager()
+
+    def __str__(self):
+        return f"Tokens of {self.snippet_id}"
 
 
 class SnippetFlag(models.Model):
     FLAG_SPAM = 1
     FLAG_INAPPROPRIATE = 2
+    FLAG_DUPLICATE = 3
     FLAG_CHOICES = (
         (FLAG_SPAM, 'Spam'),
         (FLAG_INAPPROPRIATE, 'Inappropriate'),
+        (FLAG_DUPLICATE, 'Duplicate'),
     )
     snippet = models.ForeignKey(
         Snippet, related_name='flags', on_delete=models.CASCADE)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+    # Empty for flags raised by the duplicate check rather than a user
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
                              on_delete=models.CASCADE)
     flag = models.IntegerField(choices=FLAG_CHOICES)
+    duplicate_of = models.ForeignKey(
+        Snippet, null=True, blank=True, related_name='+',
+        on_delete=models.SET_NULL)
 
     def __str__(self):
         return '{} flagged as {} by {}'.format(
             self.snippet.title,
             self.get_flag_display(),
-            self.user.username,
+            self.user.username if self.user else 'the duplicate check',
         )
 
     def remove_and_ban(self):
@@ -142,6 +339,132 @@ class SnippetFlag(models.Model):
         self.snippet.delete()
 
 
+class Tag(models.Model):
+    """ A tag snippets are categorized with.
+
+    name: The tag itself, lowercase, unique and usable in URLs
+    snippet_count: Running number of snippets carrying the tag
+    """
+    name = models.SlugField(max_length=50, unique=True)
+    # Denormalized counter, kept in step by the snippet tag signals and
+    # repaired by ``manage.py recount_snippets``.
+    snippet_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = managers.TagManager()
+
+    class Meta:
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['-snippet_count', 'name'],
+                         name='tag_count_name_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('tags:detail', args=[self.name])
+
+
+class SnippetTag(models.Model):
+    """ A snippet carrying a tag. """
+    snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            # Tag first, so intersecting tags reads only this index
+            models.UniqueConstraint(fields=['tag', 'snippet'],
+                                    name='snippet_tag_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.snippet} tagged {self.tag}"
+
+
+class SnippetSignature(models.Model):
+    """ A snippet's MinHash signature and the LSH buckets it falls in.
+
+    snippet: The snippet the signature was computed from
+    signature: The packed MinHash values (see snippets.related)
+    """
+    snippet = models.OneToOneField(
+        Snippet, on_delete=models.CASCADE, primary_key=True,
+        related_name='signature')
+    signature = models.BinaryField()
+
+    def __str__(self):
+        return f"Signature of {self.snippet_id}"
+
+
+class SignatureBucket(models.Model):
+    """ One LSH band of a snippet's signature; snippets sharing a bucket in
+    any band are candidate neighbours.
+
+    snippet: The snippet the band belongs to
+    band: Position of the band in the signature
+    bucket: Hash of the band's MinHash values
+    """
+    snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket'],
+                         name='signature_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.snippet_id} in {self.band}:{self.bucket}"
+
+
+class RelatedSnippet(models.Model):
+    """ One of a snippet's precomputed nearest neighbours.
+
+    snippet: The snippet the neighbour is listed for
+    related: The neighbouring snippet
+    score: Estimated Jaccard similarity of the two snippets' features
+    """
+    snippet = models.ForeignKey(
+        Snippet, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(
+        Snippet, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snippet', 'related'],
+                                    name='related_snippet_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['snippet', '-score'],
+                         name='related_snippet_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.related_id} related to {self.snippet_id}"
+
+
+class CodeFingerprint(models.Model):
+    """ One winnowed shingle hash of a snippet's normalized code.
+
+    snippet: The snippet the code belongs to
+    fingerprint: Hash of a run of normalized tokens (see snippets.duplicates)
+    """
+    snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE)
+    fingerprint = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fingerprint', 'snippet'],
+                         name='code_fingerprint_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.fingerprint} in {self.snippet_id}"
+
+
 class Bookmark(models.Model):
     """ Model to represent a User's favorite snippets. """
     snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE)
@@ -151,8 +474,18 @@ class Bookmark(models.Model):
         related_name='bookmarks')
     date = models.DateTimeField(auto_now_add=True)
 
+    objects = managers.BookmarkManager()
+
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'],
+                         name='bookmark_user_date_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'snippet'],
+                                    name='bookmark_user_snippet_unique'),
+        ]
 
     def __str__(self):
         return f"{self.snippet} bookmarked by {self.user}"
@@ -171,7 +504,126 @@ class Rating(models.Model):
     rating = models.IntegerField(choices=RATING_CHOICES)
     date = models.DateTimeField(auto_now_add=True)
 
+    objects = managers.RatingManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'snippet'],
+                                    name='rating_user_snippet_unique'),
+        ]
+
     def __str__(self):
         return "{} rating {} ({})".format(self.user,
                                           self.snippet,
                                           self.get_rating_display())
+
+
+class HighlightCache(models.Model):
+    """ Highlighted HTML keyed by a hash of everything that shaped it.
+
+    key: sha256 of the code, lexer name, formatter options and Pygments
+         version (see snippets.highlighting.cache_key)
+    html: The highlighted HTML, compressed like Snippet.highlighted_code
+    last_used: When the rendering was last read from the table, to the
+               day (see snippets.highlighting.prune)
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    html = CompressedTextField()
+    created = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Checkpoint(models.Model):
+    """ Progress marker for resumable batch jobs.
+
+    name: Identifies the job, e.g. "import:/path/to/dump.jsonl"
+    position: Job-specific resume point (a byte offset, a primary key...)
+    """
+    name = models.CharField(max_length=255, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+
+class LeaderboardEntry(models.Model):
+    """ An object's materialized score on one leaderboard window.
+
+    board: Which leaderboard (top authors, top languages, most bookmarked)
+    window: The number of days the score covers, 0 meaning all time (not
+                stored for the most bookmarked board, which reads
+                Snippet.bookmark_count instead)
+    object_id: Primary key of the user, language or snippet ranked
+    score: Number of snippets (or bookmarks) counted in the window
+    """
+    BOARD_AUTHORS = 'authors'
+    BOARD_LANGUAGES = 'languages'
+    BOARD_BOOKMARKED = 'bookmarked'
+    BOARD_CHOICES = (
+        (BOARD_AUTHORS, 'Top authors'),
+        (BOARD_LANGUAGES, 'Top languages'),
+        (BOARD_BOOKMARKED, 'Most bookmarked'),
+    )
+    WINDOW_ALL = 0
+    WINDOW_MONTH = 30
+    WINDOW_WEEK = 7
+    WINDOW_CHOICES = (
+        (WINDOW_ALL, 'All time'),
+        (WINDOW_MONTH, 'Last 30 days'),
+        (WINDOW_WEEK, 'Last 7 days'),
+    )
+    board = models.CharField(max_length=20, choices=BOARD_CHOICES)
+    window = models.PositiveSmallIntegerField(choices=WINDOW_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    score = models.IntegerField(default=0)
+
+    objects = managers.UpsertManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['board', 'window', 'object_id'],
+                name='leaderboard_entry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['board', 'window', '-score'],
+                         name='leaderboard_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.board}/{self.window}: {self.object_id} ({self.score})"
+
+
+class LeaderboardBucket(models.Model):
+    """ Per-day event counts the windowed leaderboards are compacted from.
+
+    board: Which leaderboard the events count towards
+    object_id: Primary key of the user, language or snippet concerned
+    day: The day the snippets (or bookmarks) were created
+    count: Number of those still existing
+    """
+    board = models.CharField(
+        max_length=20, choices=LeaderboardEntry.BOARD_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    objects = managers.UpsertManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['board', 'object_id', 'day'],
+                name='leaderboard_bucket_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['board', 'day'],
+                         name='leaderboard_bucket_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.board}: {self.object_id} on {self.day} ({self.count})"
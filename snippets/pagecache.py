@@ -0,0 +1,134 @@
+"""
+Caching of the pages anonymous visitors get, and of page fragments.
+
+Cache keys carry generation counters rather than being deleted: a page's
+key includes the current generation of every scope it depends on (the
+snippet, the language, the listings, the popular pages) and of the
+``site`` scope every page depends on. A write bumps the generations of
+the scopes it affects, one cache write each, so the next request misses
+and renders afresh; the stale entries are never read again and expire.
+
+A generation is a random token, not a number: one that is evicted comes
+back as a new token, so no old key can ever match again. Only get, add
+and set are used, so any cache backend works, local-memory and
+file-based included.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'SNIPPETS_PAGE_CACHE_TIMEOUT', 60 * 10)
+
+SITE = ('site', None)
+LIST = ('list', None)
+POPULAR = ('popular', None)
+
+
+def _generation_key(scope):
+    name, pk = scope
+    return f'snippets:generation:{name}:{pk}'
+
+
+def generations(scopes):
+    """ The current generation tokens of the scopes, in order. """
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        # add() loses to a concurrent add; read back whichever won
+        found.update(cache.get_many(missing))
+    return [found.get(key, '') for key in keys]
+
+
+def bump(scopes):
+    """ Start new generations of the scopes, invalidating every page and
+    fragment cached under the old ones. """
+    cache.set_many({_generation_key(scope): uuid.uuid4().hex
+                    for scope in scopes}, None)
+
+
+def snippet_scope(snippet_id):
+    return ('snippet', int(snippet_id))
+
+
+def language_scope(slug):
+    return ('language', slug)
+
+
+def invalidate(snippet_ids=(), language_ids=(), listings=False,
+               popular=False):
+    """ Bump the scopes a change to the given snippets and languages
+    affects. """
+    from .models import Language
+
+    scopes = [snippet_scope(pk) for pk in snippet_ids]
+    if language_ids:
+        scopes += [language_scope(slug) for slug in Language.objects.filter(
+            pk__in=language_ids).values_list('slug', flat=True)]
+    if listings:
+        scopes.append(LIST)
+    if popular:
+        scopes.append(POPULAR)
+    if scopes:
+        bump(scopes)
+
+
+def invalidate_all():
+    """ Invalidate every cached page and fragment, after bulk changes. """
+    bump([SITE])
+
+
+def fragment_generation(scope):
+    """ A {% cache %} vary-on value for a fragment depending on the scope.
+    """
+    return ':'.join(generations([SITE, scope]))
+
+
+def _anonymous(request):
+    return not any(name in request.COOKIES for name in (
+        settings.SESSION_COOKIE_NAME, CookieStorage.cookie_name))
+
+
+def cache_anonymous(*scopes):
+    """
+    Cache a view's 200 responses to anonymous GET and HEAD requests for
+    PAGE_CACHE_TIMEOUT seconds, per full path. Each scope is a (name, pk)
+    pair, or a function of the view's arguments returning one.
+
+    A request is anonymous when it carries no session or messages cookie,
+    which is decided without loading the session. Responses that set
+    cookies (a CSRF token, consumed messages) are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or \
+                    not _anonymous(request):
+                return view(request, *args, **kwargs)
+            resolved = [SITE] + [
+                scope(*args, **kwargs) if callable(scope) else scope
+                for scope in scopes]
+            material = '|'.join(
+                [view.__module__, view.__name__, request.get_full_path()]
+                + generations(resolved))
+            key = 'snippets:page:' + hashlib.md5(
+                material.encode()).hexdigest()
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming \
+                    and not response.cookies:
+                cache.set(key, (response.content, response['Content-Type']),
+                          PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,154 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGINATE_BY = getattr(settings, 'SNIPPETS_PAGINATE_BY', 20)
+COUNT_CACHE_TIMEOUT = getattr(settings, 'SNIPPETS_COUNT_CACHE_TIMEOUT', 300)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """ DjangoJSONEncoder rounds datetimes to milliseconds, which would make
+    cursors skip rows that differ only in microseconds. """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    """ One page of a KeysetPaginator, with opaque cursors to its
+    neighbours. """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by seeking past the last row seen instead of using
+    OFFSET, so page 1,000 costs the same single indexed query as page 1 and
+    no COUNT(*) is ever run.
+
+    ordering: the keys to order and seek on, e.g. ('-pub_date', '-id'). The
+              last key must be unique so every row has a distinct position.
+    Cursors are URL-safe tokens encoding the boundary row's keys and the
+    direction to move in.
+    """
+
+    def __init__(self, queryset, ordering=('-pub_date', '-id'),
+                 per_page=PAGINATE_BY):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = [(key.lstrip('-'), key.startswith('-'))
+                     for key in ordering]
+
+    def page(self, cursor=None):
+        """ Return the page a cursor points at, or the first page. """
+        if cursor:
+            values, forward = self.decode_cursor(cursor)
+        else:
+            values, forward = None, True
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+        queryset = queryset.order_by(*self._ordering(forward))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        if forward:
+            has_next, has_previous = has_more, values is not None
+        else:
+            has_next, has_previous = True, has_more
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], True)
+            if has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], False)
+            if has_previous else None)
+
+    def get_page(self, cursor=None):
+        """ Like page(), but fall back to the first page on a bad cursor. """
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+    def encode_cursor(self, obj, forward):
+        # Rows are model instances, or dicts from a .values() queryset
+        payload = {
+            'k': [obj[name] if isinstance(obj, dict) else getattr(obj, name)
+                  for name, _ in self.keys],
+            'd': 'n' if forward else 'p',
+        }
+        data = json.dumps(payload, cls=CursorEncoder,
+                          separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            raw_values, direction = payload['k'], payload['d']
+            if (len(raw_values) != len(self.keys)
+                    or direction not in ('n', 'p')):
+                raise InvalidCursor(cursor)
+            opts = self.queryset.model._meta
+            values = [opts.get_field(name).to_python(value)
+                      for (name, _), value in zip(self.keys, raw_values)]
+        except (binascii.Error, ValueError, KeyError, TypeError,
+                ValidationError):
+            raise InvalidCursor(cursor)
+        return values, direction == 'n'
+
+    def _ordering(self, forward):
+        # Walking backwards reads the index in reverse and flips the rows
+        # back into display order afterwards.
+        return [('-' if descending == forward else '') + name
+                for name, descending in self.keys]
+
+    def _seek(self, values, forward):
+        """ Build (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... """
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+
+def approximate_count(key, queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """ Return queryset.count(), cached for ``timeout`` seconds. """
+    return cache.get_or_set(f'snippets:count:{key}', queryset.count, timeout)
@@ -0,0 +1,157 @@
+"""
+Per-request query accounting.
+
+``QueryCountMiddleware`` records how many queries each request ran and how
+long they took, totalled per resolved URL name in ``view_stats`` (requests
+that resolve to no view share one UNRESOLVED entry), and looks
+for the same query shape (the SQL with its parameters left out, and IN
+lists collapsed) run SNIPPETS_QUERY_REPEAT_THRESHOLD times or more: the
+mark of an N+1 loop. Those are logged as warnings, or raised as
+RepeatedQueries with DEBUG and ``SNIPPETS_QUERY_RAISE_ON_REPEAT`` on.
+
+The middleware runs natively under both WSGI and ASGI. Recorders are
+found through a context variable by an execute wrapper installed on every
+connection, so queries the async views run through sync_to_async() in
+other threads are counted too.
+
+Queries a StreamingHttpResponse runs while it is being sent happen after
+the middleware has returned and are not counted.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+REPEAT_THRESHOLD = getattr(settings, 'SNIPPETS_QUERY_REPEAT_THRESHOLD', 5)
+RAISE_ON_REPEAT = getattr(settings, 'SNIPPETS_QUERY_RAISE_ON_REPEAT', False)
+
+_IN_RE = re.compile(r'IN \((?:%s, )*%s\)')
+# Transaction control repeats with every atomic block; it is never N+1
+_TRANSACTION_RE = re.compile(r'(BEGIN|SAVEPOINT|RELEASE|ROLLBACK)\b')
+
+# URL name -> [requests, queries, seconds in the database]
+view_stats = defaultdict(lambda: [0, 0, 0.0])
+UNRESOLVED = '<unresolved>'
+
+# The QueryRecorders active in the current context, innermost last
+_recorders = contextvars.ContextVar('snippets_query_recorders', default=())
+
+
+class RepeatedQueries(Exception):
+    pass
+
+
+def shape(sql):
+    return _IN_RE.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """ A database execute wrapper counting and timing queries by shape. """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.shapes[shape(sql)] += 1
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        """ {shape: times run} for the shapes run ``threshold`` times or
+        more. """
+        return {sql: count for sql, count in self.shapes.items()
+                if count >= threshold and not _TRANSACTION_RE.match(sql)}
+
+
+def _record(execute, sql, params, many, context):
+    for recorder in _recorders.get():
+        execute = functools.partial(recorder, execute)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install(sender, connection, **kwargs):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+@contextmanager
+def record_queries():
+    """ Record the queries run on every connection inside the block,
+    including from threads it hands work to with sync_to_async(). """
+    for connection in connections.all():
+        _install(None, connection)
+    recorder = QueryRecorder()
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+class QueryCountMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function, as Django's
+            # MiddlewareMixin does, so the handler awaits it
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        # Unresolved paths share one entry, so 404 probes can't grow the
+        # table without bound
+        match = request.resolver_match
+        name = match.view_name if match else UNRESOLVED
+        stats = view_stats[name]
+        stats[0] += 1
+        stats[1] += recorder.count
+        stats[2] += recorder.time
+        logger.debug("%s: %d queries in %.1fms", name, recorder.count,
+                     recorder.time * 1000)
+
+        repeated = recorder.repeated()
+        if repeated:
+            message = "%s ran the same query shape repeatedly: %s" % (
+                name, '; '.join(f'{count}x {sql}'
+                                for sql, count in repeated.items()))
+            if settings.DEBUG and RAISE_ON_REPEAT:
+                raise RepeatedQueries(message)
+            logger.warning(message)
+
+        if settings.DEBUG:
+            response.headers['X-Query-Count'] = str(recorder.count)
+            response.headers['X-Query-Time'] = f'{recorder.time * 1000:.1f}ms'
+        return response
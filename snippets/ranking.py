@@ -0,0 +1,53 @@
+"""
+Stored ranking scores for the top-rated listings.
+
+Ratings are up (+1) or down (-1) votes, so a snippet's ``score`` and
+``rating_count`` give its vote tally. Two scores are derived from it and
+stored on the snippet, where they can be indexed:
+
+* ``wilson_score``, the lower bound of the Wilson score interval on the
+  share of up votes: a snippet with 9 of 10 up ranks above one with 1 of 1.
+* ``hot_score``, the net vote count on a log scale plus a term growing
+  with the posting date, so that a tenfold lead in votes is worth
+  ``SNIPPETS_HOT_DECAY`` seconds of newness. The score never changes
+  while the votes don't, so it needs no periodic recomputation.
+"""
+import math
+
+from django.conf import settings
+
+WILSON_Z = getattr(settings, 'SNIPPETS_WILSON_Z', 1.96)
+HOT_DECAY = getattr(settings, 'SNIPPETS_HOT_DECAY', 45000)
+# Start of the hot score's time axis (2005-12-08), keeping values small
+HOT_EPOCH = 1134028003
+
+
+def votes(score, rating_count):
+    """ Split a snippet's score and rating count into (up, down) votes. """
+    up = (rating_count + score) // 2
+    return up, rating_count - up
+
+
+def wilson_score(score, rating_count, z=WILSON_Z):
+    up, down = votes(score, rating_count)
+    total = up + down
+    if not total:
+        return 0.0
+    share = up / total
+    return ((share + z * z / (2 * total)
+             - z * math.sqrt((share * (1 - share) + z * z / (4 * total))
+                             / total))
+            / (1 + z * z / total))
+
+
+def hot_score(score, pub_date, decay=HOT_DECAY):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    return round(sign * order + (pub_date.timestamp() - HOT_EPOCH) / decay, 7)
+
+
+# Keyset orderings of the top-rated listings, each backed by an index
+ORDERINGS = {
+    'wilson': ('-wilson_score', '-id'),
+    'hot': ('-hot_score', '-id'),
+}
@@ -0,0 +1,263 @@
+"""
+Related snippets from a precomputed MinHash/LSH similarity index.
+
+A snippet's features are the identifiers in its code (Pygments ``Name``
+tokens, which include imported modules) and the words of its title and
+description. The identifiers come from the tokens the code is
+highlighted from, or from its stored token stream, so the code isn't
+lexed for this alone. The features' MinHash signature estimates the
+Jaccard similarity of two feature sets, and is split into bands:
+snippets sharing a band's bucket are the only candidates compared, so
+refreshing snippets never scans the table.
+
+``refresh()`` runs for saved snippets once they are committed. It
+replaces their own top ``SNIPPETS_RELATED_COUNT`` neighbours and adds
+them to the lists of those neighbours; lists they drop out of are only
+repaired by their own refresh or by ``manage.py rebuild_related``.
+"""
+import array
+import hashlib
+import random
+import re
+import zlib
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from pygments.token import Name
+
+from . import pagecache, tokens
+from .models import RelatedSnippet, SignatureBucket, Snippet, SnippetSignature
+
+RELATED_COUNT = getattr(settings, 'SNIPPETS_RELATED_COUNT', 5)
+# Estimated Jaccard similarity below which snippets aren't related
+MIN_SIMILARITY = getattr(settings, 'SNIPPETS_RELATED_MIN_SIMILARITY', 0.2)
+# At 20 bands of 3, pairs at 0.5 similarity share a bucket 93% of the time
+# and pairs at 0.2 only 15%.
+BANDS = 20
+ROWS = 3
+# Candidates compared per snippet, in case a bucket grows very large
+MAX_CANDIDATES = 500
+# Buckets or snippets per lookup query, within SQLite's parameter limit
+LOOKUP_CHUNK = 2000
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20091)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+                 for _ in range(BANDS * ROWS)]
+_WORD_RE = re.compile(r'[a-z][a-z0-9_]{2,}')
+
+
+def code_names(stream):
+    """ The identifiers in lexed code. """
+    return {value for ttype, value in stream
+            if ttype in Name and len(value) > 1}
+
+
+def features(title, description, names):
+    """ The set of identifiers and words similarity is measured over. """
+    found = {'w:' + word for word in _WORD_RE.findall(
+        f'{title} {description}'.lower())}
+    found.update('n:' + name for name in names)
+    return found
+
+
+def signature(feature_set):
+    """ MinHash the features; None for an empty set. """
+    if not feature_set:
+        return None
+    hashes = [zlib.crc32(feature.encode('utf-8')) for feature in feature_set]
+    return array.array('I', (
+        min((a * h + b) % _PRIME for h in hashes) & 0xffffffff
+        for a, b in _PERMUTATIONS))
+
+
+def buckets(sig):
+    """ Yield (band, bucket) for each band of a signature. """
+    for band in range(BANDS):
+        rows = sig[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(rows, digest_size=8).digest()
+        yield band, int.from_bytes(digest, 'big') >> 1
+
+
+def similarity(sig, other):
+    return sum(a == b for a, b in zip(sig, other)) / len(sig)
+
+
+def _unpack(data):
+    return array.array('I', bytes(data))
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        yield values[start:start + LOOKUP_CHUNK]
+
+
+def index_snippets(snippets, names=None):
+    """
+    Store the signatures and buckets of the given snippets (which need
+    their language loaded). ``names`` maps pks to the identifiers in
+    their code (see code_names()); the others' are read from their token
+    streams. Returns {snippet pk: signature}.
+    """
+    names = dict(names or {})
+    missing = [snippet for snippet in snippets if snippet.pk not in names]
+    if missing:
+        names.update((pk, code_names(stream)) for pk, stream in
+                     tokens.streams_of(missing).items())
+    signatures = {}
+    for snippet in snippets:
+        sig = signature(features(snippet.title, snippet.description,
+                                 names[snippet.pk]))
+        if sig is not None:
+            signatures[snippet.pk] = sig
+    pks = [snippet.pk for snippet in snippets]
+    with transaction.atomic():
+        SnippetSignature.objects.filter(snippet__in=pks).delete()
+        SignatureBucket.objects.filter(snippet__in=pks).delete()
+        SnippetSignature.objects.bulk_create(
+            [SnippetSignature(snippet_id=pk, signature=sig.tobytes())
+             for pk, sig in signatures.items()])
+        SignatureBucket.objects.bulk_create(
+            [SignatureBucket(snippet_id=pk, band=band, bucket=bucket)
+             for pk, sig in signatures.items()
+             for band, bucket in buckets(sig)],
+            batch_size=1000)
+    return signatures
+
+
+def neighbours_many(signatures):
+    """
+    Return {pk: [(score, pk)]}, the top neighbours of each of the given
+    {pk: signature}, looking the candidates of them all up together: one
+    query per LOOKUP_CHUNK buckets, and one per LOOKUP_CHUNK candidates.
+    """
+    keys = {pk: set(buckets(sig)) for pk, sig in signatures.items()}
+    holders = defaultdict(list)
+    for chunk in _chunks({bucket for found in keys.values()
+                          for _, bucket in found}):
+        for band, bucket, pk in SignatureBucket.objects.filter(
+                band__in=range(BANDS), bucket__in=chunk).values_list(
+                'band', 'bucket', 'snippet'):
+            holders[band, bucket].append(pk)
+    candidates = {}
+    for pk, found in keys.items():
+        shared = Counter(other for key in found for other in holders[key]
+                         if other != pk)
+        # The candidates sharing the most buckets are the likeliest
+        candidates[pk] = [other for other, _ in
+                          shared.most_common(MAX_CANDIDATES)]
+    stored = {}
+    for chunk in _chunks({other for found in candidates.values()
+                          for other in found}):
+        stored.update(
+            (other, _unpack(data)) for other, data in
+            SnippetSignature.objects.filter(snippet__in=chunk).values_list(
+                'snippet', 'signature'))
+    found = {}
+    for pk, sig in signatures.items():
+        scored = []
+        for other in candidates[pk]:
+            if other in stored:
+                score = similarity(sig, stored[other])
+                if score >= MIN_SIMILARITY:
+                    scored.append((score, other))
+        scored.sort(reverse=True)
+        found[pk] = scored[:RELATED_COUNT]
+    return found
+
+
+def neighbours(snippet_id, sig):
+    """ Return the [(score, pk)] of the snippet's top neighbours. """
+    return neighbours_many({snippet_id: sig})[snippet_id]
+
+
+def _trim(snippet_ids):
+    """ Keep only the best RELATED_COUNT entries of each snippet's list,
+    in one statement. """
+    table = RelatedSnippet._meta.db_table
+    for chunk in _chunks(snippet_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+                f"PARTITION BY snippet_id ORDER BY score DESC, related_id"
+                f") AS position FROM {table} WHERE snippet_id IN "
+                f"({', '.join(['%s'] * len(chunk))})) ranked "
+                f"WHERE position > %s)", [*chunk, RELATED_COUNT])
+
+
+@transaction.atomic
+def refresh(snippets, names=None):
+    """ Re-index the given snippets and update their neighbour lists.
+    ``names`` is as for index_snippets(). """
+    signatures = index_snippets(snippets, names)
+    pks = [snippet.pk for snippet in snippets]
+    # The snippets listing these ones lose or change those entries
+    listing = set(RelatedSnippet.objects.filter(
+        related__in=pks).values_list('snippet', flat=True))
+    RelatedSnippet.objects.filter(snippet__in=pks).delete()
+    RelatedSnippet.objects.filter(related__in=pks).delete()
+    entries, touched = [], set()
+    for pk, found in neighbours_many(signatures).items():
+        for score, other in found:
+            entries.append(RelatedSnippet(
+                snippet_id=pk, related_id=other, score=score))
+            if other not in signatures:
+                entries.append(RelatedSnippet(
+                    snippet_id=other, related_id=pk, score=score))
+                touched.add(other)
+    RelatedSnippet.objects.bulk_create(entries, ignore_conflicts=True)
+    _trim(touched)
+    pagecache.invalidate(set(pks) | listing | touched)
+
+
+def rebuild(chunk_size=500):
+    """
+    Recompute every signature, then every neighbour list. The new lists
+    are swapped in for the old ones in one transaction, so pages never
+    see them missing. Yields a (pass, snippets done) tuple after each
+    chunk of each pass, then once the lists are saved.
+    """
+    snippets = Snippet.objects.select_related('language').only(
+        'title', 'description', 'code', 'code_hash', 'language',
+        'language__language_code').order_by('pk')
+    done, last = 0, 0
+    while True:
+        chunk = list(snippets.filter(pk__gt=last)[:chunk_size])
+        if not chunk:
+            break
+        index_snippets(chunk)
+        last, done = chunk[-1].pk, done + len(chunk)
+        yield 'signatures', done
+
+    entries, done, last = [], 0, 0
+    rows = SnippetSignature.objects.order_by('snippet_id').values_list(
+        'snippet', 'signature')
+    while True:
+        chunk = {pk: _unpack(data) for pk, data in
+                 rows.filter(snippet__gt=last)[:chunk_size]}
+        if not chunk:
+            break
+        entries += [
+            RelatedSnippet(snippet_id=pk, related_id=other, score=score)
+            for pk, found in neighbours_many(chunk).items()
+            for score, other in found]
+        last, done = max(chunk), done + len(chunk)
+        yield 'neighbours', done
+    with transaction.atomic():
+        RelatedSnippet.objects.all().delete()
+        RelatedSnippet.objects.bulk_create(entries, batch_size=1000)
+    pagecache.invalidate_all()
+    yield 'saved', done
+
+
+def related_to(snippet_id, limit=RELATED_COUNT):
+    """ The snippet's precomputed neighbours, best first, in one query.
+    Only what a link to each needs is loaded: its title and author's
+    username. """
+    return [entry.related for entry in RelatedSnippet.objects.filter(
+        snippet=snippet_id).select_related('related__author').only(
+        'related__title', 'related__author__username').order_by(
+        '-score')[:limit]]
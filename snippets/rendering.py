@@ -0,0 +1,253 @@
+"""
+Out-of-request rendering of snippet descriptions and code.
+
+With ``SNIPPETS_ASYNC_RENDER`` on, Snippet.save() stores the raw input,
+marks the snippet ``RENDER_PENDING`` and leaves Markdown and Pygments to a
+local process pool. The pending rows are the queue: ``enqueue()`` hands a
+freshly saved snippet to a background dispatcher, and
+``manage.py render_pending`` drains whatever is left, e.g. after a restart.
+Every job gets ``SNIPPETS_RENDER_TIMEOUT`` seconds; a job that overruns is
+marked ``RENDER_FAILED`` and its worker process is killed.
+"""
+import atexit
+import logging
+import multiprocessing
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import markdown as markdown_module
+import pygments
+from django.conf import settings
+from django.db import close_old_connections, connections
+from markdown import markdown
+
+from . import highlighting
+
+ASYNC_RENDER = getattr(settings, 'SNIPPETS_ASYNC_RENDER', False)
+RENDER_TIMEOUT = getattr(settings, 'SNIPPETS_RENDER_TIMEOUT', 10)
+RENDER_WORKERS = getattr(settings, 'SNIPPETS_RENDER_WORKERS', 2)
+
+# Identifies everything that shapes the stored HTML; bump the trailing
+# revision when the rendering code itself changes output.
+RENDERER_VERSION = 'markdown-%s;pygments-%s;html-%s;1' % (
+    markdown_module.__version__, pygments.__version__,
+    ','.join(f'{k}={v}' for k, v in
+             sorted(highlighting.FORMATTER_OPTIONS.items())))
+
+logger = logging.getLogger(__name__)
+
+# What the indexes keep of a snippet's code: its encoded token stream
+# (None when it can't be stored), its duplicate fingerprints and the
+# identifiers related snippets are found by
+Analysis = namedtuple('Analysis', ['stream', 'fingerprints', 'names'])
+
+_dispatcher = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def render_description(description):
+    return markdown(description)
+
+
+def render_job(description, code, language_code):
+    """
+    Render a snippet's description and code. Runs in a worker process, so
+    it only touches Markdown and Pygments, never the database.
+    """
+    return (render_description(description),
+            highlighting.render(code, language_code))
+
+
+def analyse(code, language_code, stream=None):
+    """ Analyse the code for the indexes, from its tokens if it has been
+    lexed already. Runs in worker processes too. """
+    from . import duplicates, related, tokens
+
+    if stream is None:
+        stream = tokens.lex(code, language_code)
+    return Analysis(
+        tokens.encode(stream) if tokens.storable(
+            code, language_code, stream) else None,
+        duplicates.fingerprints(stream), related.code_names(stream))
+
+
+def index_job(description, code, language_code):
+    """ render_job(), plus the Analysis of the code, from one lexing of
+    it. """
+    from . import tokens
+
+    stream = tokens.lex(code, language_code)
+    return (render_description(description),
+            highlighting.render(code, language_code, stream),
+            analyse(code, language_code, stream))
+
+
+def index(analysed, check=True):
+    """
+    Store what the indexes keep of saved snippets' code, given as
+    (snippet, Analysis) pairs: the token streams and fingerprints, and
+    their related snippets. Unless ``check`` is off, near duplicates are
+    flagged first. The snippets need their language loaded.
+    """
+    from . import duplicates, related, tokens
+
+    prints = {snippet.pk: analysis.fingerprints
+              for snippet, analysis in analysed}
+    if check:
+        duplicates.check_snippets(prints)
+    tokens.save_many(
+        (snippet.pk, snippet.code_hash, snippet.language.language_code,
+         analysis.stream)
+        for snippet, analysis in analysed if analysis.stream is not None)
+    duplicates.index_snippets(prints)
+    related.refresh([snippet for snippet, _ in analysed],
+                    {snippet.pk: analysis.names
+                     for snippet, analysis in analysed})
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(workers)
+        return _pool
+
+
+@atexit.register
+def _kill_pool():
+    """ Terminate the shared pool; the next job starts a fresh one. """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
+
+def render_pending(snippet_ids=None, limit=None, timeout=RENDER_TIMEOUT,
+                   workers=RENDER_WORKERS):
+    """
+    Render pending snippets across the process pool and store the results.
+    Returns a (rendered, failed) tuple.
+    """
+    from .models import Snippet
+
+    pending = Snippet.objects.filter(
+        render_status=Snippet.RENDER_PENDING).select_related(
+        'language').with_text().order_by('pk')
+    if snippet_ids is not None:
+        pending = pending.filter(pk__in=snippet_ids)
+    queue = list(pending[:limit])
+    rendered = failed = 0
+    while queue:
+        pool = _get_pool(workers)
+        jobs = [(snippet, pool.apply_async(
+            index_job, (snippet.description, snippet.code,
+                         snippet.language.language_code)))
+                for snippet in queue]
+        queue = []
+        for position, (snippet, job) in enumerate(jobs):
+            try:
+                result = job.get(timeout)
+            except multiprocessing.TimeoutError:
+                logger.warning("Rendering snippet %s took longer than %ss",
+                               snippet.pk, timeout)
+                _store_failure(snippet)
+                failed += 1
+                # The overrunning job can't be cancelled on its own, so the
+                # pool goes and unfinished jobs move to a fresh one.
+                for other, other_job in jobs[position + 1:]:
+                    if other_job.ready() and other_job.successful():
+                        _store(other, other_job.get())
+                        rendered += 1
+                    else:
+                        queue.append(other)
+                _kill_pool()
+                break
+            except Exception:
+                logger.exception("Rendering snippet %s failed", snippet.pk)
+                _store_failure(snippet)
+                failed += 1
+            else:
+                _store(snippet, result)
+                rendered += 1
+    return rendered, failed
+
+
+def _store(snippet, result):
+    from .models import Snippet
+
+    description_html, highlighted_code, analysis = result
+    # Only land the result if the snippet wasn't edited meanwhile; an edit
+    # queues a fresh job of its own.
+    updated = Snippet.objects.filter(
+        pk=snippet.pk, updated_date=snippet.updated_date).update(
+        description_html=description_html,
+        highlighted_code=highlighted_code,
+        render_status=Snippet.RENDER_READY,
+        render_version=RENDERER_VERSION)
+    if updated:
+        index([(snippet, analysis)])
+    highlighting.store(
+        snippet.code, snippet.language.language_code, highlighted_code)
+    invalidate([snippet])
+
+
+def invalidate(snippets, **scopes):
+    """
+    Drop the cached pages and feeds showing the snippets' rendered HTML,
+    after writes that bypass post_save (update(), bulk_update()). Further
+    pagecache.invalidate() scopes may be given. The snippets need their
+    author_id and language_id loaded.
+    """
+    from . import pagecache
+    from .feeds import invalidate_feeds
+    from .models import SnippetTag
+
+    pks = [snippet.pk for snippet in snippets]
+    invalidate_feeds(
+        {snippet.author_id for snippet in snippets},
+        {snippet.language_id for snippet in snippets},
+        set(SnippetTag.objects.filter(snippet__in=pks).values_list(
+            'tag', flat=True)))
+    pagecache.invalidate(pks, **scopes)
+
+
+def _store_failure(snippet):
+    from .models import Snippet
+
+    Snippet.objects.filter(
+        pk=snippet.pk, updated_date=snippet.updated_date).update(
+        render_status=Snippet.RENDER_FAILED)
+
+
+def _run(func, args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background job %s failed", func.__name__)
+    finally:
+        connections.close_all()
+
+
+def submit(func, *args):
+    """
+    Run func(*args) on the background dispatcher thread, after any job
+    queued before it, with a database connection of its own. For writes
+    that needn't hold up a request.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='snippet-render')
+    _dispatcher.submit(_run, func, args)
+
+
+def enqueue(snippet_id):
+    """
+    Render a pending snippet in the background. Rows stay pending in the
+    database until stored, so nothing is lost if this process dies first.
+    """
+    submit(render_pending, [snippet_id])
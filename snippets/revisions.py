@@ -0,0 +1,139 @@
+"""
+Snippet code history stored as compressed deltas.
+
+Each saved version of a snippet's code is a SnippetRevision. Every
+``SNIPPETS_REVISION_KEYFRAME_INTERVAL``-th one (the 1st, 11th, 21st... by
+default) is a keyframe holding the whole code; the others hold a delta
+against the version before: the runs of lines kept from it, and the
+lines added. An edit thus costs storage in proportion to the lines it
+changes, and any version is rebuilt from one keyframe and at most
+interval - 1 deltas, read in a single query.
+
+A history starts at the snippet's first edit, as two revisions: the code
+it had until then and the edited code. Snippets never edited, which are
+most of them, have none, rather than a keyframe copying their code.
+"""
+import difflib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import SnippetRevision
+
+KEYFRAME_INTERVAL = getattr(
+    settings, 'SNIPPETS_REVISION_KEYFRAME_INTERVAL', 10)
+
+
+def _pack(value):
+    return zlib.compress(
+        json.dumps(value, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def diff(old, new):
+    """
+    Return the delta turning old into new: a list of [start, end] runs of
+    old's lines to keep and strings of lines to insert, in order.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines,
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append(''.join(new_lines[j1:j2]))
+    return ops
+
+
+def patch(old, ops):
+    """ Apply a delta from diff() to old. """
+    old_lines = old.splitlines(keepends=True)
+    return ''.join(
+        ''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op
+        for op in ops)
+
+
+def is_keyframe(number):
+    return (number - 1) % KEYFRAME_INTERVAL == 0
+
+
+def codes_between(snippet_id, first, last):
+    """ Rebuild the snippet's code as of each revision from ``first`` to
+    ``last``, in one query and one pass over the deltas. """
+    start = first - (first - 1) % KEYFRAME_INTERVAL
+    rows = list(SnippetRevision.objects.filter(
+        snippet=snippet_id, number__range=(start, last)).order_by(
+        'number').values_list('number', 'keyframe', 'data'))
+    if [row[0] for row in rows] != list(range(start, last + 1)) or \
+            not rows[0][1]:
+        raise SnippetRevision.DoesNotExist(
+            f"Revision {last} of snippet {snippet_id} is incomplete")
+    codes, code = [], None
+    for number, keyframe, data in rows:
+        if keyframe:
+            code = zlib.decompress(bytes(data)).decode('utf-8')
+        else:
+            code = patch(code, _unpack(data))
+        if number >= first:
+            codes.append(code)
+    return codes
+
+
+def code_at(snippet_id, number):
+    """ Rebuild the snippet's code as of the given revision. """
+    return codes_between(snippet_id, number, number)[0]
+
+
+def _create(snippet_id, number, code, previous):
+    if previous is None or is_keyframe(number):
+        keyframe, data = True, zlib.compress(code.encode('utf-8'), 9)
+    else:
+        keyframe, data = False, _pack(diff(previous, code))
+    return SnippetRevision.objects.create(
+        snippet_id=snippet_id, number=number, keyframe=keyframe, data=data,
+        size=len(code))
+
+
+def _record(snippet, previous_code):
+    last = SnippetRevision.objects.filter(snippet=snippet.pk).order_by(
+        '-number').values_list('number', flat=True).first()
+    if last is None:
+        if previous_code is None or previous_code == snippet.code:
+            return _create(snippet.pk, 1, snippet.code, None)
+        _create(snippet.pk, 1, previous_code, None)
+        last, previous = 1, previous_code
+    else:
+        # Deltas are taken against the stored version, which is what they
+        # will be applied to, whatever the row held in the meantime
+        previous = code_at(snippet.pk, last)
+        if previous == snippet.code:
+            return None
+    return _create(snippet.pk, last + 1, snippet.code, previous)
+
+
+def record(snippet, previous_code=None, attempts=5):
+    """
+    Add the snippet's current code to its history, unless it's the latest
+    version already. ``previous_code`` is the code it replaced, which
+    starts the history of a snippet that has none. Returns the new
+    SnippetRevision, or None.
+
+    Two concurrent edits can both read the same last number; the one
+    that loses on the unique (snippet, number) constraint reads the
+    history again and takes the next number, so neither version is lost.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return _record(snippet, previous_code)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
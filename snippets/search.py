@@ -0,0 +1,157 @@
+"""
+Full-text search over snippets, backed by an SQLite FTS5 table.
+
+The ``snippets_snippet_fts`` table indexes the title, description and code of
+every snippet under the snippet's id as rowid. It is contentless: it keeps
+the index but no copy of the text, so removing an entry takes the text it
+was made from (see ``unindex_snippets()``). It is kept in step by the
+signal handlers in ``snippets.signals`` and can be rebuilt from scratch with
+``manage.py rebuild_search_index``. On other databases, or SQLite builds
+without FTS5, search falls back to plain ``icontains`` filtering.
+"""
+import functools
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Snippet
+
+FTS_TABLE = 'snippets_snippet_fts'
+# bm25() weights for the title, description and code columns
+WEIGHTS = (10.0, 4.0, 1.0)
+
+_word_re = re.compile(r'\w+')
+
+
+@functools.lru_cache(maxsize=None)
+def is_available():
+    """ Whether the database is SQLite with FTS5 compiled in, probed once.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def entry(snippet):
+    """ The (rowid, title, description, code) index entry of a snippet. """
+    return (snippet.pk, snippet.title, snippet.description, snippet.code)
+
+
+def index_snippets(snippets):
+    """ Add the index entries of snippets not indexed yet. """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, description, code) "
+            f"VALUES (%s, %s, %s, %s)", [entry(s) for s in snippets])
+
+
+def unindex_snippets(entries):
+    """ Remove index entries, given as the (rowid, title, description,
+    code) they were made from: a contentless table can only take tokens
+    out of the index by lexing the text again. """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} "
+            f"({FTS_TABLE}, rowid, title, description, code) "
+            f"VALUES ('delete', %s, %s, %s, %s)", list(entries))
+
+
+def reindex_snippet(snippet, indexed):
+    """ Replace the snippet's entry, made from the ``indexed`` (title,
+    description, code), with one for its current text. """
+    if not is_available():
+        return
+    with transaction.atomic():
+        unindex_snippets([(snippet.pk, *indexed)])
+        index_snippets([snippet])
+
+
+def rebuild_index(chunk_size=500):
+    """ Re-index every snippet; returns the number of snippets indexed. """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')")
+    batch, total = [], 0
+    snippets = Snippet.objects.order_by().only(
+        'title', 'description', 'code')
+    for snippet in snippets.iterator(chunk_size=chunk_size):
+        batch.append(snippet)
+        if len(batch) == chunk_size:
+            index_snippets(batch)
+            total += len(batch)
+            batch = []
+    index_snippets(batch)
+    total += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query: every word must match, and the last
+    one may be a prefix, so operators typed by users are never parsed.
+    """
+    words = _word_re.findall(query)
+    if not words:
+        return ''
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_ids(query, language=None, author=None, limit=50):
+    """ Return the ids of the snippets matching ``query``, best first. """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    sql = [f"SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE}"]
+    params = [expression]
+    where = [f"{FTS_TABLE} MATCH %s"]
+    if language is not None or author is not None:
+        sql.append(f"JOIN snippets_snippet s ON s.id = {FTS_TABLE}.rowid")
+    if language is not None:
+        where.append("s.language_id = %s")
+        params.append(language.pk)
+    if author is not None:
+        where.append("s.author_id = %s")
+        params.append(author.pk)
+    sql.append("WHERE " + " AND ".join(where))
+    sql.append(f"ORDER BY bm25({FTS_TABLE}, %s, %s, %s)" % WEIGHTS)
+    if limit is not None:
+        sql.append("LIMIT %s")
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(' '.join(sql), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(query, language=None, author=None, limit=50):
+    """
+    Return the snippets matching ``query`` ranked by bm25, optionally
+    restricted to a Language and/or an author.
+    """
+    snippets = Snippet.objects.listing()
+    if not is_available():
+        if language is not None:
+            snippets = snippets.filter(language=language)
+        if author is not None:
+            snippets = snippets.filter(author=author)
+        for word in _word_re.findall(query):
+            snippets = snippets.filter(
+                Q(title__icontains=word) | Q(description__icontains=word))
+        return list(snippets[:limit])
+
+    ids = search_ids(query, language=language, author=author, limit=limit)
+    found = snippets.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,234 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import leaderboards, pagecache, related, rendering, revisions, search
+from .feeds import invalidate_feeds
+from .models import (Bookmark, Language, LeaderboardEntry, Rating,
+                     RelatedSnippet, Snippet, SnippetTag, Tag)
+
+# The snippet fields in the full-text index
+SEARCH_FIELDS = ('title', 'description', 'code')
+
+# Snippets whose votes changed outside the managers, recounted on commit
+_recounts = threading.local()
+
+
+def _feed_scopes(instance):
+    """ The authors, languages and tags whose feeds list the snippet, before
+    and after the change. """
+    loaded = getattr(instance, '_loaded_values', {})
+    author_ids = {instance.author_id, loaded.get('author_id')} - {None}
+    language_ids = {instance.language_id, loaded.get('language_id')} - {None}
+    tag_ids = getattr(instance, '_deleted_tag_ids', None)
+    if tag_ids is None:
+        tag_ids = set(SnippetTag.objects.filter(
+            snippet=instance.pk).values_list('tag', flat=True))
+    return author_ids, language_ids, tag_ids
+
+
+def _changed(instance, *fields):
+    """ Whether any of the fields differs from what was loaded. Fields
+    left unloaded can't have changed. """
+    loaded = getattr(instance, '_loaded_values', {})
+    unloaded = instance.get_deferred_fields()
+    return any(field not in unloaded and
+               loaded.get(field) != getattr(instance, field)
+               for field in fields)
+
+
+def _listing(snippet_id):
+    """ The snippets whose related lists link to the snippet by title. """
+    return set(RelatedSnippet.objects.filter(
+        related=snippet_id).values_list('snippet', flat=True))
+
+
+@receiver(pre_save, sender=Snippet)
+def snippet_saving(sender, instance, **kwargs):
+    # The search entry is replaced using the text it was made from
+    if instance._state.adding or not _changed(instance, *SEARCH_FIELDS):
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    missing = [field for field in SEARCH_FIELDS if field not in loaded]
+    if missing:
+        stored = Snippet.objects.filter(pk=instance.pk).values_list(
+            *missing).first()
+        if stored is None:
+            return
+        loaded.update(zip(missing, stored))
+        instance._loaded_values = loaded
+        # Fields still unloaded keep their stored text, which the new
+        # entry is then made from without loading them again
+        unloaded = instance.get_deferred_fields()
+        for field in missing:
+            if field in unloaded:
+                setattr(instance, field, loaded[field])
+    instance._indexed = tuple(loaded[field] for field in SEARCH_FIELDS)
+
+
+@receiver(post_save, sender=Snippet)
+def snippet_saved(sender, instance, created, **kwargs):
+    """ Keep the full-text, duplicate and similarity indexes, cached feeds,
+    pages, leaderboards and code history in step with the saved snippet.
+    """
+    indexed = getattr(instance, '_indexed', None)
+    if created:
+        search.index_snippets([instance])
+    elif _changed(instance, *SEARCH_FIELDS):
+        if indexed is None:
+            search.index_snippets([instance])
+        else:
+            search.reindex_snippet(instance, indexed)
+    author_ids, language_ids, tag_ids = _feed_scopes(instance)
+    invalidate_feeds(author_ids, language_ids, tag_ids)
+    snippet_ids = {instance.pk}
+    if not created and _changed(instance, 'title'):
+        snippet_ids |= _listing(instance.pk)
+    pagecache.invalidate(snippet_ids, language_ids, listings=True,
+                         popular=True)
+    _rank_snippet(instance, created)
+    if not created and _changed(instance, 'code'):
+        # Histories start at the first edit, with the code it replaced
+        revisions.record(
+            instance, getattr(instance, '_loaded_values', {}).get('code'))
+    if instance.render_status == Snippet.RENDER_PENDING:
+        # The render worker indexes the snippet as it lexes the code
+        return
+    if created or _changed(instance, 'code', 'language_id'):
+        # Out of the transaction, from the tokens save() highlighted
+        stream = instance.__dict__.pop('_stream', None)
+        transaction.on_commit(lambda: rendering.index([(
+            instance, rendering.analyse(
+                instance.code, instance.language.language_code, stream))]))
+    elif _changed(instance, 'title', 'description'):
+        # The identifiers are read from the stored token stream
+        transaction.on_commit(lambda: related.refresh([instance]))
+
+
+@receiver(pre_delete, sender=Snippet)
+def snippet_deleting(sender, instance, **kwargs):
+    instance._indexed = search.entry(instance)
+    # The taggings are gone by post_delete, and cascade without signals
+    instance._deleted_tag_ids = set(SnippetTag.objects.filter(
+        snippet=instance.pk).values_list('tag', flat=True))
+    instance._listing = _listing(instance.pk)
+
+
+@receiver(post_delete, sender=Snippet)
+def snippet_deleted(sender, instance, **kwargs):
+    search.unindex_snippets([instance._indexed])
+    author_ids, language_ids, tag_ids = _feed_scopes(instance)
+    invalidate_feeds(author_ids, language_ids, tag_ids)
+    pagecache.invalidate({instance.pk} | instance._listing, language_ids,
+                         listings=True, popular=True)
+    Tag.objects.adjust(dict.fromkeys(instance._deleted_tag_ids, -1))
+    leaderboards.record_snippets([instance], -1)
+    leaderboards.forget(LeaderboardEntry.BOARD_BOOKMARKED, instance.pk)
+
+
+def _rank_snippet(instance, created):
+    """ Count a new snippet on the author and language leaderboards, or
+    move an edited one that changed author or language. """
+    day = leaderboards.day_of(instance.pub_date)
+    loaded = getattr(instance, '_loaded_values', {})
+    for board, field in ((LeaderboardEntry.BOARD_AUTHORS, 'author_id'),
+                         (LeaderboardEntry.BOARD_LANGUAGES, 'language_id')):
+        current = getattr(instance, field)
+        if created:
+            leaderboards.record(board, current, day)
+        elif loaded.get(field) not in (None, current):
+            leaderboards.record(board, loaded[field], day, -1)
+            leaderboards.record(board, current, day)
+
+
+def _recount_on_commit(snippet_id):
+    """
+    Recount the snippet's vote counters once the transaction commits.
+    Deletes cascading from a user or snippet run in one transaction, so
+    their snippets are recounted together, and a deleted snippet not at
+    all.
+    """
+    pending = _recounts.__dict__.setdefault('snippet_ids', set())
+    pending.add(snippet_id)
+    transaction.on_commit(_recount_pending)
+
+
+def _recount_pending():
+    snippet_ids = _recounts.__dict__.pop('snippet_ids', None)
+    if snippet_ids:
+        Snippet.objects.recount(snippet_ids)
+        Snippet.objects.rerank(snippet_ids)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    # Ratings saved and deleted in the admin, by cascades or fixtures;
+    # RatingManager.rate() counts its own
+    _recount_on_commit(instance.snippet_id)
+
+
+@receiver(post_save, sender=Bookmark)
+def bookmark_saved(sender, instance, created, **kwargs):
+    # BookmarkManager.add() counts its own
+    if created:
+        _recount_on_commit(instance.snippet_id)
+        leaderboards.record(LeaderboardEntry.BOARD_BOOKMARKED,
+                            instance.snippet_id,
+                            leaderboards.day_of(instance.date))
+
+
+@receiver(post_delete, sender=Bookmark)
+def bookmark_deleted(sender, instance, **kwargs):
+    _recount_on_commit(instance.snippet_id)
+    leaderboards.record(LeaderboardEntry.BOARD_BOOKMARKED, instance.snippet_id,
+                        leaderboards.day_of(instance.date), -1)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def language_changed(sender, instance, **kwargs):
+    # Every snippet page names its language
+    pagecache.invalidate_all()
+
+
+@receiver(m2m_changed, sender=Snippet.tags.through)
+def snippet_tags_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """ Keep tag counts, tag feeds and snippet pages in step with tags
+    added to or removed from snippets, from either side of the relation.
+    """
+    field = 'snippet' if reverse else 'tag'
+    lookup = {'tag' if reverse else 'snippet': instance.pk}
+    if action in ('pre_remove', 'pre_clear'):
+        # The removed rows are gone by post_remove and post_clear, so note
+        # now which of them existed; remove() may name unrelated objects
+        related = SnippetTag.objects.filter(**lookup)
+        if action == 'pre_remove':
+            related = related.filter(**{f'{field}__in': pk_set})
+        instance._removed_pks = set(related.values_list(field, flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # post_add's pk_set only holds the rows actually added
+    delta = 1
+    if action != 'post_add':
+        pk_set, delta = instance.__dict__.pop('_removed_pks', set()), -1
+    if not pk_set:
+        return
+    if reverse:
+        tag_ids, snippet_ids = [instance.pk], pk_set
+        snippets = Snippet.objects.filter(pk__in=pk_set)
+        invalidate_feeds(
+            set(snippets.values_list('author', flat=True)),
+            set(snippets.values_list('language', flat=True)), tag_ids)
+    else:
+        tag_ids, snippet_ids = pk_set, [instance.pk]
+        invalidate_feeds([instance.author_id], [instance.language_id],
+                         tag_ids)
+    Tag.objects.adjust({tag_id: delta * len(pk_set) if reverse else delta
+                        for tag_id in tag_ids})
+    pagecache.invalidate(snippet_ids, popular=True)
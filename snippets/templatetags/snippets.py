@@ -1,6 +1,6 @@
 from django import template
 
-from snippets.models import Bookmark, Rating, SnippetFlag
+from snippets.viewer import ViewerState
 
 register = template.Library()
 
@@ -53,8 +53,9 @@ class IfBookmarkedNode(template.Node):
             snippet = self.snippet.resolve(context)
         except template.VariableDoesNotExist:
             return ''
-        # Use the resolved variables to query for an existing bookmark
-        if Bookmark.objects.filter(user__pk=user.id, snippet_id=snippet.id):
+        # Look the bookmark up in the viewer state batched for this request
+        state = ViewerState.for_context(context, user)
+        if state.is_bookmarked(snippet):
             return self.nodelist_true.render(context)
         else:
             return self.nodelist_false.render(context)
@@ -91,7 +92,8 @@ class IfRatedNode(template.Node):
             snippet = self.snippet.resolve(context)
         except template.VariableDoesNotExist:
             return ''
-        if Rating.objects.filter(user__pk=user.id, snippet__pk=snippet.id):
+        state = ViewerState.for_context(context, user)
+        if state.get_rating(snippet) is not None:
             return self.nodelist_true.render(context)
         else:
             return self.nodelist_false.render(context)
@@ -124,14 +126,47 @@ class GetRatingNode(template.Node):
             snippet = self.snippet.resolve(context)
         except template.VariableDoesNotExist:
             return ''
-        rating = Rating.objects.get(user__pk=user.id, snippet__pk=snippet.id)
-        context[self.varname] = rating
+        state = ViewerState.for_context(context, user)
+        context[self.varname] = state.get_rating(snippet)
         return ''
 
 
 register.tag('get_rating', do_get_rating)
 
 
+def do_load_viewer_state(parser, token):
+    """ Compilation function for the {% load_viewer_state %} tag
+    Usage:
+        {% load_viewer_state user snippet_list %}
+    Queues every snippet in the list so the if_bookmarked, if_rated and
+    get_rating tags rendered afterwards share one bookmark query and one
+    rating query for the whole page.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            "%s tag takes two arguments" % bits[0])
+    return LoadViewerStateNode(bits[1], bits[2])
+
+
+class LoadViewerStateNode(template.Node):
+    def __init__(self, user, snippets):
+        self.user = template.Variable(user)
+        self.snippets = template.Variable(snippets)
+
+    def render(self, context):
+        try:
+            user = self.user.resolve(context)
+            snippets = self.snippets.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+        ViewerState.for_context(context, user).prime(snippets)
+        return ''
+
+
+register.tag('load_viewer_state', do_load_viewer_state)
+
+
 # @register.filter
 # def has_flagged(user, snippet):
 #     if not user.is_authenticated():
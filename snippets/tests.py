@@ -1,17 +1,66 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import zlib
+from io import StringIO
+from unittest import mock
+
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.http import Http404
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.template import Template, Context, TemplateSyntaxError
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
 from snippets.templatetags.snippets import do_if_bookmarked
+from snippets.views import asynchronous
+
+from django.contrib.auth.models import AnonymousUser, User
+from snippets import (benchmarks, duplicates, fields, highlighting,
+                      leaderboards, pagecache, queries, ranking, related,
+                      rendering, revisions, search, tokens)
+from snippets.feeds import LatestSnippetsFeed
+from snippets.management.commands import load_test
+from snippets.models import (Bookmark, Checkpoint, CodeFingerprint,
+                             HighlightCache, Language, LeaderboardEntry,
+                             Rating, RelatedSnippet, Snippet, SnippetFlag,
+                             SnippetRevision, SnippetTokens, Tag)
+from snippets.pagination import (InvalidCursor, KeysetPaginator,
+                                 approximate_count)
+
+PYTHON = {'name': 'Python', 'slug': 'python', 'language_code': 'python',
+          'file_extension': 'py', 'mime_type': 'text/x-python'}
+
 
-from django.contrib.auth.models import User
-from snippets.models import Snippet
+class SnippetTestCase(TestCase):
+    """ Shares a Python language and a user, named by ``username``, across
+    a test case's tests. """
+    username = 'author'
+    password = None
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username=cls.username, password=cls.password)
+        cls.language = Language.objects.create(**PYTHON)
 
-class IfBookmarkedTests(TestCase):
+
+class IfBookmarkedTests(SnippetTestCase):
+    username = 'test_user'
 
     def setUp(self):
-        self.user = User.objects.create(username='test_user')
         # create a Snippet with passing the appropriate fields
-        self.snippet = Snippet.objects.create(title='test_snippet', language='Python')
+        self.snippet = Snippet.objects.create(
+            title='test_snippet', language=self.language, author=self.user,
+            code='pass')
 
     def test_valid_syntax(self):
         # Create a template with the custom filter using valid syntax
@@ -27,14 +76,1553 @@ class IfBookmarkedTests(TestCase):
         self.assertNotEqual(rendered, "Bookmarked")
 
     def test_invalid_syntax(self):
-        # Create a template with the custom filter using invalid syntax
-        template = Template("{% load snippets %} {% if_bookmarked user %}Bookmarked{% endif_bookmarked %}")
-        
-        # Create a context with a variable for the template to use
-        context = Context({"user": self.user})
-        
-        # Assert that the custom filter raises a TemplateSyntaxError
+        # Assert that compiling the tag with invalid syntax raises a
+        # TemplateSyntaxError
         with self.assertRaises(TemplateSyntaxError):
-            template.render(context)
+            Template("{% load snippets %} {% if_bookmarked user %}Bookmarked{% endif_bookmarked %}")
+
+# Additionally, you can use the assertContains() method to check if the output is as expected, and assertTemplateUsed() method to check if the filter is used.
+
+class SnippetCountersTests(SnippetTestCase):
+    username = 'rater'
+    password = 'pw'
+
+    def setUp(self):
+        self.snippet = Snippet.objects.create(
+            title='counted', language=self.language, author=self.user,
+            description='desc', code='print(1)')
+        self.client.force_login(self.user)
+
+    def test_rating_updates_score_and_count(self):
+        self.client.get(
+            reverse('snippets:rate', args=[self.snippet.id]), {'rating': '-1'})
+        self.snippet.refresh_from_db()
+        self.assertEqual(self.snippet.score, -1)
+        self.assertEqual(self.snippet.rating_count, 1)
+        self.assertEqual(self.snippet.get_score(), -1)
+
+    def test_rating_again_replaces_the_rating(self):
+        url = reverse('snippets:rate', args=[self.snippet.id])
+        self.client.get(url, {'rating': '1'})
+        self.client.get(url, {'rating': '-1'})
+        self.client.get(url, {'rating': '-1'})
+        self.snippet.refresh_from_db()
+        self.assertEqual((self.snippet.score, self.snippet.rating_count),
+                         (-1, 1))
+        self.assertEqual(Rating.objects.get().rating, Rating.RATING_DOWN)
+        self.assertFalse(Rating.objects.rate(
+            self.snippet.id, self.user.id, Rating.RATING_DOWN))
+
+    def test_votes_are_unique(self):
+        Rating.objects.create(user=self.user, snippet=self.snippet, rating=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.create(
+                user=self.user, snippet=self.snippet, rating=-1)
+        with self.assertNumQueries(1):
+            self.assertTrue(
+                Bookmark.objects.upsert(['user', 'snippet'],
+                                        snippet_id=self.snippet.id,
+                                        user_id=self.user.id,
+                                        date=timezone.now()))
+        self.assertFalse(Bookmark.objects.add(self.snippet.id, self.user.id))
+        self.assertEqual(Bookmark.objects.count(), 1)
+
+    def test_bookmark_add_and_delete_update_count(self):
+        self.client.get(reverse('bookmarks:add', args=[self.snippet.id]))
+        self.client.get(reverse('bookmarks:add', args=[self.snippet.id]))
+        self.snippet.refresh_from_db()
+        self.assertEqual(self.snippet.bookmark_count, 1)
+        self.assertEqual(leaderboards.ranked_ids(
+            LeaderboardEntry.BOARD_BOOKMARKED), [(self.snippet.id, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('bookmarks:delete', args=[self.snippet.id]))
+        self.snippet.refresh_from_db()
+        self.assertEqual(self.snippet.bookmark_count, 0)
+
+    def test_save_keeps_concurrent_votes(self):
+        stale = Snippet.objects.get(pk=self.snippet.pk)
+        Rating.objects.rate(self.snippet.id, self.user.id, Rating.RATING_UP)
+        stale.title = 'edited'
+        stale.save()
+        self.snippet.refresh_from_db()
+        self.assertEqual((self.snippet.title, self.snippet.score,
+                          self.snippet.rating_count), ('edited', 1, 1))
+        self.assertGreater(self.snippet.wilson_score, 0)
+
+    def test_cascading_deletes_update_counters(self):
+        voter = User.objects.create_user(username='voter')
+        Rating.objects.rate(self.snippet.id, voter.id, Rating.RATING_UP)
+        Rating.objects.rate(self.snippet.id, self.user.id, Rating.RATING_UP)
+        Bookmark.objects.add(self.snippet.id, voter.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            voter.delete()
+        self.snippet.refresh_from_db()
+        self.assertEqual(
+            (self.snippet.score, self.snippet.rating_count,
+             self.snippet.bookmark_count), (1, 1, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.all().delete()
+        self.snippet.refresh_from_db()
+        self.assertEqual((self.snippet.score, self.snippet.rating_count),
+                         (0, 0))
+
+    def test_recount_repairs_counters(self):
+        Rating.objects.create(user=self.user, snippet=self.snippet, rating=1)
+        Bookmark.objects.create(user=self.user, snippet=self.snippet)
+        Snippet.objects.filter(pk=self.snippet.pk).update(
+            score=42, rating_count=7, bookmark_count=3)
+        call_command('recount_snippets', stdout=StringIO())
+        self.snippet.refresh_from_db()
+        self.assertEqual(
+            (self.snippet.score, self.snippet.rating_count,
+             self.snippet.bookmark_count),
+            (1, 1, 1))
+
+    def test_detail_page_reads_counters(self):
+        Snippet.objects.filter(pk=self.snippet.pk).update(
+            score=3, rating_count=5)
+        response = self.client.get(self.snippet.get_absolute_url())
+        self.assertContains(response, '3 (after 5 ratings)')
+
+
+class ViewerStateTagTests(SnippetTestCase):
+    username = 'viewer'
+
+    def setUp(self):
+        self.snippets = [
+            Snippet.objects.create(
+                title=f'snippet {i}', language=self.language, author=self.user,
+                description='desc', code='pass')
+            for i in range(3)]
+        Bookmark.objects.create(user=self.user, snippet=self.snippets[0])
+        Rating.objects.create(user=self.user, snippet=self.snippets[1],
+                              rating=Rating.RATING_UP)
+
+    def test_page_of_tags_costs_two_queries(self):
+        template = Template(
+            "{% load snippets %}{% load_viewer_state user snippets %}"
+            "{% for snippet in snippets %}"
+            "{% if_bookmarked user snippet %}B{% else %}-{% endif_bookmarked %}"
+            "{% if_rated user snippet %}{% get_rating user snippet as rating %}"
+            "{{ rating.get_rating_display }}{% else %}-{% endif_rated %};"
+            "{% endfor %}")
+        context = Context({'user': self.user, 'snippets': self.snippets})
+        with self.assertNumQueries(2):
+            rendered = template.render(context)
+        self.assertEqual(rendered, 'B-;-useful;--;')
+
+    def test_anonymous_user_runs_no_queries(self):
+        template = Template(
+            "{% load snippets %}"
+            "{% if_bookmarked user snippet %}B{% else %}-{% endif_bookmarked %}")
+        context = Context({'user': AnonymousUser(),
+                           'snippet': self.snippets[0]})
+        with self.assertNumQueries(0):
+            self.assertEqual(template.render(context), '-')
+
+
+class KeysetPaginatorTests(SnippetTestCase):
+    username = 'pager'
+
+    def setUp(self):
+        for i in range(5):
+            Snippet.objects.create(
+                title=f'snippet {i}', language=self.language, author=self.user,
+                description='desc', code='pass')
+        # Share one timestamp so the id tie-breaker is exercised
+        Snippet.objects.update(pub_date=timezone.now())
+        self.expected = list(
+            Snippet.objects.order_by('-pub_date', '-id')
+            .values_list('id', flat=True))
+
+    def test_walks_forward_and_back(self):
+        paginator = KeysetPaginator(Snippet.objects.all(), per_page=2)
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([snippet.id for snippet in page])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(len(pages), 3)
+
+        previous = paginator.page(page.previous_cursor)
+        self.assertEqual([s.id for s in previous], pages[1])
+        self.assertTrue(previous.has_next())
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Snippet.objects.all(), per_page=2)
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+        page = paginator.get_page('not-a-cursor')
+        self.assertEqual([s.id for s in page], self.expected[:2])
+        self.assertFalse(page.has_previous())
+
+    def test_list_view_runs_no_count_query(self):
+        approximate_count('snippets', Snippet.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('snippets:list'))
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+
+class SearchTests(SnippetTestCase):
+    username = 'searcher'
+
+    def setUp(self):
+        self.python = self.language
+        self.ruby = Language.objects.create(
+            name='Ruby', slug='ruby', language_code='ruby',
+            file_extension='rb', mime_type='text/x-ruby')
+        self.in_title = Snippet.objects.create(
+            title='Memoize decorator', language=self.python,
+            author=self.user, description='Caching', code='pass')
+        self.in_code = Snippet.objects.create(
+            title='Helpers', language=self.python, author=self.user,
+            description='Misc', code='def memoize(func): return func')
+        self.other = Snippet.objects.create(
+            title='Memoize in Ruby', language=self.ruby, author=self.user,
+            description='Caching', code='nil')
+
+    def test_ranks_title_matches_first(self):
+        results = search.search('memoize', language=self.python)
+        self.assertEqual(results, [self.in_title, self.in_code])
+
+    def test_index_follows_save_and_delete(self):
+        self.in_code.code = 'def cache(func): return func'
+        self.in_code.save()
+        self.other.delete()
+        self.assertEqual(search.search('memoize'), [self.in_title])
+        self.assertEqual(search.search('cach'), [self.in_title, self.in_code])
+
+    def test_operators_are_treated_as_words(self):
+        self.assertEqual(search.search('memoize OR "NEAR('), [])
+
+    def test_search_view(self):
+        response = self.client.get(
+            reverse('snippets:search'), {'q': 'memoize', 'language': 'ruby'})
+        self.assertEqual(list(response.context['snippet_list']), [self.other])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {search.FTS_TABLE} "
+                           f"({search.FTS_TABLE}) VALUES ('delete-all')")
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(search.search('memoize')), 3)
+
+    def test_index_keeps_no_copy_of_the_text(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT code FROM {search.FTS_TABLE}")
+            self.assertEqual(set(cursor.fetchall()), {(None,)})
+        # An entry is replaced even when the old text wasn't loaded
+        snippet = Snippet.objects.only('title').get(pk=self.in_code.pk)
+        snippet.title = 'Renamed'
+        snippet.save()
+        self.assertEqual(search.search('renamed'), [self.in_code])
+        self.assertEqual(search.search('helpers'), [])
+
+    def test_admin_search_adds_full_text_matches(self):
+        User.objects.create_superuser(username='admin', password='pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(
+            reverse('admin:snippets_snippet_changelist'), {'q': 'memoize'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(
+            reverse('admin:snippets_snippet_changelist'), {'q': 'searcher'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+
+class HighlightCacheTests(SnippetTestCase):
+    username = 'highlighter'
+
+    def setUp(self):
+        highlighting.cache_clear()
+
+    def create_snippet(self, code='x = 1'):
+        return Snippet.objects.create(
+            title='cached', language=self.language, author=self.user,
+            description='desc', code=code)
+
+    def test_identical_code_is_lexed_once(self):
+        first = self.create_snippet()
+        second = self.create_snippet()
+        self.assertEqual(first.highlighted_code, second.highlighted_code)
+        info = highlighting.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_cache_table_serves_other_processes(self):
+        self.create_snippet()
+        highlighting.cache_clear()
+        self.create_snippet()
+        info = highlighting.cache_info()
+        self.assertEqual((info.db_hits, info.misses), (1, 0))
+
+    def test_cached_html_is_stored_compressed(self):
+        snippet = self.create_snippet('\n'.join(
+            f'value_{i} = {i}' for i in range(100)))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT html FROM snippets_highlightcache')
+            stored, = cursor.fetchone()
+        self.assertLess(len(stored), len(snippet.highlighted_code) / 2)
+
+    def test_prune_drops_stale_and_unused_renderings(self):
+        snippet = self.create_snippet()
+        old_key = highlighting.cache_key('x = 1', 'python')
+        snippet.code = 'x = 2'
+        snippet.save()
+        current_key = highlighting.cache_key('x = 2', 'python')
+        self.assertEqual(HighlightCache.objects.count(), 2)
+        out = StringIO()
+        call_command('highlight_cache', '--prune', stdout=out)
+        self.assertIn('Pruned 1 cached renderings', out.getvalue())
+        self.assertEqual(list(HighlightCache.objects.values_list(
+            'key', flat=True)), [current_key])
+
+        long_ago = timezone.now() - datetime.timedelta(days=60)
+        HighlightCache.objects.update(last_used=long_ago)
+        highlighting.cache_clear()
+        self.create_snippet('x = 2')
+        # Reading the rendering from the table marks it used
+        self.assertGreater(
+            HighlightCache.objects.get(key=current_key).last_used, long_ago)
+        HighlightCache.objects.update(last_used=long_ago)
+        self.assertEqual(highlighting.prune(days=30), 1)
+        self.assertFalse(HighlightCache.objects.filter(
+            key__in=[old_key, current_key]).exists())
+
+    def test_metadata_only_save_skips_highlighting(self):
+        snippet = Snippet.objects.get(pk=self.create_snippet().pk)
+        highlighting.cache_clear()
+        snippet.title = 'renamed'
+        snippet.save()
+        info = highlighting.cache_info()
+        self.assertEqual((info.hits, info.db_hits, info.misses), (0, 0, 0))
+        snippet.code = 'x = 2'
+        snippet.save()
+        self.assertEqual(highlighting.cache_info().misses, 1)
+        self.assertIn('2', snippet.highlighted_code)
+
+
+class AsyncRenderTests(SnippetTestCase):
+    username = 'paster'
+
+    def setUp(self):
+        patcher = mock.patch.object(rendering, 'ASYNC_RENDER', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.snippet = Snippet.objects.create(
+                title='big paste', language=self.language, author=self.user,
+                description='*desc*', code='if a < b: pass')
+        self.assertEqual(len(callbacks), 1)
+
+    def test_save_defers_rendering(self):
+        self.assertEqual(self.snippet.render_status, Snippet.RENDER_PENDING)
+        self.assertEqual(self.snippet.highlighted_code, '')
+        response = self.client.get(self.snippet.get_absolute_url())
+        self.assertContains(response, '<pre>if a &lt; b: pass</pre>',
+                            html=True)
+
+    def test_render_pending_stores_results(self):
+        self.assertEqual(rendering.render_pending(workers=1), (1, 0))
+        self.snippet.refresh_from_db()
+        self.assertEqual(self.snippet.render_status, Snippet.RENDER_READY)
+        self.assertIn('<em>desc</em>', self.snippet.description_html)
+        self.assertIn('highlight', self.snippet.highlighted_code)
+        # The worker's tokens are stored with the HTML
+        self.assertEqual(SnippetTokens.objects.get().code_hash,
+                         self.snippet.code_hash)
+
+
+class ImportSnippetsTests(SnippetTestCase):
+    username = 'importer'
+
+    def setUp(self):
+        records = [
+            {'title': f'imported {i}', 'description': '*d*',
+             'code': f'x = {i}', 'language': 'python', 'author': 'importer',
+             'tags': ['Bulk', 'odd' if i % 2 else 'even']}
+            for i in range(5)]
+        records.insert(2, {'title': 'orphan', 'description': '', 'code': '',
+                           'language': 'cobol', 'author': 'importer'})
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        self.addCleanup(os.remove, self.path)
+
+    def test_imports_renders_and_resumes(self):
+        out, err = StringIO(), StringIO()
+        call_command('import_snippets', self.path, batch_size=2, workers=1,
+                     stdout=out, stderr=err)
+        self.assertIn('Imported 5 snippets, skipped 1', out.getvalue())
+        self.assertIn('cobol', err.getvalue())
+        snippet = Snippet.objects.get(title='imported 3')
+        self.assertIn('<em>d</em>', snippet.description_html)
+        self.assertIn('highlight', snippet.highlighted_code)
+        self.assertEqual(len(search.search('imported')), 5)
+        self.assertEqual(dict(Tag.objects.values_list('name', 'snippet_count')),
+                         {'bulk': 5, 'even': 3, 'odd': 2})
+
+        # A second run picks up at the saved offset and imports nothing
+        call_command('import_snippets', self.path, workers=1,
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Snippet.objects.count(), 5)
+
+
+class RerenderTests(SnippetTestCase):
+    username = 'renderer'
+
+    def setUp(self):
+        self.snippets = [
+            Snippet.objects.create(
+                title=f'snippet {i}', language=self.language, author=self.user,
+                description='*desc*', code=f'x = {i}')
+            for i in range(3)]
+
+    def test_save_records_renderer_version(self):
+        self.assertEqual(self.snippets[0].render_version,
+                         rendering.RENDERER_VERSION)
+
+    def test_rerenders_stale_rows_and_resumes(self):
+        Snippet.objects.update(render_version='old', description_html='old')
+        Snippet.objects.filter(pk=self.snippets[0].pk).update(
+            render_version=rendering.RENDERER_VERSION)
+        # Pretend an earlier run died after writing the second snippet
+        Checkpoint.objects.create(
+            name=f'rerender:{rendering.RENDERER_VERSION}',
+            position=self.snippets[1].pk)
+        call_command('rerender', batch_size=1, workers=1, stdout=StringIO())
+        versions = dict(Snippet.objects.values_list('pk', 'render_version'))
+        self.assertEqual(versions[self.snippets[1].pk], 'old')
+        self.assertEqual(versions[self.snippets[2].pk],
+                         rendering.RENDERER_VERSION)
+        self.assertFalse(Checkpoint.objects.filter(
+            name__startswith='rerender:').exists())
+
+        call_command('rerender', workers=1, stdout=StringIO())
+        self.assertFalse(Snippet.objects.exclude(
+            render_version=rendering.RENDERER_VERSION).exists())
+        # Rows already current are skipped rather than rewritten
+        self.assertEqual(
+            list(Snippet.objects.filter(description_html='old')
+                 .values_list('pk', flat=True)),
+            [self.snippets[0].pk])
+
+    def test_rerender_invalidates_cached_pages_and_feeds(self):
+        cache.clear()
+        Snippet.objects.update(
+            render_version='old', description_html='<p>stale</p>')
+        urls = [self.snippets[0].get_absolute_url(), reverse('feeds:latest')]
+        for url in urls:
+            self.assertContains(self.client.get(url), 'stale')
+        call_command('rerender', workers=1, stdout=StringIO())
+        for url in urls:
+            response = self.client.get(url)
+            self.assertNotContains(response, 'stale')
+            self.assertContains(response, 'desc')
+
+
+class FeedTests(SnippetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        for i in range(3):
+            Snippet.objects.create(
+                title=f'feed item {i}', language=self.language,
+                author=User.objects.create_user(username=f'author{i}'),
+                description='desc', code='pass')
+        self.url = reverse('feeds:latest')
+
+    def test_items_load_authors_in_one_query(self):
+        Site.objects.get_current()
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'author2')
+
+    def test_conditional_get_and_invalidation(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        snippet = Snippet.objects.get(title='feed item 1')
+        snippet.title = 'renamed item'
+        snippet.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'renamed item')
+
+        language_url = reverse('feeds:language', args=['python'])
+        self.client.get(language_url)
+        snippet.delete()
+        response = self.client.get(language_url)
+        self.assertNotContains(response, 'renamed item')
+
+
+class ConditionalSnippetViewTests(SnippetTestCase):
+    username = 'mirror'
+
+    def setUp(self):
+        cache.clear()
+        self.snippet = Snippet.objects.create(
+            title='big', language=self.language, author=self.user,
+            description='desc', code='x = 1\n' * 2000)
+
+    def test_raw_answers_304_from_validators(self):
+        url = reverse('snippets:raw', args=[self.snippet.id])
+        response = self.client.get(url)
+        self.assertEqual(response.content.decode(), self.snippet.code)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_large_code_is_served_precompressed(self):
+        url = reverse('snippets:download', args=[self.snippet.id])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/x-python')
+        self.assertEqual(gzip.decompress(response.content).decode(),
+                         self.snippet.code)
+        # The second fetch reuses the cached body and never loads the code
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(any('"code"' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_each_content_coding_has_its_own_etag(self):
+        url = reverse('snippets:raw', args=[self.snippet.id])
+        etags = {encoding: self.client.get(
+            url, HTTP_ACCEPT_ENCODING=encoding)['ETag']
+            for encoding in ('gzip', 'identity')}
+        self.assertNotEqual(etags['gzip'], etags['identity'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='identity',
+                                   HTTP_IF_NONE_MATCH=etags['gzip'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode(), self.snippet.code)
+
+    def test_code_sent_as_it_is_has_one_etag(self):
+        small = Snippet.objects.create(
+            title='small', language=self.language, author=self.user,
+            description='desc', code='x = 1\n')
+        url = reverse('snippets:raw', args=[small.id])
+        responses = [self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                     for encoding in ('gzip', 'identity')]
+        self.assertFalse(any(response.has_header('Content-Encoding')
+                             for response in responses))
+        self.assertEqual(responses[0]['ETag'], responses[1]['ETag'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=responses[1]['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_etag_changes_with_score(self):
+        url = self.snippet.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Rating.objects.rate(self.snippet.id, self.user.id, Rating.RATING_UP)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pending_messages_skip_the_304(self):
+        self.client.force_login(self.user)
+        add_url = reverse('bookmarks:add', args=[self.snippet.id])
+        url = self.snippet.get_absolute_url()
+        self.client.get(add_url, follow=True)
+        etag = self.client.get(url)['ETag']
+        # Bookmarking again changes nothing the ETag covers
+        self.client.get(add_url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'You have bookmarked this snippet')
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class LeaderboardTests(SnippetTestCase):
+    username = 'alice'
+
+    def setUp(self):
+        self.alice = self.user
+        self.bob = User.objects.create_user(username='bob')
+
+    def create(self, author, days_ago=0):
+        snippet = Snippet.objects.create(
+            title='t', language=self.language, author=author,
+            description='d', code='pass')
+        if days_ago:
+            # Backdate as a bulk edit would, past the signals
+            pub_date = timezone.now() - datetime.timedelta(days=days_ago)
+            Snippet.objects.filter(pk=snippet.pk).update(pub_date=pub_date)
+        return snippet
+
+    def scores(self, board, window=LeaderboardEntry.WINDOW_ALL):
+        return [(obj.pk, obj.leaderboard_score)
+                for obj in leaderboards.top(board, window)]
+
+    def test_saves_and_deletes_move_scores(self):
+        first = self.create(self.alice)
+        self.create(self.alice)
+        self.create(self.bob)
+        self.assertEqual(
+            [author.username for author in Snippet.objects.top_authors()],
+            ['alice', 'bob'])
+        first.author = self.bob
+        first.save()
+        self.assertEqual(self.scores(LeaderboardEntry.BOARD_AUTHORS),
+                         [(self.bob.pk, 2), (self.alice.pk, 1)])
+        # A bucket and an all-windows upsert per board, in a savepoint
+        with self.assertNumQueries(8):
+            leaderboards.record_snippets([first], -1)
+        leaderboards.record_snippets([first])
+        first.delete()
+        self.assertEqual(self.scores(LeaderboardEntry.BOARD_LANGUAGES),
+                         [(self.language.pk, 2)])
+
+        snippet = self.create(self.bob)
+        Bookmark.objects.add(snippet.pk, self.alice.pk)
+        self.assertEqual(self.scores(LeaderboardEntry.BOARD_BOOKMARKED),
+                         [(snippet.pk, 1)])
+        snippet.delete()
+        self.assertEqual(self.scores(LeaderboardEntry.BOARD_BOOKMARKED), [])
+
+    def test_rebuild_and_compact_windows(self):
+        self.create(self.alice, days_ago=10)
+        self.create(self.alice, days_ago=40)
+        self.create(self.bob)
+        leaderboards.rebuild()
+        authors = LeaderboardEntry.BOARD_AUTHORS
+        self.assertEqual(self.scores(authors),
+                         [(self.alice.pk, 2), (self.bob.pk, 1)])
+        self.assertEqual(self.scores(authors, LeaderboardEntry.WINDOW_MONTH),
+                         [(self.alice.pk, 1), (self.bob.pk, 1)])
+        self.assertEqual(self.scores(authors, LeaderboardEntry.WINDOW_WEEK),
+                         [(self.bob.pk, 1)])
+
+        # Eight days on, bob's snippet has left the weekly window
+        call_command('compact_leaderboards', stdout=StringIO())
+        leaderboards.compact(
+            timezone.localdate() + datetime.timedelta(days=8))
+        self.assertEqual(self.scores(authors, LeaderboardEntry.WINDOW_WEEK),
+                         [])
+
+    def test_view_reads_the_board_in_two_queries(self):
+        for author in (self.alice, self.bob):
+            self.create(author)
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse('popular:authors') + '?window=7')
+        self.assertContains(response, 'alice')
+        self.assertEqual(response.context['window'], 7)
+
+
+class TopRatedTests(SnippetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.voters = [User.objects.create_user(username=f'voter{i}')
+                      for i in range(10)]
+
+    def create(self, title, up, down):
+        snippet = Snippet.objects.create(
+            title=title, language=self.language, author=self.user,
+            description='d', code='pass')
+        votes = [Rating.RATING_UP] * up + [Rating.RATING_DOWN] * down
+        for voter, rating in zip(self.voters, votes):
+            Rating.objects.rate(snippet.id, voter.id, rating)
+        snippet.refresh_from_db()
+        return snippet
+
+    def test_wilson_prefers_confidence_over_raw_share(self):
+        self.assertEqual(ranking.wilson_score(0, 0), 0)
+        self.assertGreater(ranking.wilson_score(8, 10),
+                           ranking.wilson_score(1, 1))
+
+    def test_rating_reranks_only_that_snippet(self):
+        lucky = self.create('lucky', 1, 0)
+        solid = self.create('solid', 9, 1)
+        self.assertGreater(solid.wilson_score, lucky.wilson_score)
+        self.assertGreater(solid.hot_score, lucky.hot_score)
+        # The vote and recount, then one read and one write of its scores,
+        # in a savepoint
+        with self.assertNumQueries(6):
+            Rating.objects.rate(lucky.id, self.voters[1].id,
+                                Rating.RATING_DOWN)
+        self.assertEqual(
+            list(Snippet.objects.top_rated().values_list('title', flat=True)),
+            ['solid', 'lucky'])
+
+    def test_views_list_by_ranking(self):
+        for position in range(3):
+            self.create(f'snippet {position}', position, 0)
+        response = self.client.get(reverse('popular:top_rated'))
+        self.assertEqual([s.title for s in response.context['snippet_list']],
+                         ['snippet 2', 'snippet 1', 'snippet 0'])
+        response = self.client.get(reverse('popular:hot'))
+        self.assertEqual(response.context['ranking'], 'hot')
+        self.assertEqual(
+            list(response.context['snippet_list'])[0].title, 'snippet 2')
+
+
+class TagTests(SnippetTestCase):
+    username = 'tagger'
+    password = 'pw'
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, title, tags):
+        snippet = Snippet.objects.create(
+            title=title, language=self.language, author=self.user,
+            description='d', code='pass')
+        snippet.tags.set(Tag.objects.for_names(tags))
+        return snippet
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'snippet_count'))
+
+    def test_counts_follow_tagging_and_deletes(self):
+        first = self.create('first', ['python', 'async'])
+        self.create('second', ['python'])
+        self.assertEqual(self.counts(), {'async': 1, 'python': 2})
+        first.tags.remove(Tag.objects.get(name='async'))
+        Tag.objects.get(name='python').snippets.clear()
+        self.assertEqual(self.counts(), {'async': 0, 'python': 0})
+        # Removing a tag the snippet doesn't carry changes nothing
+        first.tags.remove(Tag.objects.get(name='async'))
+        self.assertEqual(self.counts(), {'async': 0, 'python': 0})
+        first.tags.set(Tag.objects.for_names(['python']))
+        self.assertEqual(self.counts(), {'async': 0, 'python': 1})
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        with self.assertNumQueries(1):
+            Tag.objects.adjust(dict.fromkeys(tag_ids, 1))
+        Tag.objects.adjust(dict.fromkeys(tag_ids, -1))
+        first.delete()
+        self.assertEqual(self.counts(), {'async': 0, 'python': 0})
+        self.assertEqual(list(Tag.objects.top_tags()), [])
+
+    def test_intersection_and_views(self):
+        self.create('both', ['python', 'async'])
+        self.create('sync', ['python'])
+        self.create('other', ['async', 'rust'])
+        tags = Tag.objects.filter(name__in=['python', 'async'])
+        self.assertEqual(
+            [s.title for s in Snippet.objects.tagged(tags)], ['both'])
+
+        response = self.client.get(
+            reverse('tags:detail', args=['python+async']))
+        self.assertEqual([s.title for s in response.context['snippet_list']],
+                         ['both'])
+        self.assertEqual(response.context['snippet_count'], 1)
+        self.assertEqual(self.client.get(
+            reverse('tags:detail', args=['python+nope'])).status_code, 404)
+
+        response = self.client.get(reverse('popular:tags'))
+        self.assertEqual(
+            [(tag.name, tag.snippet_count)
+             for tag in response.context['top_tags']],
+            [('async', 2), ('python', 2), ('rust', 1)])
+
+    def test_form_tags_and_feed(self):
+        self.client.login(username='tagger', password='pw')
+        self.client.post(reverse('snippets:add'), {
+            'title': 'tagged', 'description': 'd', 'code': 'pass',
+            'language': self.language.pk, 'tags': 'Python  web python'})
+        snippet = Snippet.objects.get(title='tagged')
+        self.assertEqual(sorted(tag.name for tag in snippet.tags.all()),
+                         ['python', 'web'])
+
+        url = reverse('feeds:tag', args=['web'])
+        self.assertContains(self.client.get(url), 'tagged')
+        self.client.post(reverse('snippets:edit', args=[snippet.pk]), {
+            'title': 'retitled', 'description': 'd', 'code': 'pass',
+            'language': self.language.pk, 'tags': 'web'})
+        self.assertContains(self.client.get(url), 'retitled')
+        self.assertEqual(self.counts(), {'python': 0, 'web': 1})
+
+
+class RelatedSnippetTests(SnippetTestCase):
+    username = 'relater'
+
+    def create(self, title, code):
+        # Neighbours are found once the snippet is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return Snippet.objects.create(
+                title=title, language=self.language, author=self.user,
+                description='Parse a request', code=code)
+
+    def test_lists_are_trimmed_in_one_statement(self):
+        code = 'import json\ndef fetch_payload(url):\n    return json\n'
+        with mock.patch.object(related, 'RELATED_COUNT', 1):
+            snippets = [self.create('Fetch JSON payload', code + f'x{i}\n')
+                        for i in range(4)]
+            self.assertEqual(RelatedSnippet.objects.filter(
+                snippet=snippets[0]).count(), 1)
+            RelatedSnippet.objects.bulk_create(
+                [RelatedSnippet(snippet=snippet, related=other, score=0.1)
+                 for snippet in snippets for other in snippets
+                 if other != snippet], ignore_conflicts=True)
+            with self.assertNumQueries(1):
+                related._trim([snippet.pk for snippet in snippets])
+        self.assertEqual(RelatedSnippet.objects.count(), 4)
+
+    def test_renaming_reads_the_stored_tokens(self):
+        first = self.create('Fetch JSON payload', 'json.loads(payload)\n')
+        second = self.create('Parse payload', 'json.loads(payload)\n')
+        second.title = 'Fetch JSON payload'
+        with mock.patch.object(tokens, 'lex') as lex, \
+                self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        lex.assert_not_called()
+        self.assertEqual(related.related_to(second.pk), [first])
+
+    def test_rebuild_covers_every_chunk(self):
+        code = 'import json\ndef fetch_payload(url):\n    return json\n'
+        snippets = [self.create('Fetch JSON payload', code + f'x{i}\n')
+                    for i in range(3)]
+        RelatedSnippet.objects.all().delete()
+        stages = list(related.rebuild(chunk_size=1))
+        self.assertEqual(stages[-1], ('saved', 3))
+        for snippet in snippets:
+            self.assertEqual(len(related.related_to(snippet.pk)), 2)
+
+    def test_neighbours_load_only_what_links_need(self):
+        first = self.create('Fetch JSON payload', 'json.loads(payload)\n')
+        second = self.create('Fetch JSON payload', 'json.loads(payload)\n')
+        with CaptureQueriesContext(connection) as queries:
+            found = related.related_to(second.pk)
+            self.assertEqual(
+                [(snippet.get_absolute_url(), snippet.title,
+                  snippet.author.username) for snippet in found],
+                [(first.get_absolute_url(), first.title, self.username)])
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        for column in ('"code"', '"highlighted_code"', '"description"',
+                       '"password"', '"email"'):
+            self.assertNotIn(column, sql)
+
+    def test_similarity_tracks_shared_features(self):
+        sig = related.signature({'a', 'b', 'c', 'd'})
+        self.assertEqual(related.similarity(sig, sig), 1)
+        self.assertLess(
+            related.similarity(sig, related.signature({'x', 'y', 'z'})),
+            related.MIN_SIMILARITY)
+
+    def test_save_refreshes_both_lists(self):
+        code = ('import json\nfrom urllib.request import urlopen\n'
+                'def fetch_payload(url):\n'
+                '    return json.loads(urlopen(url).read())\n')
+        first = self.create('Fetch JSON payload', code)
+        self.create('Unrelated', 'class Matrix:\n    rows = columns = 0\n')
+        second = self.create('Fetch JSON payload', code + 'fetch_payload(1)\n')
+        with self.assertNumQueries(1):
+            self.assertEqual(related.related_to(second.pk), [first])
+        self.assertEqual(related.related_to(first.pk), [second])
+
+        second.code = 'class Matrix:\n    rows = columns = 0\n'
+        second.title = second.description = 'Unrelated'
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertEqual(related.related_to(first.pk), [])
+
+        call_command('rebuild_related', stdout=StringIO())
+        response = self.client.get(second.get_absolute_url())
+        self.assertEqual(
+            [s.title for s in response.context['related_snippets']],
+            ['Unrelated'])
+
+
+class DuplicateTests(SnippetTestCase):
+    username = 'poster'
+    password = 'pw'
+    code = ('def total(items):\n'
+            '    result = 0\n'
+            '    for item in items:\n'
+            '        if item.price > 10:\n'
+            '            result += item.price * item.quantity\n'
+            '    return result')
+
+    def setUp(self):
+        # Fingerprints are stored once the snippet is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.original = Snippet.objects.create(
+                title='original', language=self.language, author=self.user,
+                description='d', code=self.code)
+        self.client.login(username='poster', password='pw')
+
+    def post(self, code, title='repost'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('snippets:add'), {
+                'title': title, 'description': 'd', 'code': code,
+                'language': self.language.pk})
+
+    def test_exact_duplicate_is_rejected(self):
+        response = self.post(self.code)
+        self.assertContains(response, 'has already been posted')
+        self.assertFalse(Snippet.objects.filter(title='repost').exists())
+
+    def test_renamed_copy_is_flagged(self):
+        renamed = self.code.replace('result', 'acc').replace('item', 'row')
+        duplicate = duplicates.find_duplicate(renamed, 'python')
+        self.assertEqual((duplicate.snippet_id, duplicate.exact),
+                         (self.original.pk, False))
+        # Editing a snippet never matches the snippet itself
+        self.assertIsNone(duplicates.find_duplicate(
+            self.code, 'python', exclude=self.original.pk))
+
+        self.post(renamed)
+        flag = SnippetFlag.objects.get(snippet__title='repost')
+        self.assertEqual((flag.flag, flag.duplicate_of, flag.user),
+                         (SnippetFlag.FLAG_DUPLICATE, self.original, None))
+
+        with mock.patch.object(duplicates, 'NEAR_DUPLICATE_ACTION', 'reject'):
+            self.assertContains(self.post(renamed, 'again'),
+                                'has already been posted')
+
+    def test_code_is_lexed_once_per_save(self):
+        renamed = self.code.replace('result', 'acc')
+        with mock.patch.object(tokens, 'lex', wraps=tokens.lex) as lex:
+            self.post(renamed)
+        self.assertEqual(lex.call_count, 1)
+        repost = Snippet.objects.get(title='repost')
+        self.assertTrue(CodeFingerprint.objects.filter(snippet=repost).exists())
+        self.assertTrue(SnippetTokens.objects.filter(snippet=repost).exists())
+        self.assertTrue(SnippetFlag.objects.filter(snippet=repost).exists())
+
+    def test_batches_are_checked_together(self):
+        stream = tokens.lex(self.code, 'python')
+        codes = [(Snippet.hash_code(f'{self.code}\n# {i}'),
+                  duplicates.fingerprints(stream)) for i in range(20)]
+        codes.append((self.original.code_hash, set()))
+        with self.assertNumQueries(3):
+            found = duplicates.find_duplicates(codes)
+        self.assertEqual({(d.snippet_id, d.exact) for d in found[:-1]},
+                         {(self.original.pk, False)})
+        self.assertTrue(found[-1].exact)
+
+    def test_common_fingerprints_are_skipped(self):
+        prints = duplicates.fingerprints(tokens.lex(self.code, 'python'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Snippet.objects.create(
+                title='copy', language=self.language, author=self.user,
+                description='d', code=self.code + '\n')
+        with mock.patch.object(duplicates, 'MAX_SHARED', 1):
+            self.assertEqual(
+                duplicates.find_duplicates([(None, prints)]), [None])
+        self.assertIsNotNone(duplicates.find_duplicates([(None, prints)])[0])
+
+    def test_build_command_indexes_existing_rows(self):
+        CodeFingerprint.objects.all().delete()
+        self.assertIsNone(duplicates.find_duplicate(
+            self.code + '\n', 'python'))
+        call_command('build_fingerprints', stdout=StringIO())
+        self.assertEqual(
+            duplicates.find_duplicate(self.code + '\n', 'python').snippet_id,
+            self.original.pk)
+
+
+class ApiTests(SnippetTestCase):
+    username = 'reader'
+    password = 'pw'
+
+    def setUp(self):
+        self.snippets = [
+            Snippet.objects.create(
+                title=f'snippet {i}', language=self.language,
+                author=self.user, description='d', code=f'x = {i}')
+            for i in range(3)]
+        self.snippets[0].tags.set(Tag.objects.for_names(['web']))
+
+    def get_json(self, name, *args, **params):
+        response = self.client.get(reverse(name, args=args), params)
+        content = b''.join(response.streaming_content) \
+            if response.streaming else response.content
+        return response, json.loads(content)
+
+    def test_list_sparse_fields_and_cursor(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, data = self.get_json(
+                'snippets:api_list', fields='id,title')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"code"', queries[0]['sql'])
+        self.assertEqual(data['results'][0],
+                         {'id': self.snippets[2].pk, 'title': 'snippet 2'})
+        self.assertIsNone(data['next'])
+
+        with mock.patch('snippets.views.api.KeysetPaginator',
+                        lambda qs, ordering: KeysetPaginator(
+                            qs, ordering, per_page=2)):
+            _, first = self.get_json('snippets:api_list', fields='title')
+            self.assertIn('fields=title', first['next'])
+            second = json.loads(b''.join(
+                self.client.get(first['next']).streaming_content))
+        self.assertEqual(second['results'], [{'title': 'snippet 0'}])
+
+        response, data = self.get_json('snippets:api_list', fields='nope')
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_and_bulk(self):
+        _, data = self.get_json('snippets:api_detail', self.snippets[0].pk)
+        self.assertEqual((data['code'], data['tags'], data['language']),
+                         ('x = 0', ['web'], 'python'))
+        response, _ = self.get_json('snippets:api_detail', 0)
+        self.assertEqual(response.status_code, 404)
+
+        ids = ','.join(str(snippet.pk) for snippet in self.snippets)
+        with self.assertNumQueries(1):
+            _, data = self.get_json(
+                'snippets:api_bulk', ids=ids + ',0', fields='id,code')
+        self.assertEqual([row['code'] for row in data['results']],
+                         ['x = 0', 'x = 1', 'x = 2'])
+
+    def test_languages_bookmarks_and_popular(self):
+        _, data = self.get_json('languages:api_list', fields='slug')
+        self.assertEqual(data['results'], [{'slug': 'python'}])
+
+        response, _ = self.get_json('bookmarks:api_user')
+        self.assertEqual(response.status_code, 403)
+        Bookmark.objects.add(self.snippets[1].pk, self.user.pk)
+        self.client.login(username='reader', password='pw')
+        _, data = self.get_json('bookmarks:api_user', fields='title')
+        self.assertEqual(data['results'][0]['snippet'],
+                         {'title': 'snippet 1'})
+
+        _, data = self.get_json('popular:api_authors')
+        self.assertEqual(data['results'], [
+            {'score': 3, 'object': {'id': self.user.pk,
+                                    'username': 'reader'}}])
+        _, data = self.get_json('popular:api_bookmarked', fields='title')
+        self.assertEqual(data['results'],
+                         [{'score': 1, 'object': {'title': 'snippet 1'}}])
+        _, data = self.get_json('popular:api_tags', fields='name')
+        self.assertEqual(data['results'], [{'name': 'web'}])
+        response, _ = self.get_json('popular:api_rated', ranking='hot')
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncViewTests(SnippetTestCase):
+    username = 'waiter'
+
+    def setUp(self):
+        cache.clear()
+        self.snippet = Snippet.objects.create(
+            title='async', language=self.language, author=self.user,
+            description='d', code='x = 1')
+        self.factory = RequestFactory()
+
+    def request(self, **headers):
+        request = self.factory.get('/', **headers)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_raw_and_conditional_get(self):
+        response = await asynchronous.snippet_raw(
+            self.request(), self.snippet.pk)
+        self.assertEqual(response.content, b'x = 1')
+        self.assertIn('Last-Modified', response)
+        response = await asynchronous.snippet_raw(
+            self.request(HTTP_IF_NONE_MATCH=response['ETag']),
+            self.snippet.pk)
+        self.assertEqual(response.status_code, 304)
+
+    async def test_detail_download_and_feed(self):
+        response = await asynchronous.snippet_detail(
+            self.request(), self.snippet.pk)
+        self.assertContains(response, 'async')
+        response = await asynchronous.snippet_download(
+            self.request(), self.snippet.pk)
+        self.assertEqual(response['Content-Type'], 'text/x-python')
+        with self.assertRaises(Http404):
+            await asynchronous.snippet_download(self.request(), 0)
+        view = asynchronous.feed(LatestSnippetsFeed())
+        response = await view(self.request())
+        self.assertContains(response, 'async')
+
+
+class RevisionTests(SnippetTestCase):
+    username = 'editor'
+    password = 'pw'
+
+    def setUp(self):
+        self.lines = [f'value_{i} = {i}\n' for i in range(500)]
+        self.snippet = Snippet.objects.create(
+            title='Long', language=self.language, author=self.user,
+            description='d', code=''.join(self.lines))
+
+    def edit(self, line, text):
+        self.lines[line] = text
+        self.snippet.code = ''.join(self.lines)
+        self.snippet.save()
+        return self.snippet.code
+
+    def test_every_revision_is_rebuilt(self):
+        versions = [self.snippet.code]
+        for i in range(24):
+            versions.append(self.edit(i * 7, f'changed_{i} = True\n'))
+        self.assertEqual(
+            list(SnippetRevision.objects.filter(keyframe=True).values_list(
+                'number', flat=True).order_by('number')), [1, 11, 21])
+        for number, code in enumerate(versions, 1):
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    revisions.code_at(self.snippet.pk, number), code)
+
+    def test_consecutive_revisions_rebuild_together(self):
+        versions = [self.snippet.code]
+        for i in range(11):
+            versions.append(self.edit(i, f'changed_{i} = True\n'))
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                revisions.codes_between(self.snippet.pk, 10, 12),
+                versions[9:12])
+
+    def test_concurrent_edits_both_recorded(self):
+        self.edit(0, 'first = None\n')
+        code_at = revisions.code_at
+        reads = []
+
+        def racing_code_at(snippet_id, number):
+            # Another edit takes the next number between the first read
+            # and its insert
+            reads.append(number)
+            if len(reads) == 1:
+                SnippetRevision.objects.create(
+                    snippet_id=snippet_id, number=number + 1, keyframe=True,
+                    data=zlib.compress(b'other = 1\n'), size=10)
+            return code_at(snippet_id, number)
+
+        with mock.patch.object(revisions, 'code_at', racing_code_at):
+            self.edit(1, 'second = None\n')
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(revisions.code_at(self.snippet.pk, reads[-1] + 1),
+                         self.snippet.code)
+
+    def test_deltas_grow_with_the_change(self):
+        self.edit(250, 'middle = None\n')
+        self.snippet.title = 'Renamed'
+        self.snippet.save()
+        keyframe, delta = SnippetRevision.objects.order_by('number')
+        self.assertFalse(delta.keyframe)
+        self.assertLess(len(delta.data), 60)
+        self.assertGreater(len(keyframe.data), 20 * len(delta.data))
+        self.assertEqual(SnippetRevision.objects.count(), 2)
+
+    def test_history_starts_at_first_edit(self):
+        self.assertFalse(SnippetRevision.objects.exists())
+        Snippet.objects.bulk_create([Snippet(
+            title='Imported', language=self.language, author=self.user,
+            description='d', code='a = 1\n')])
+        imported = Snippet.objects.get(title='Imported')
+        imported.code = 'a = 2\n'
+        imported.save()
+        self.assertEqual(revisions.code_at(imported.pk, 1), 'a = 1\n')
+        self.assertEqual(revisions.code_at(imported.pk, 2), 'a = 2\n')
+
+    def test_views(self):
+        history_url = reverse('snippets:history', args=[self.snippet.pk])
+        self.assertContains(self.client.get(history_url),
+                            "hasn't been edited yet")
+        self.edit(0, 'first = None\n')
+        response = self.client.get(history_url)
+        self.assertContains(response, 'Revision 1')
+        self.assertContains(response, 'Revision 2')
+        response = self.client.get(
+            reverse('snippets:revision', args=[self.snippet.pk, 2]))
+        self.assertContains(response, 'Changes from revision 1')
+        self.assertContains(response, 'first')
+        self.assertEqual(self.client.get(reverse(
+            'snippets:revision', args=[self.snippet.pk, 3])).status_code, 404)
+
+
+class CompressedTextTests(SnippetTestCase):
+    username = 'author'
+
+    def setUp(self):
+        self.code = ''.join(f'compressible_{i} = {i}\n' for i in range(200))
+        self.snippet = Snippet.objects.create(
+            title='Big', language=self.language, author=self.user,
+            description='d', code=self.code)
+
+    def stored(self, column):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {column} FROM snippets_snippet '
+                           f'WHERE id = %s', [self.snippet.pk])
+            return cursor.fetchone()[0]
+
+    def test_large_text_is_stored_compressed(self):
+        stored = self.stored('code')
+        self.assertEqual(stored[:1], b'\xff')
+        self.assertLess(len(stored), len(self.code) / 3)
+        self.assertEqual(self.stored('highlighted_code')[:1], b'\xff')
+        self.assertEqual(Snippet.objects.get().code, self.code)
+        self.assertTrue(Snippet.objects.filter(code=self.code).exists())
+
+    def test_short_and_unconverted_text(self):
+        self.assertEqual(fields.compress('short'), b'short')
+        self.assertEqual(fields.decompress(b'short'), 'short')
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE snippets_snippet SET code = %s',
+                           ['legacy text'])
+        self.assertEqual(Snippet.objects.get().code, 'legacy text')
+
+    def test_search_still_indexes_code(self):
+        search.rebuild_index()
+        self.assertEqual(search.search_ids('compressible_150'),
+                         [self.snippet.pk])
+
+    def test_listing_leaves_out_the_text(self):
+        snippet = Snippet.objects.listing().get()
+        self.assertTrue({'code', 'highlighted_code', 'description_html'}
+                        <= snippet.get_deferred_fields())
+        with self.assertNumQueries(0):
+            snippet.author.username, snippet.language.name
+
+    def test_text_is_loaded_only_when_asked_for(self):
+        text = {'description', 'description_html', 'code',
+                'highlighted_code'}
+        self.assertEqual(Snippet.objects.get().get_deferred_fields(), text)
+        self.assertEqual(
+            self.language.snippet_set.get().get_deferred_fields(), text)
+        self.assertEqual(
+            Snippet.objects.with_text().get().get_deferred_fields(), set())
+        unloaded = Snippet.objects.only('code').get().get_deferred_fields()
+        self.assertNotIn('code', unloaded)
+        self.assertIn('highlighted_code', unloaded)
+
+    def test_saving_without_the_text_leaves_it_alone(self):
+        snippet = Snippet.objects.get()
+        snippet.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            snippet.save()
+        self.assertTrue({'description_html', 'highlighted_code'}
+                        <= snippet.get_deferred_fields())
+        stored = Snippet.objects.with_text().get()
+        self.assertEqual(stored.code, self.code)
+        self.assertIn('compressible_199', stored.highlighted_code)
+
+    def test_default_manager_loads_the_text(self):
+        # The admin, dumpdata and serializers read every field of each row
+        self.assertEqual(
+            Snippet._default_manager.get().get_deferred_fields(), set())
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('dumpdata', 'snippets.snippet', stdout=out)
+        self.assertIn('compressible_199', out.getvalue())
+
+
+class TokenStreamTests(SnippetTestCase):
+    username = 'author'
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet = Snippet.objects.create(
+                title='Loop', language=self.language, author=self.user,
+                description='d', code='\n\nfor i in range(3):\r\n'
+                '\tprint(i)\r\nprint("done")')
+        self.url = reverse('snippets:raw', args=[self.snippet.pk])
+
+    def test_stream_is_stored_at_save(self):
+        stored = SnippetTokens.objects.get(snippet=self.snippet)
+        self.assertEqual(stored.code_hash, self.snippet.code_hash)
+        lexed = tokens.lex(self.snippet.code, 'python')
+        with self.assertNumQueries(1):
+            self.assertEqual(tokens.tokens_of(self.snippet), lexed)
+        self.assertEqual(tokens.render(lexed, 'html'),
+                         self.snippet.highlighted_code)
+
+    def test_stale_stream_is_lexed_again(self):
+        Snippet.objects.filter(pk=self.snippet.pk).update(
+            code='x = 1', code_hash=Snippet.hash_code('x = 1'))
+        snippet = Snippet.objects.only(
+            'code', 'code_hash', 'language').get(pk=self.snippet.pk)
+        # Reading only reads; the new stream is stored in the background
+        with mock.patch.object(rendering, 'submit') as submit, \
+                self.assertNumQueries(2):
+            self.assertEqual(
+                tokens.render(tokens.tokens_of(snippet), 'text'), 'x = 1\n')
+        func, *args = submit.call_args.args
+        func(*args)
+        self.assertEqual(SnippetTokens.objects.get().code_hash,
+                         snippet.code_hash)
+        with self.assertNumQueries(1):
+            tokens.tokens_of(snippet)
+
+    def test_raw_formats(self):
+        response = self.client.get(self.url, {'format': 'ansi'})
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIn('\x1b[', response.content.decode())
+        response = self.client.get(self.url, {'lines': '2-3'})
+        self.assertEqual(response.content.decode(),
+                         '\tprint(i)\nprint("done")\n')
+        response = self.client.get(
+            self.url, {'format': 'html', 'lines': '2'})
+        self.assertContains(response, '<span class="normal">2</span>')
+        self.assertNotContains(response, 'done')
+        etags = {self.client.get(self.url, query)['ETag'] for query in (
+            {}, {'format': 'ansi'}, {'lines': '2-3'}, {'format': 'bogus'})}
+        self.assertEqual(len(etags), 3)
+
+
+class QueryBudgetTests(SnippetTestCase):
+    """
+    Upper bounds on the queries each page runs, over enough rows that a
+    query per row would break them.
+    """
+    username = 'reader'
+    password = 'pw'
+
+    def setUp(self):
+        cache.clear()
+        authors = [User.objects.create_user(username=f'author{i}')
+                   for i in range(3)]
+        tag = Tag.objects.create(name='loops')
+        self.snippets = []
+        for i in range(12):
+            snippet = Snippet.objects.create(
+                title=f'snippet {i}', language=self.language,
+                author=authors[i % 3], description='d',
+                code=f'for i in range({i}):\n    print(i)')
+            snippet.tags.add(tag)
+            Bookmark.objects.create(snippet=snippet, user=self.user)
+            Rating.objects.create(snippet=snippet, user=self.user, rating=1)
+            self.snippets.append(snippet)
+
+    def assertQueryBudget(self, budget, url):
+        with queries.record_queries() as recorder:
+            response = self.client.get(url)
+            b''.join(response)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            recorder.count, budget,
+            f"{url} ran {recorder.count} queries: {dict(recorder.shapes)}")
+        self.assertFalse(recorder.repeated(), url)
+
+    def test_budgets(self):
+        # (url, anonymous budget, logged in budget); logging in adds the
+        # session and user queries, and the viewer's bookmarks and ratings.
+        snippet = self.snippets[0]
+        budgets = [
+            (reverse('snippets:list'), 2, 2),
+            (reverse('snippets:detail', args=[snippet.pk]), 4, 8),
+            (reverse('snippets:raw', args=[snippet.pk]), 2, 2),
+            (reverse('languages:list'), 1, 1),
+            (reverse('languages:detail', args=['python']), 3, 3),
+            (reverse('popular:authors'), 2, 2),
+            (reverse('popular:languages'), 2, 2),
+            (reverse('popular:bookmarked'), 2, 4),
+            (reverse('popular:top_rated'), 1, 1),
+            (reverse('popular:tags'), 1, 1),
+            (reverse('tags:detail', args=['loops']), 2, 2),
+            (reverse('feeds:latest'), 3, 3),
+            (reverse('snippets:api_list'), 1, 1),
+            (reverse('popular:api_bookmarked'), 2, 2),
+            (reverse('bookmarks:user'), None, 3),
+            (reverse('bookmarks:api_user'), None, 3),
+        ]
+        for logged_in in (False, True):
+            if logged_in:
+                self.client.login(username='reader', password='pw')
+            for url, anonymous, user in budgets:
+                budget = user if logged_in else anonymous
+                if budget is None:
+                    continue
+                with self.subTest(url=url, logged_in=logged_in):
+                    cache.clear()
+                    self.assertQueryBudget(budget, url)
+
+    def test_middleware_counts_per_view(self):
+        queries.view_stats.clear()
+        with self.settings(DEBUG=True):
+            response = self.client.get(
+                reverse('snippets:raw', args=[self.snippets[0].pk]))
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertEqual(queries.view_stats['snippets:raw'][:2], [1, 2])
+
+    async def test_middleware_counts_async_requests(self):
+        queries.view_stats.clear()
+        await self.async_client.get(
+            reverse('snippets:raw', args=[self.snippets[0].pk]))
+        self.assertEqual(queries.view_stats['snippets:raw'][:2], [1, 2])
+        await self.async_client.get('/no/such/page/')
+        await self.async_client.get('/nor/this/one/')
+        self.assertEqual(list(queries.view_stats),
+                         ['snippets:raw', queries.UNRESOLVED])
+        self.assertEqual(queries.view_stats[queries.UNRESOLVED][0], 2)
+
+    def test_repeated_queries(self):
+        with queries.record_queries() as recorder:
+            for snippet in Snippet.objects.all():
+                snippet.author.username
+        self.assertEqual(list(recorder.repeated().values()), [12])
+        self.assertEqual(
+            queries.shape('WHERE id IN (%s, %s, %s)'), 'WHERE id IN (...)')
+
+
+class PageCacheTests(SnippetTestCase):
+    username = 'reader'
+    password = 'pw'
+
+    def setUp(self):
+        cache.clear()
+        self.snippet = Snippet.objects.create(
+            title='Cached', language=self.language, author=self.user,
+            description='d', code='print(1)')
+        self.url = reverse('snippets:detail', args=[self.snippet.pk])
+
+    def get(self, url):
+        with queries.record_queries() as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, recorder.count
+
+    def test_anonymous_pages_are_cached(self):
+        for url in (self.url, reverse('snippets:list'),
+                    reverse('languages:detail', args=['python']),
+                    reverse('popular:top_rated')):
+            with self.subTest(url=url):
+                first, _ = self.get(url)
+                second, count = self.get(url)
+                self.assertEqual(first.content, second.content)
+                # Only the detail page's conditional GET validators
+                self.assertLessEqual(count, 1)
+
+    def test_writes_invalidate_pages(self):
+        list_url = reverse('snippets:list')
+        top_rated_url = reverse('popular:top_rated')
+        for url in (self.url, list_url, top_rated_url):
+            self.get(url)
+        Rating.objects.rate(self.snippet.pk, self.user.pk, 1)
+        self.assertContains(self.get(self.url)[0], 'after 1 rating')
+        self.snippet.title = 'Renamed'
+        self.snippet.save()
+        for url in (self.url, list_url, top_rated_url):
+            self.assertContains(self.get(url)[0], 'Renamed')
+
+    def test_related_lists_follow_renames_and_deletes(self):
+        other = Snippet.objects.create(
+            title='Neighbour', language=self.language, author=self.user,
+            description='d', code='print(2)')
+        RelatedSnippet.objects.create(
+            snippet=self.snippet, related=other, score=0.5)
+        self.assertContains(self.get(self.url)[0], 'Neighbour')
+        # Without waiting for the related lists to be refreshed on commit
+        other.title = 'Renamed neighbour'
+        other.save()
+        self.assertContains(self.get(self.url)[0], 'Renamed neighbour')
+        other.delete()
+        self.assertNotContains(self.get(self.url)[0], 'Renamed neighbour')
+
+    def test_signed_in_pages_cache_the_snippet_fragment(self):
+        self.client.login(username='reader', password='pw')
+        _, uncached = self.get(self.url)
+        response, cached = self.get(self.url)
+        self.assertLess(cached, uncached)
+        self.assertContains(response, 'Edit this snippet')
+        self.snippet.tags.add(Tag.objects.create(name='loops'))
+        self.assertContains(self.get(self.url)[0], 'loops')
+
+    def test_session_cookie_bypasses_the_page_cache(self):
+        self.get(self.url)
+        self.client.login(username='reader', password='pw')
+        self.assertContains(self.get(self.url)[0], 'Edit this snippet')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {
+                    'BACKEND':
+                        'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': location}}):
+            before = pagecache.generations([pagecache.LIST])
+            self.assertEqual(pagecache.generations([pagecache.LIST]), before)
+            self.get(self.url)
+            self.assertLessEqual(self.get(self.url)[1], 1)
+            self.snippet.title = 'Renamed'
+            self.snippet.save()
+            self.assertNotEqual(
+                pagecache.generations([pagecache.LIST]), before)
+            self.assertContains(self.get(self.url)[0], 'Renamed')
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_run(self):
+        call_command('seed_bench', users=5, languages=2, snippets=30,
+                     ratings=40, bookmarks=20, stdout=StringIO())
+        self.assertEqual(Snippet.objects.count(), 30)
+        self.assertEqual(Rating.objects.count(), 40)
+        snippet = Snippet.objects.order_by('-rating_count').first()
+        self.assertEqual(snippet.rating_count, snippet.rating_set.count())
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('run_benchmarks', repeat=1, output=output,
+                         stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)
+        self.assertEqual(set(results['results']), set(benchmarks.BENCHMARKS))
+        self.assertEqual(results['rows']['snippets'], 30)
+        # The writing benchmarks roll back
+        self.assertEqual(Snippet.objects.count(), 30)
+        self.assertEqual(Rating.objects.count(), 40)
+
+
+class LoadTestTests(SnippetTestCase):
+    username = 'loader'
+
+    def setUp(self):
+        self.snippet = Snippet.objects.create(
+            title='load', language=self.language, author=self.user,
+            description='d', code='x = 1')
+
+    def test_percentile(self):
+        timings = list(range(1, 101))
+        self.assertEqual(load_test.percentile(timings, 50), 50)
+        self.assertEqual(load_test.percentile(timings, 99), 99)
+        self.assertEqual(load_test.percentile([7], 95), 7)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_virtual_user(self):
+        client = Client()
+        client.force_login(self.user)
+        user = load_test.VirtualUser(
+            load_test.InProcessTransport(get_wsgi_application()),
+            client.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.assertEqual(user.request(
+            'GET', reverse('snippets:raw', args=[self.snippet.pk])), 200)
+        add = reverse('snippets:add')
+        self.assertEqual(user.request('GET', add), 200)
+        self.assertIn(settings.CSRF_COOKIE_NAME, user.cookies)
+        self.assertEqual(user.request('POST', add, data={
+            'title': 'posted', 'description': 'd', 'code': 'y = 2',
+            'language': self.language.pk, 'tags': ''}), 302)
+        self.assertTrue(Snippet.objects.filter(title='posted').exists())
+
+    def test_mix_overrides(self):
+        command = load_test.Command()
+        mix = dict((name, weight) for name, weight, _ in command.parse_mix(
+            ['snippets:add=0', 'snippets:raw=5']))
+        self.assertNotIn('snippets:add', mix)
+        self.assertEqual(mix['snippets:raw'], 5)
+        with self.assertRaises(CommandError):
+            command.parse_mix(['nope=1'])
 
-# Additionally, you can use the assertContains() method to check if the output is as expected, and assertTemplateUsed() method to check if the filter is used.
\ No newline at end of file
+    def test_error_rate_applies_per_url_name(self):
+        command = load_test.Command(stdout=StringIO())
+        report = {'requests': 1000, 'errors': 5, 'urls': {
+            'snippets:detail': {'requests': 990, 'errors': 0, 'p95': 1},
+            'snippets:add': {'requests': 10, 'errors': 5, 'p95': 1}}}
+        options = {'max_error_rate': 0.01, 'max_p95': None,
+                   'baseline': None}
+        with self.assertRaisesMessage(
+                CommandError, '5 of 10 snippets:add requests failed'):
+            command.enforce_thresholds(report, options)
+        report['urls']['snippets:add']['errors'] = report['errors'] = 0
+        command.enforce_thresholds(report, options)
@@ -0,0 +1,208 @@
+"""
+Stored Pygments token streams, rendered to any output format without
+lexing the code again.
+
+A stream is kept as a table of the token types it uses and, per token, an
+index into that table and the token's length. The token values are not
+stored: they are slices of the code as the lexer saw it (see
+``prepare()``), so the stream is a small fraction of the code's size. The
+whole is zlib-compressed.
+
+Streams are written when a snippet's code is highlighted. Otherwise they
+are lexed on first use and stored in the background. A stream is only
+used for the exact code and language it was lexed from.
+"""
+import array
+import re
+import zlib
+
+from pygments import format as pygments_format
+from pygments.formatters import HtmlFormatter, TerminalFormatter
+from pygments.token import string_to_tokentype
+
+from . import highlighting
+
+# Bump when the encoding changes; older streams are then lexed again
+STREAM_VERSION = 1
+
+# Lines split on newlines only, unlike str.splitlines()
+_LINE_RE = re.compile(r'[^\n]*\n|[^\n]+')
+
+FORMATS = {
+    # The site's highlighted HTML, with line numbers
+    'html': lambda start: HtmlFormatter(
+        **dict(highlighting.FORMATTER_OPTIONS, linenostart=start)),
+    'html-plain': lambda start: HtmlFormatter(),
+    'ansi': lambda start: TerminalFormatter(),
+}
+CONTENT_TYPES = {
+    'html': 'text/html',
+    'html-plain': 'text/html',
+    'ansi': 'text/plain',
+    'text': 'text/plain',
+}
+
+
+def prepare(code, lexer):
+    """ The text the lexer actually tokenizes, after Pygments' newline,
+    BOM and whitespace handling. """
+    text = code
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if lexer.stripall:
+        text = text.strip()
+    elif lexer.stripnl:
+        text = text.strip('\n')
+    if lexer.tabsize > 0:
+        text = text.expandtabs(lexer.tabsize)
+    if lexer.ensurenl and not text.endswith('\n'):
+        text += '\n'
+    return text
+
+
+def lex(code, language_code):
+    """ Lex the code into a list of (token type, value) pairs. """
+    return list(highlighting.get_lexer(language_code).get_tokens(code))
+
+
+def encode(tokens):
+    types, indexes = [], {}
+    pairs = array.array('I')
+    for ttype, value in tokens:
+        if ttype not in indexes:
+            indexes[ttype] = len(types)
+            types.append(str(ttype))
+        pairs.extend((indexes[ttype], len(value)))
+    header = '\n'.join(types).encode('utf-8')
+    return zlib.compress(
+        bytes([STREAM_VERSION]) + header + b'\0' + pairs.tobytes())
+
+
+def decode(data, text):
+    """ Rebuild the (token type, value) pairs from a stream and the
+    prepared text it was lexed from. """
+    data = zlib.decompress(bytes(data))
+    if data[0] != STREAM_VERSION:
+        raise ValueError(f"Unknown token stream version {data[0]}")
+    header, _, packed = data[1:].partition(b'\0')
+    types = [string_to_tokentype(name)
+             for name in header.decode('utf-8').split('\n')]
+    pairs = array.array('I', packed)
+    tokens, position = [], 0
+    for index, length in zip(pairs[::2], pairs[1::2]):
+        tokens.append((types[index], text[position:position + length]))
+        position += length
+    if position != len(text):
+        raise ValueError("Token stream doesn't match the code")
+    return tokens
+
+
+def storable(code, language_code, tokens):
+    """ Whether the tokens rebuild the code exactly; lexers that rewrite
+    their input make streams that don't, which are not stored. """
+    text = prepare(code, highlighting.get_lexer(language_code))
+    return ''.join(value for _, value in tokens) == text
+
+
+def _save(snippet_id, code_hash, language_code, data):
+    save_many([(snippet_id, code_hash, language_code, data)])
+
+
+def save_many(streams):
+    """ Store encoded streams, given as (snippet pk, code_hash, language
+    code, data) tuples, in one statement. """
+    from .models import SnippetTokens
+
+    SnippetTokens.objects.upsert_many(
+        ['snippet'], [
+            {'snippet_id': snippet_id, 'code_hash': code_hash,
+             'language_code': language_code, 'data': data}
+            for snippet_id, code_hash, language_code, data in streams],
+        update=['code_hash', 'language_code', 'data'])
+
+
+def store(snippet, tokens=None):
+    """
+    Save the token stream of the snippet's code, lexing it unless the
+    tokens are given. Returns the tokens.
+    """
+    language_code = snippet.language.language_code
+    if tokens is None:
+        tokens = lex(snippet.code, language_code)
+    if storable(snippet.code, language_code, tokens):
+        _save(snippet.pk, snippet.code_hash, language_code, encode(tokens))
+    return tokens
+
+
+def tokens_of(snippet):
+    """ The snippet's tokens, from its stored stream when it is current.
+    Otherwise they are lexed, and storing them is left to the background
+    dispatcher, so reading a snippet never writes. """
+    from . import rendering
+    from .models import SnippetTokens
+
+    language_code = snippet.language.language_code
+    stored = SnippetTokens.objects.filter(
+        snippet=snippet.pk, code_hash=snippet.code_hash,
+        language_code=language_code).values_list('data', flat=True).first()
+    if stored is not None:
+        try:
+            return decode(stored, prepare(
+                snippet.code, highlighting.get_lexer(language_code)))
+        except ValueError:
+            pass
+    tokens = lex(snippet.code, language_code)
+    if storable(snippet.code, language_code, tokens):
+        rendering.submit(_save, snippet.pk, snippet.code_hash,
+                         language_code, encode(tokens))
+    return tokens
+
+
+def streams_of(snippets):
+    """
+    The tokens of each snippet's code, as {pk: tokens}: from the current
+    stored streams, read in one query, and lexed otherwise. Nothing is
+    written. The snippets need their language loaded.
+    """
+    from .models import SnippetTokens
+
+    current = {snippet.pk: snippet for snippet in snippets}
+    found = {}
+    for pk, code_hash, language_code, data in SnippetTokens.objects.filter(
+            snippet__in=list(current)).values_list(
+            'snippet', 'code_hash', 'language_code', 'data'):
+        snippet = current[pk]
+        if (code_hash, language_code) != (
+                snippet.code_hash, snippet.language.language_code):
+            continue
+        try:
+            found[pk] = decode(data, prepare(
+                snippet.code, highlighting.get_lexer(language_code)))
+        except ValueError:
+            pass
+    for pk, snippet in current.items():
+        if pk not in found:
+            found[pk] = lex(snippet.code, snippet.language.language_code)
+    return found
+
+
+def select_lines(tokens, first, last):
+    """ The tokens of lines ``first`` to ``last`` (from 1, inclusive). """
+    selected, line = [], 1
+    for ttype, value in tokens:
+        for part in _LINE_RE.findall(value):
+            if first <= line <= last:
+                selected.append((ttype, part))
+            if part.endswith('\n'):
+                line += 1
+        if line > last:
+            break
+    return selected
+
+
+def render(tokens, fmt, first_line=1):
+    """ Format the tokens as ``fmt``, one of FORMATS or 'text'. """
+    if fmt == 'text':
+        return ''.join(value for _, value in tokens)
+    return pygments_format(tokens, FORMATS[fmt](first_line))
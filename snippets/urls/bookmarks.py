@@ -1,6 +1,6 @@
 from django.urls import path
 
-from ..views import bookmarks
+from ..views import api, bookmarks
 
 app_name = 'bookmarks'
 
@@ -16,4 +16,8 @@ urlpatterns = [
     path('<int:snippet_id>/delete/',
          bookmarks.delete_bookmark,
          name='delete'),
+
+    path('api/',
+         api.user_bookmarks,
+         name='api_user'),
 ]
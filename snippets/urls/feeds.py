@@ -1,22 +1,27 @@
 from django.urls import path
 
 from .. import feeds
+from ..views import asynchronous
+
+# Behind django_snippets.asgi the feeds run as async views
+view = asynchronous.feed if asynchronous.ASYNC_VIEWS else (lambda feed: feed)
 
 app_name = 'feeds'
 
 urlpatterns = [
     path('author/<username>/',
-         feeds.SnippetsByAuthorFeed(),
+         view(feeds.SnippetsByAuthorFeed()),
          name='author'),
 
     path('language/<slug:slug>/',
-         feeds.SnippetsByLanguageFeed(),
+         view(feeds.SnippetsByLanguageFeed()),
          name='language'),
 
     path('latest/',
-         feeds.LatestSnippetsFeed(),
+         view(feeds.LatestSnippetsFeed()),
          name='latest'),
 
-    # path('tag/<slug:slug>/',
-    #      feeds.SnippetsByTagFeed(), name='feed_tag'),
+    path('tag/<slug:name>/',
+         view(feeds.SnippetsByTagFeed()),
+         name='tag'),
 ]
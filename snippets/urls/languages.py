@@ -1,6 +1,6 @@
 from django.urls import path
 
-from ..views import languages
+from ..views import api, languages
 
 app_name = 'languages'
 
@@ -9,6 +9,14 @@ urlpatterns = [
          languages.language_list,
          name='list'),
 
+    path('api/',
+         api.language_list,
+         name='api_list'),
+
+    path('api/<slug:slug>/',
+         api.language_detail,
+         name='api_detail'),
+
     path('<slug:slug>/',
          languages.language_detail,
          name='detail'),
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from ..views import popular
+from ..views import api, popular
 
 app_name = 'popular'
 
@@ -17,7 +17,36 @@ urlpatterns = [
          popular.most_bookmarked,
          name='bookmarked'),
 
-    # path('rated/',
-    #      popular.top_rated,
-    #      name='top_rated'),
+    path('tags/',
+         popular.top_tags,
+         name='tags'),
+
+    path('rated/',
+         popular.top_rated,
+         name='top_rated'),
+
+    path('rated/hot/',
+         popular.top_rated,
+         {'ranking': 'hot'},
+         name='hot'),
+
+    path('api/authors/',
+         api.top_authors,
+         name='api_authors'),
+
+    path('api/languages/',
+         api.top_languages,
+         name='api_languages'),
+
+    path('api/bookmarks/',
+         api.most_bookmarked,
+         name='api_bookmarked'),
+
+    path('api/rated/',
+         api.top_rated,
+         name='api_rated'),
+
+    path('api/tags/',
+         api.top_tags,
+         name='api_tags'),
 ]
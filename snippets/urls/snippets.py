@@ -1,6 +1,9 @@
 from django.urls import path
 
-from ..views import snippets
+from ..views import api, asynchronous, snippets
+
+# Behind django_snippets.asgi the read-heavy views run as async views
+reads = asynchronous if asynchronous.ASYNC_VIEWS else snippets
 
 app_name = 'snippets'
 
@@ -9,12 +12,16 @@ urlpatterns = [
          snippets.snippet_list,
          name='list'),
 
+    path('search/',
+         snippets.search,
+         name='search'),
+
     path('add/',
          snippets.snippet_add,
          name='add'),
 
     path('<int:snippet_id>/',
-         snippets.snippet_detail,
+         reads.snippet_detail,
          name='detail'),
 
     path('<int:snippet_id>/edit/',
@@ -22,13 +29,21 @@ urlpatterns = [
          name='edit'),
 
     path('<int:snippet_id>/download/',
-         snippets.snippet_download,
+         reads.snippet_download,
          name='download'),
 
     path('<int:snippet_id>/raw/',
-         snippets.snippet_raw,
+         reads.snippet_raw,
          name='raw'),
 
+    path('<int:snippet_id>/history/',
+         snippets.snippet_history,
+         name='history'),
+
+    path('<int:snippet_id>/history/<int:number>/',
+         snippets.snippet_revision,
+         name='revision'),
+
     path('<int:snippet_id>/flag/',
          snippets.snippet_flag,
          name='flag'),
@@ -36,4 +51,16 @@ urlpatterns = [
     path('<int:snippet_id>/rate/',
          snippets.snippet_rate,
          name='rate'),
+
+    path('api/snippets/',
+         api.snippet_list,
+         name='api_list'),
+
+    path('api/snippets/bulk/',
+         api.snippet_bulk,
+         name='api_bulk'),
+
+    path('api/snippets/<int:snippet_id>/',
+         api.snippet_detail,
+         name='api_detail'),
 ]
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from ..views import tags
+
+app_name = 'tags'
+
+urlpatterns = [
+    path('<str:names>/',
+         tags.tag_detail,
+         name='detail'),
+]
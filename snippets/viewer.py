@@ -0,0 +1,67 @@
+from .models import Bookmark, Rating
+
+
+class ViewerState:
+    """
+    The bookmarks and ratings a single user holds over a set of snippets.
+
+    Snippets are loaded in batches: ``prime()`` queues the snippets a page is
+    about to render, and the first lookup fetches the user's bookmarks and
+    ratings for every queued snippet with one query each. A lookup for a
+    snippet that was never primed loads it (and whatever else is queued) on
+    demand, so the state is always correct, just less batched.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.bookmarked = set()
+        self.ratings = {}
+        self._loaded = set()
+        self._pending = set()
+
+    @classmethod
+    def for_context(cls, context, user):
+        """
+        Return the state for ``user``, memoized on the request when the
+        context has one and on the template's render context otherwise.
+        """
+        request = context.get('request')
+        if request is not None:
+            states = request.__dict__.setdefault('_viewer_states', {})
+        else:
+            states = context.render_context.setdefault('_viewer_states', {})
+        key = getattr(user, 'pk', None)
+        if key not in states:
+            states[key] = cls(user)
+        return states[key]
+
+    def prime(self, snippets):
+        """ Queue snippets (or snippet ids) to be loaded on the next lookup. """
+        for snippet in snippets:
+            snippet_id = getattr(snippet, 'pk', snippet)
+            if snippet_id not in self._loaded:
+                self._pending.add(snippet_id)
+
+    def is_bookmarked(self, snippet):
+        self._ensure_loaded(snippet.pk)
+        return snippet.pk in self.bookmarked
+
+    def get_rating(self, snippet):
+        """ Return the user's Rating of the snippet, or None. """
+        self._ensure_loaded(snippet.pk)
+        return self.ratings.get(snippet.pk)
+
+    def _ensure_loaded(self, snippet_id):
+        if snippet_id in self._loaded:
+            return
+        ids = self._pending | {snippet_id}
+        self._pending = set()
+        self._loaded |= ids
+        if not getattr(self.user, 'is_authenticated', False):
+            return
+        self.bookmarked.update(
+            Bookmark.objects.filter(user_id=self.user.pk, snippet_id__in=ids)
+            .values_list('snippet_id', flat=True))
+        for rating in Rating.objects.filter(
+                user_id=self.user.pk, snippet_id__in=ids):
+            self.ratings[rating.snippet_id] = rating
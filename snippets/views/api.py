@@ -0,0 +1,193 @@
+"""
+Read-only JSON API.
+
+Every endpoint takes ``?fields=`` to choose the fields returned; lists are
+cursor paginated, with ``next`` and ``previous`` URLs next to the
+``results``.
+"""
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+from .. import api, leaderboards
+from ..models import Bookmark, Language, LeaderboardEntry, Snippet, Tag
+from ..pagination import InvalidCursor, KeysetPaginator
+from ..ranking import ORDERINGS
+from .popular import _window
+
+
+def api_view(view):
+    """ Allow only GET and HEAD, and answer bad ``?fields=`` with a 400. """
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except api.FieldError as e:
+            return api.error(str(e))
+    return wrapper
+
+
+def _snippet_page(request, snippets, ordering=('-pub_date', '-id')):
+    """ Stream one cursor page of snippets in the requested fields. """
+    fields = api.parse_fields(
+        request, api.SNIPPET_FIELDS, api.SNIPPET_LIST_FIELDS)
+    keys = [key.lstrip('-') for key in ordering]
+    paginator = KeysetPaginator(
+        snippets.values(*api.columns(fields, api.SNIPPET_FIELDS, extra=keys)),
+        ordering=ordering)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return api.error("Invalid cursor.")
+    return api.stream(api.serialize_snippets(page, fields),
+                      **api.page_links(request, page))
+
+
+@api_view
+def snippet_list(request):
+    """
+    Snippets, newest first. Filter with ``?language=<slug>``,
+    ``?author=<username>`` and any number of ``?tag=<name>``.
+    """
+    snippets = Snippet.objects.all()
+    names = set(request.GET.getlist('tag'))
+    if names:
+        tags = list(Tag.objects.filter(name__in=names))
+        if len(tags) != len(names):
+            snippets = snippets.none()
+        else:
+            snippets = Snippet.objects.tagged(tags)
+    if 'language' in request.GET:
+        snippets = snippets.filter(language__slug=request.GET['language'])
+    if 'author' in request.GET:
+        snippets = snippets.filter(author__username=request.GET['author'])
+    return _snippet_page(request, snippets)
+
+
+@api_view
+def snippet_detail(request, snippet_id):
+    fields = api.parse_fields(request, api.SNIPPET_FIELDS)
+    row = Snippet.objects.filter(pk=snippet_id).values(
+        *api.columns(fields, api.SNIPPET_FIELDS)).first()
+    if row is None:
+        return api.error("No Snippet matches the given query.", status=404)
+    return JsonResponse(next(api.serialize_snippets([row], fields)))
+
+
+@api_view
+def snippet_bulk(request):
+    """
+    The snippets listed in ``?ids=1,2,3`` (at most SNIPPETS_API_MAX_BULK_IDS)
+    in primary key order, read with one query. Missing ids are skipped.
+    """
+    try:
+        ids = {int(pk) for pk in request.GET.get('ids', '').split(',') if pk}
+    except ValueError:
+        return api.error("ids must be a comma-separated list of integers.")
+    if len(ids) > api.MAX_BULK_IDS:
+        return api.error(f"At most {api.MAX_BULK_IDS} ids per request.")
+    fields = api.parse_fields(
+        request, api.SNIPPET_FIELDS, api.SNIPPET_LIST_FIELDS)
+    rows = Snippet.objects.filter(pk__in=ids).order_by('pk').values(
+        *api.columns(fields, api.SNIPPET_FIELDS)).iterator(
+        chunk_size=api.STREAM_CHUNK_SIZE)
+    return api.stream(api.serialize_snippets(rows, fields))
+
+
+@api_view
+def language_list(request):
+    fields = api.parse_fields(request, api.LANGUAGE_FIELDS)
+    rows = Language.objects.order_by('name').values(
+        *api.columns(fields, api.LANGUAGE_FIELDS))
+    return api.stream(api.serialize(row, fields, api.LANGUAGE_FIELDS)
+                      for row in rows)
+
+
+@api_view
+def language_detail(request, slug):
+    fields = api.parse_fields(request, api.LANGUAGE_FIELDS)
+    row = Language.objects.filter(slug=slug).values(
+        *api.columns(fields, api.LANGUAGE_FIELDS)).first()
+    if row is None:
+        return api.error("No Language matches the given query.", status=404)
+    return JsonResponse(api.serialize(row, fields, api.LANGUAGE_FIELDS))
+
+
+@api_view
+def user_bookmarks(request):
+    """ The current user's bookmarks, newest first. """
+    if not request.user.is_authenticated:
+        return api.error("Authentication required.", status=403)
+    fields = api.parse_fields(
+        request, api.SNIPPET_FIELDS, api.SNIPPET_LIST_FIELDS)
+    paginator = KeysetPaginator(
+        Bookmark.objects.filter(user=request.user).values(*api.columns(
+            fields, api.SNIPPET_FIELDS, prefix='snippet__',
+            extra=['id', 'date'])),
+        ordering=('-date', '-id'))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return api.error("Invalid cursor.")
+    results = (
+        {'date': row['date'], 'snippet': snippet}
+        for row, snippet in zip(
+            page, api.serialize_snippets(page, fields, 'snippet__')))
+    return api.stream(results, **api.page_links(request, page))
+
+
+def _ranked(request, board, queryset, available, default=None):
+    """ Stream a leaderboard as {"score", "object"} pairs, best first. """
+    fields = api.parse_fields(request, available, default)
+    ranked = leaderboards.ranked_ids(board, _window(request))
+    rows = {row['id']: row for row in queryset.filter(
+        pk__in=[object_id for object_id, _ in ranked]).values(
+        *api.columns(fields, available, extra=['id']))}
+    ranked = [(score, rows[object_id]) for object_id, score in ranked
+              if object_id in rows]
+    if available is api.SNIPPET_FIELDS:
+        objects = api.serialize_snippets([row for _, row in ranked], fields)
+    else:
+        objects = (api.serialize(row, fields, available) for _, row in ranked)
+    return api.stream({'score': score, 'object': obj}
+                      for (score, _), obj in zip(ranked, objects))
+
+
+@api_view
+def top_authors(request):
+    return _ranked(request, LeaderboardEntry.BOARD_AUTHORS,
+                   get_user_model().objects.all(), api.USER_FIELDS)
+
+
+@api_view
+def top_languages(request):
+    return _ranked(request, LeaderboardEntry.BOARD_LANGUAGES,
+                   Language.objects.all(), api.LANGUAGE_FIELDS)
+
+
+@api_view
+def most_bookmarked(request):
+    return _ranked(request, LeaderboardEntry.BOARD_BOOKMARKED,
+                   Snippet.objects.all(), api.SNIPPET_FIELDS,
+                   api.SNIPPET_LIST_FIELDS)
+
+
+@api_view
+def top_rated(request):
+    """ Snippets by Wilson score, or by hot score with ``?ranking=hot``. """
+    ranking = request.GET.get('ranking', 'wilson')
+    if ranking not in ORDERINGS:
+        return api.error(f"ranking must be one of {', '.join(ORDERINGS)}.")
+    return _snippet_page(request, Snippet.objects.all(), ORDERINGS[ranking])
+
+
+@api_view
+def top_tags(request):
+    fields = api.parse_fields(request, api.TAG_FIELDS)
+    rows = Tag.objects.top_tags()[:leaderboards.LEADERBOARD_SIZE].values(
+        *api.columns(fields, api.TAG_FIELDS))
+    return api.stream(api.serialize(row, fields, api.TAG_FIELDS)
+                      for row in rows)
@@ -0,0 +1,76 @@
+"""
+Async variants of the high-volume read views: snippet detail, download and
+raw, and the feeds. With ``SNIPPETS_ASYNC_VIEWS`` on they replace the sync
+views in the URLconf; serve the project through ``django_snippets.asgi``.
+
+Django 4.0 has no async ORM yet, so the queries and template rendering run
+in a thread through ``sync_to_async``: one hop to load the validators,
+which alone settles a conditional GET, and one more to build a full
+response. Between those hops, and while the body goes out to the client,
+the request holds no thread at all.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from . import snippets
+
+ASYNC_VIEWS = getattr(settings, 'SNIPPETS_ASYNC_VIEWS', False)
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """ django.views.decorators.http.condition() for async views. """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            def validators():
+                etag = etag_func and etag_func(request, *args, **kwargs)
+                last_modified = last_modified_func and last_modified_func(
+                    request, *args, **kwargs)
+                return (quote_etag(etag) if etag else None,
+                        int(last_modified.timestamp())
+                        if last_modified else None)
+
+            etag, last_modified = await sync_to_async(validators)()
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header(
+                        'Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(
+                        last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+@async_condition(etag_func=snippets._detail_etag)
+async def snippet_detail(request, snippet_id):
+    return await sync_to_async(snippets.detail_response)(request, snippet_id)
+
+
+@async_condition(etag_func=snippets._code_etag,
+                 last_modified_func=snippets._last_modified)
+async def snippet_download(request, snippet_id):
+    return await sync_to_async(snippets.download_response)(
+        request, snippet_id)
+
+
+@async_condition(etag_func=snippets._code_etag,
+                 last_modified_func=snippets._last_modified)
+async def snippet_raw(request, snippet_id):
+    return await sync_to_async(snippets.raw_response)(request, snippet_id)
+
+
+def feed(feed_view):
+    """ Wrap a CachedFeed instance as an async view. """
+    async def view(request, *args, **kwargs):
+        return await sync_to_async(feed_view)(request, *args, **kwargs)
+    return view
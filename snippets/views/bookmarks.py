@@ -3,25 +3,20 @@ from django.contrib import messages
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 
+from ..managers import LISTING_DEFERRED
 from ..models import Bookmark, Snippet
+from ..pagination import KeysetPaginator
 
 
 @login_required
 def add_bookmark(request, snippet_id):
     """
     Function to let a user add a snippet to his bookmark.
-    Checks whether the user already has a bookmark to this
-    snippet, otherwise creates one.
+    The bookmark is inserted unless the user already has one to this
+    snippet, in a single statement, so repeated clicks can't duplicate it.
     """
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
-    try:
-        Bookmark.objects.get(
-            user__pk=request.user.id,
-            snippet__pk=snippet.id)
-    except Bookmark.DoesNotExist:
-        bookmark = Bookmark.objects.create(
-            user=request.user,
-            snippet=snippet)
+    snippet = get_object_or_404(Snippet.objects.only('pk'), pk=snippet_id)
+    Bookmark.objects.add(snippet.id, request.user.id)
     messages.success(request, 'You have bookmarked this snippet')
     return HttpResponseRedirect(snippet.get_absolute_url())
 
@@ -34,6 +29,8 @@ def delete_bookmark(request, snippet_id):
     """
     snippet = get_object_or_404(Snippet, pk=snippet_id)
     if request.method == 'POST':
+        # The snippet's bookmark count follows through the post_delete
+        # signal
         Bookmark.objects.filter(
             user__pk=request.user.id,
             snippet__pk=snippet.id).delete()
@@ -46,8 +43,13 @@ def delete_bookmark(request, snippet_id):
 
 
 def user_bookmarks(request):
-    """ List the current user's bookmarks """
-    bookmarks = Bookmark.objects.filter(user__pk=request.user.id)
+    """ List the current user's bookmarks, newest first """
+    paginator = KeysetPaginator(
+        Bookmark.objects.filter(user__pk=request.user.id).select_related(
+            'snippet__author', 'snippet__language').defer(
+            *('snippet__' + field for field in LISTING_DEFERRED)),
+        ordering=('-date', '-id'))
+    bookmarks = paginator.get_page(request.GET.get('cursor'))
 
     template_name = 'bookmarks/user_bookmarks.html'
     context = {'bookmarks': bookmarks}
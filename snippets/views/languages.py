@@ -1,6 +1,8 @@
 from django.shortcuts import render, get_object_or_404
 
+from .. import pagecache
 from ..models import Language
+from ..pagination import KeysetPaginator, approximate_count
 
 
 def language_list(request):
@@ -12,10 +14,17 @@ def language_list(request):
     return render(request, template_name, context)
 
 
+@pagecache.cache_anonymous(pagecache.language_scope)
 def language_detail(request, slug):
     language = get_object_or_404(Language, slug=slug)
+    paginator = KeysetPaginator(language.snippet_set.listing())
 
     template_name = 'languages/detail.html'
-    context = {'language': language}
+    context = {
+        'language': language,
+        'snippet_list': paginator.get_page(request.GET.get('cursor')),
+        'snippet_count': approximate_count(
+            f'language:{language.pk}', language.snippet_set.all()),
+    }
 
     return render(request, template_name, context)
@@ -1,53 +1,86 @@
 from django.shortcuts import render
 
-from ..models import Snippet, Language
+from .. import pagecache
+from ..leaderboards import LEADERBOARD_SIZE
+from ..models import LeaderboardEntry, Snippet, Language, Tag
+from ..pagination import KeysetPaginator
+from ..ranking import ORDERINGS
 
 
+def _window(request):
+    """ The leaderboard window (in days, 0 for all time) asked for. """
+    try:
+        window = int(request.GET.get('window', LeaderboardEntry.WINDOW_ALL))
+    except ValueError:
+        return LeaderboardEntry.WINDOW_ALL
+    if window not in dict(LeaderboardEntry.WINDOW_CHOICES):
+        return LeaderboardEntry.WINDOW_ALL
+    return window
+
+
+def _window_context(window):
+    return {'window': window, 'windows': LeaderboardEntry.WINDOW_CHOICES}
+
+
+@pagecache.cache_anonymous(pagecache.POPULAR)
 def top_authors(request):
     """ A view to list out the top authors. """
-    top_authors = Snippet.objects.top_authors()
+    window = _window(request)
+    top_authors = Snippet.objects.top_authors(window)
 
     template_name = 'popular/top_authors.html'
-    context = {'top_authors': top_authors}
+    context = {'top_authors': top_authors, **_window_context(window)}
 
     return render(request, template_name, context)
 
 
+@pagecache.cache_anonymous(pagecache.POPULAR)
 def top_languages(request):
     """ A view to list out the top languages """
-    top_languages = Language.objects.top_languages()
+    window = _window(request)
+    top_languages = Language.objects.top_languages(window)
 
     template_name = 'popular/top_languages.html'
-    context = {'top_languages': top_languages}
+    context = {'top_languages': top_languages, **_window_context(window)}
 
     return render(request, template_name, context)
 
 
+@pagecache.cache_anonymous(pagecache.POPULAR)
 def most_bookmarked(request):
     """ A view to list out the most bookmarked snippets by users. """
-    bookmarks = Snippet.objects.most_bookmarked()
+    window = _window(request)
+    bookmarks = Snippet.objects.most_bookmarked(window)
 
     template_name = 'popular/most_bookmarked.html'
-    context = {'bookmarks': bookmarks}
+    context = {'bookmarks': bookmarks, **_window_context(window)}
+
+    return render(request, template_name, context)
+
+
+@pagecache.cache_anonymous(pagecache.POPULAR)
+def top_rated(request, ranking='wilson'):
+    """
+    A view to list out the top-rated snippets, by Wilson score or, with
+    ranking='hot', by hot score (see snippets.ranking).
+    """
+    paginator = KeysetPaginator(
+        Snippet.objects.listing(),
+        ordering=ORDERINGS[ranking])
+    snippet_list = paginator.get_page(request.GET.get('cursor'))
+
+    template_name = 'popular/top_rated.html'
+    context = {'snippet_list': snippet_list, 'ranking': ranking}
 
     return render(request, template_name, context)
 
 
-# def top_tags(request):
-#    writing a view that lists tags ordered by the number of snippets that use them
-#     return object_list(
-#         request,
-#         queryset=Snippet.objects.top_tags(),
-#         template_name='cab/tag_list.html',
-#         paginate_by=20,
-#     )
-
-
-# def top_rated(request):
-#     queryset = Snippet.objects.top_rated()
-#     return month_object_list(
-#         request,
-#         queryset=queryset,
-#         template_name='cab/top_rated.html',
-#         paginate_by=20,
-#     )
+@pagecache.cache_anonymous(pagecache.POPULAR)
+def top_tags(request):
+    """ A view to list out the tags used by the most snippets. """
+    top_tags = Tag.objects.top_tags()[:LEADERBOARD_SIZE]
+
+    template_name = 'popular/top_tags.html'
+    context = {'top_tags': top_tags}
+
+    return render(request, template_name, context)
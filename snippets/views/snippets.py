@@ -1,15 +1,29 @@
+import difflib
+import hashlib
+import re
+
 from django.contrib import messages
+from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.core.mail import mail_admins
-from django.http import (HttpResponse, HttpResponseForbidden,
+from django.http import (Http404, HttpResponse, HttpResponseForbidden,
                          HttpResponseRedirect)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
 
 from snippets.forms import SnippetFlagForm, SnippetForm
-from snippets.models import Rating, Snippet, SnippetFlag
+from snippets import (compression, highlighting, pagecache, related,
+                      revisions, tokens)
+from snippets import search as snippet_search
+from snippets.models import (Language, Rating, Snippet, SnippetFlag,
+                             SnippetRevision)
+from snippets.pagination import KeysetPaginator, approximate_count
 
 
+@pagecache.cache_anonymous(pagecache.LIST)
 def snippet_list(request):
     """
     Returns a snippet list page.
@@ -17,41 +31,251 @@ def snippet_list(request):
     Template: ``snippets/snippet_list.html``
     Context:
         snippet_list
-            Snippet object list
+            KeysetPage of Snippet objects, newest first
+        snippet_count
+            Approximate number of snippets posted, cached
     """
-    snippet_list = Snippet.objects.all()
+    paginator = KeysetPaginator(Snippet.objects.listing())
+    snippet_list = paginator.get_page(request.GET.get('cursor'))
 
     template_name = 'snippets/snippet_list.html'
-    context = {'snippet_list': snippet_list}
+    context = {
+        'snippet_list': snippet_list,
+        'snippet_count': approximate_count('snippets', Snippet.objects.all()),
+    }
 
     return render(request, template_name, context)
 
 
-def snippet_detail(request, snippet_id):
-    snippet_detail = get_object_or_404(Snippet, pk=snippet_id)
+def search(request):
+    """
+    Returns the snippets matching a full-text query, best match first.
+
+    Template: ``snippets/search.html``
+    Context:
+        query
+            The search terms, from ``?q=``
+        language
+            Language the results are restricted to (``?language=<slug>``)
+        author
+            User the results are restricted to (``?author=<username>``)
+        snippet_list
+            Matching Snippet objects ranked by relevance
+    """
+    query = request.GET.get('q', '').strip()
+    language = author = None
+    if request.GET.get('language'):
+        language = get_object_or_404(Language, slug=request.GET['language'])
+    if request.GET.get('author'):
+        author = get_object_or_404(
+            get_user_model(), username=request.GET['author'])
+    snippet_list = []
+    if query:
+        snippet_list = snippet_search.search(
+            query, language=language, author=author)
+
+    template_name = 'snippets/search.html'
+    context = {
+        'query': query,
+        'language': language,
+        'author': author,
+        'snippet_list': snippet_list,
+    }
+
+    return render(request, template_name, context)
+
+
+def _validators(request, snippet_id):
+    """
+    Load the columns conditional GETs are decided on, without the code or
+    its HTML, once per request.
+    """
+    if not hasattr(request, '_snippet_validators'):
+        request._snippet_validators = Snippet.objects.filter(
+            pk=snippet_id).values(
+            'updated_date', 'code_hash', 'language_id', 'render_status',
+            'render_version', 'score', 'rating_count',
+            'bookmark_count').first()
+    return request._snippet_validators
+
+
+def _code_etag(request, snippet_id):
+    validators = _validators(request, snippet_id)
+    if validators is None:
+        return None
+    etag = '%(code_hash)s-%(language_id)s' % validators
+    variant = _variant(request)
+    if variant:
+        # Each format and line range of the raw view is its own entity
+        etag += '-' + hashlib.md5(repr(variant).encode()).hexdigest()
+    else:
+        # So is each content-coding _code_response() sends the code in;
+        # code sent as it is has one ETag whatever the client accepts
+        encoding, body, _ = _encoded_body(request, snippet_id)
+        if body:
+            etag += '-' + encoding
+    return etag
+
+
+def _last_modified(request, snippet_id):
+    validators = _validators(request, snippet_id)
+    return validators and validators['updated_date']
+
+
+def _detail_etag(request, snippet_id):
+    # The page also shows the counters, the render state and the viewer's
+    # own tools, none of which move updated_date.
+    validators = _validators(request, snippet_id)
+    if validators is None:
+        return None
+    # Nor do the messages of an action redirecting back here, which a 304
+    # would drop; len() reads them without marking them shown
+    if len(messages.get_messages(request)):
+        return None
+    material = [str(value) for value in validators.values()]
+    material.append(str(request.user.pk))
+    return hashlib.md5('|'.join(material).encode()).hexdigest()
+
+
+def _encoded_body(request, snippet_id):
+    """
+    Decide, once per request, how the snippet's code is sent: returns the
+    (encoding, compressed body, code) to use. The body is the cached one,
+    or compressed now when the client accepts an encoding and the code is
+    PRECOMPRESS_MIN_SIZE characters or more; it is None when the code is
+    sent as it is. The code is None unless it had to be read to decide.
+    """
+    if not hasattr(request, '_snippet_body'):
+        encoding = compression.accepted_encoding(request)
+        body = code = None
+        if encoding:
+            code_hash = _validators(request, snippet_id)['code_hash']
+            body = compression.get_compressed(code_hash, encoding)
+            if body is None:
+                code = Snippet.objects.filter(pk=snippet_id).values_list(
+                    'code', flat=True).first()
+                if code is not None and \
+                        len(code) >= compression.PRECOMPRESS_MIN_SIZE:
+                    body = compression.compress(code, code_hash, encoding)
+        request._snippet_body = encoding, body, code
+    return request._snippet_body
+
+
+def _code_response(request, snippet_id, content_type=None):
+    """
+    Build a response carrying the snippet's code, compressed from the
+    cache when the client accepts it and the code is large enough.
+    """
+    encoding, body, code = _encoded_body(request, snippet_id)
+    snippet = get_object_or_404(
+        Snippet.objects.select_related('language').only(
+            'language', 'language__mime_type', 'language__file_extension',
+            *(() if body or code is not None else ('code',))),
+        pk=snippet_id)
+    if body:
+        response = HttpResponse(body, content_type=content_type)
+        response['Content-Encoding'] = encoding
+    else:
+        response = HttpResponse(
+            snippet.code if code is None else code,
+            content_type=content_type)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return snippet, response
+
+
+@pagecache.cache_anonymous(pagecache.snippet_scope)
+def detail_response(request, snippet_id):
+    snippet_detail = get_object_or_404(
+        Snippet.objects.select_related('author', 'language').with_text(),
+        pk=snippet_id)
 
     template_name = 'snippets/detail.html'
-    context = {'snippet': snippet_detail}
+    context = {
+        'snippet': snippet_detail,
+        # Only looked up when the cached fragment showing them is stale
+        'related_snippets': SimpleLazyObject(
+            lambda: related.related_to(snippet_detail.pk)),
+        'generation': pagecache.fragment_generation(
+            pagecache.snippet_scope(snippet_detail.pk)),
+        'cache_timeout': pagecache.PAGE_CACHE_TIMEOUT,
+    }
 
     return render(request, template_name, context)
 
 
-def snippet_download(request, snippet_id):
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
-    response = HttpResponse(snippet.code, content_type='text/plain')
+def download_response(request, snippet_id):
+    if _validators(request, snippet_id) is None:
+        raise Http404('No Snippet matches the given query.')
+    snippet, response = _code_response(request, snippet_id)
     response['Content-Disposition'] = 'attachment; filename=%s.%s' % \
         (snippet.id, snippet.language.file_extension)
     response['Content-Type'] = snippet.language.mime_type
     return response
 
 
-def snippet_raw(request, snippet_id):
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
-    response = HttpResponse(snippet.code, content_type='text/plain')
+_LINES_RE = re.compile(r'^(\d+)(?:-(\d+))?$')
+
+
+def _variant(request):
+    """
+    The (format, first line, last line) the raw view is asked for with
+    ``?format=`` (see snippets.tokens.CONTENT_TYPES) and ``?lines=a-b``,
+    or None for the plain code. Unknown formats and malformed ranges are
+    ignored.
+    """
+    fmt = request.GET.get('format')
+    if fmt not in tokens.CONTENT_TYPES:
+        fmt = None
+    first = last = None
+    match = _LINES_RE.match(request.GET.get('lines', ''))
+    if match:
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if not 1 <= first <= last:
+            first = last = None
+    if fmt is None and first is None:
+        return None
+    return fmt or 'text', first, last
+
+
+def _formatted_response(request, snippet_id, variant):
+    """ Render the code in another format, or some of its lines, from its
+    stored token stream. """
+    fmt, first, last = variant
+    snippet = get_object_or_404(
+        Snippet.objects.select_related('language').only(
+            'code', 'code_hash', 'language__language_code'), pk=snippet_id)
+    stream = tokens.tokens_of(snippet)
+    if first is not None:
+        stream = tokens.select_lines(stream, first, last)
+    return HttpResponse(tokens.render(stream, fmt, first or 1),
+                        content_type=tokens.CONTENT_TYPES[fmt])
+
+
+def raw_response(request, snippet_id):
+    if _validators(request, snippet_id) is None:
+        raise Http404('No Snippet matches the given query.')
+    variant = _variant(request)
+    if variant:
+        response = _formatted_response(request, snippet_id, variant)
+        response['Content-Disposition'] = 'inline'
+        return response
+    snippet, response = _code_response(
+        request, snippet_id, content_type='text/plain')
     response['Content-Disposition'] = 'inline'
     return response
 
 
+# The response builders are shared with the async variants of these views
+# in snippets.views.asynchronous.
+snippet_detail = condition(etag_func=_detail_etag)(detail_response)
+snippet_download = condition(
+    etag_func=_code_etag, last_modified_func=_last_modified)(
+    download_response)
+snippet_raw = condition(
+    etag_func=_code_etag, last_modified_func=_last_modified)(raw_response)
+
+
 @login_required
 def snippet_add(request):
     """
@@ -70,6 +294,7 @@ def snippet_add(request):
             snippet = form.save(commit=False)
             snippet.author = request.user
             snippet.save()
+            form.save_m2m()
             messages.success(
                 request, 'Your snippet has been successfully saved')
             return HttpResponseRedirect(snippet.get_absolute_url())
@@ -84,7 +309,7 @@ def snippet_add(request):
 
 @login_required
 def snippet_edit(request, snippet_id):
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
+    snippet = get_object_or_404(Snippet.objects.with_text(), pk=snippet_id)
     if request.user.id != snippet.author.id or not request.user.is_active:
         return HttpResponseForbidden()
     if request.method == 'POST':
@@ -103,21 +328,88 @@ def snippet_edit(request, snippet_id):
     return render(request, template_name, context)
 
 
+def snippet_history(request, snippet_id):
+    """
+    Returns the list of a snippet's saved versions, newest first.
+
+    Template: ``snippets/history.html``
+    Context:
+        snippet
+            The Snippet
+        revision_list
+            Its SnippetRevision objects, without their data
+    """
+    snippet = get_object_or_404(
+        Snippet.objects.only('title', 'author_id'), pk=snippet_id)
+
+    template_name = 'snippets/history.html'
+    context = {
+        'snippet': snippet,
+        'revision_list': snippet.revisions.defer('data'),
+    }
+
+    return render(request, template_name, context)
+
+
+def snippet_revision(request, snippet_id, number):
+    """
+    Returns one version of a snippet's code, and its changes from the
+    version before.
+
+    Template: ``snippets/revision.html``
+    Context:
+        snippet
+            The Snippet
+        revision
+            The SnippetRevision, without its data
+        highlighted_code
+            The code as of the revision, highlighted
+        highlighted_diff
+            Unified diff from the previous revision, highlighted; empty for
+            the first
+    """
+    snippet = get_object_or_404(
+        Snippet.objects.select_related('language').only(
+            'title', 'language__language_code'), pk=snippet_id)
+    revision = get_object_or_404(
+        snippet.revisions.defer('data'), number=number)
+    try:
+        *previous, code = revisions.codes_between(
+            snippet.pk, max(number - 1, 1), number)
+    except SnippetRevision.DoesNotExist:
+        raise Http404('This revision can no longer be rebuilt.')
+    language_code = snippet.language.language_code
+    highlighted_diff = ''
+    if previous:
+        # Old versions are seldom viewed; they are rendered afresh rather
+        # than crowding current code out of the highlight cache
+        highlighted_diff = highlighting.render(''.join(
+            difflib.unified_diff(
+                previous[0].splitlines(keepends=True),
+                code.splitlines(keepends=True),
+                f'revision {number - 1}', f'revision {number}')), 'diff')
+
+    template_name = 'snippets/revision.html'
+    context = {
+        'snippet': snippet,
+        'revision': revision,
+        'highlighted_code': highlighting.render(code, language_code),
+        'highlighted_diff': highlighted_diff,
+    }
+
+    return render(request, template_name, context)
+
+
 @login_required
 def snippet_rate(request, snippet_id):
-    snippet = get_object_or_404(Snippet, pk=snippet_id)
+    snippet = get_object_or_404(Snippet.objects.only('pk'), pk=snippet_id)
     # Verify the acceptable query string is present or redirect back if not
     if 'rating' not in request.GET or request.GET['rating'] not in ('1', '-1'):
         return HttpResponseRedirect(snippet.get_absolute_url())
-    # Change the existing value of a rating if one is found
-    try:
-        rating = Rating.objects.get(
-            user__pk=request.user.id, snippet__pk=snippet.id)
-    except Rating.DoesNotExist:
-        rating = Rating(user=request.user, snippet=snippet)
-        rating.rating = int(request.GET['rating'])
-        rating.save()
-        return HttpResponseRedirect(snippet.get_absolute_url())
+    # Insert the rating, or change the existing value if one is found
+    Rating.objects.rate(
+        snippet.id, request.user.id, int(request.GET['rating']))
+    return HttpResponseRedirect(snippet.get_absolute_url())
 
 
 @login_required
@@ -157,20 +449,3 @@ def snippet_flag(request, snippet_id):
 #         template_name='cab/user_detail.html',
 #         extra_context={'author': user},
 #     )
-
-# def search(request):
-#     query = request.GET.get('q')
-#     snippet_qs = Snippet.objects.none()
-#     if query:
-#         snippet_qs = Snippet.objects.filter(
-#             Q(title__icontains=query) |
-#             Q(tags__in=[query]) |
-#             Q(author__username__iexact=query)
-#         ).distinct().order_by('-rating_score', '-pub_date')
-
-#     return snippet_list(
-#         request,
-#         queryset=snippet_qs,
-#         template_name='search/search.html',
-#         extra_context={'query': query},
-#     )
@@ -0,0 +1,42 @@
+from django.http import Http404
+from django.shortcuts import render
+
+from ..models import Snippet, Tag
+from ..pagination import KeysetPaginator, approximate_count
+
+
+def tag_detail(request, names):
+    """
+    Returns the snippets carrying every one of the ``+``-separated tags in
+    the URL, e.g. ``/tags/python+async/``.
+
+    Template: ``tags/detail.html``
+    Context:
+        tags
+            The Tag objects asked for
+        snippet_list
+            KeysetPage of the matching Snippet objects, newest first
+        snippet_count
+            Number of matching snippets, approximate for several tags
+    """
+    names = set(names.split('+'))
+    tags = list(Tag.objects.filter(name__in=names))
+    if not tags or len(tags) != len(names):
+        raise Http404('No Tag matches the given query.')
+    if len(tags) == 1:
+        snippets = Snippet.objects.filter(tags=tags[0])
+        snippet_count = tags[0].snippet_count
+    else:
+        snippets = Snippet.objects.tagged(tags)
+        snippet_count = approximate_count(
+            'tags:' + '+'.join(sorted(names)), snippets)
+    paginator = KeysetPaginator(snippets.listing())
+
+    template_name = 'tags/detail.html'
+    context = {
+        'tags': tags,
+        'snippet_list': paginator.get_page(request.GET.get('cursor')),
+        'snippet_count': snippet_count,
+    }
+
+    return render(request, template_name, context)